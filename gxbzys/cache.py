@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+
+class DecryptedBlockCache:
+    """
+    解密后数据块的LRU缓存，按占用的内存限制大小，线程安全
+
+    被固定（pin）的数据块不会被淘汰，适合保存mpv探测文件时反复读取的第一个和最后一个数据块。
+    同一个文件的多个视频流共用缓存，预读的数据块被任何一个视频流读取后，预读线程就不会再移除它
+
+    :param max_size: 缓存占用内存的上限（字节），固定的数据块也计算在内
+    :param pin_first_last: 为`True`时，打开视频流后固定第一个和最后一个数据块
+    """
+
+    def __init__(self, max_size: int = 32 * 1024 * 1024, pin_first_last: bool = True):
+        self.max_size = max_size
+        self.pin_first_last = pin_first_last
+        self.size = 0  #: 当前缓存的字节数
+        self.hits = 0  #: 命中次数
+        self.misses = 0  #: 未命中次数
+        self.evictions = 0  #: 淘汰的数据块数量
+        self._blocks: OrderedDict = OrderedDict()  #: 未固定的数据块，按最近使用排序
+        self._pinned_blocks: Dict[int, bytes] = {}  #: 固定的数据块
+        self._pinned: Set[int] = set()
+        self._unread: Set[int] = set()  #: 预读以后还没有被读取的数据块
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks) + len(self._pinned_blocks)
+
+    def __contains__(self, idx: int) -> bool:
+        with self._lock:
+            return idx in self._blocks or idx in self._pinned_blocks
+
+    def get(self, idx: int) -> Optional[bytes]:
+        """获取数据块，不存在时返回`None`"""
+        with self._lock:
+            data = self._pinned_blocks.get(idx)
+            if data is None:
+                data = self._blocks.get(idx)
+                if data is not None:
+                    self._blocks.move_to_end(idx)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._unread.discard(idx)
+            return data
+
+    def put(self, idx: int, data: bytes, prefetched: bool = False):
+        """
+        加入数据块，超出内存上限时淘汰最久未使用的数据块
+        :param prefetched: 为`True`时表示预读的数据块，读取之前可以用`discard_unread`移除
+        """
+        with self._lock:
+            if prefetched and idx not in self._pinned:
+                self._unread.add(idx)
+            else:
+                self._unread.discard(idx)
+            if idx in self._pinned:
+                if idx not in self._pinned_blocks:
+                    self._pinned_blocks[idx] = data
+                    self.size += len(data)
+                    self._evict()
+                return
+            old_data = self._blocks.pop(idx, None)
+            if old_data is not None:
+                self.size -= len(old_data)
+            self._blocks[idx] = data
+            self.size += len(data)
+            self._evict()
+
+    def discard(self, idx: int):
+        """移除未固定的数据块"""
+        with self._lock:
+            self._remove(idx)
+
+    def discard_unread(self, idx: int) -> bool:
+        """
+        移除预读以后还没有被读取的数据块，已经被读取过的数据块（可能是其他视频流读取的）保留
+        :return 移除时返回`True`
+        """
+        with self._lock:
+            if idx not in self._unread:
+                return False
+            self._remove(idx)
+            return True
+
+    def _remove(self, idx: int):
+        self._unread.discard(idx)
+        data = self._blocks.pop(idx, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def pin(self, idx: int):
+        """固定数据块，固定以后数据块不会被淘汰，可以在数据块加入缓存之前调用"""
+        with self._lock:
+            self._pinned.add(idx)
+            self._unread.discard(idx)
+            data = self._blocks.pop(idx, None)
+            if data is not None:
+                self._pinned_blocks[idx] = data
+
+    def unpin(self, idx: int):
+        """取消固定数据块，数据块保留在缓存中，按LRU规则淘汰"""
+        with self._lock:
+            self._pinned.discard(idx)
+            data = self._pinned_blocks.pop(idx, None)
+            if data is not None:
+                self._blocks[idx] = data
+                self._evict()
+
+    def clear(self):
+        """清空缓存，保留固定设置和命中统计"""
+        with self._lock:
+            self._blocks.clear()
+            self._pinned_blocks.clear()
+            self._unread.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计，用于调整缓存大小"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'evictions': self.evictions,
+                'blocks': len(self._blocks) + len(self._pinned_blocks),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._blocks) > 0:
+            idx, data = self._blocks.popitem(last=False)
+            self._unread.discard(idx)
+            self.size -= len(data)
+            self.evictions += 1
+
+    def __repr__(self):
+        return f'DecryptedBlockCache({self.stats()})'
@@ -1,13 +1,17 @@
+import logging
 import threading
 from typing import Callable
 import os
 
 from PySide6 import QtGui
 from PySide6.QtCore import Qt
-from PySide6.QtWidgets import QProgressDialog, QMessageBox
+from PySide6.QtWidgets import QProgressDialog, QMessageBox, QCheckBox
 
 import keymanager.dialogs as dialog
-from gxbzys.video import VideoHead, VideoInfo, write_encrypt_video, VideoStream
+from gxbzys.pipeline import StagedPipeline
+from gxbzys.trickplay import TrickplayGenerator
+from gxbzys.video import VideoHead, VideoInfo, write_encrypt_video, decrypt_video, verify_encrypt_video, \
+    INFO_FORMAT_COMPACT
 from keymanager.encryptor import encrypt_data, not_encrypt_data
 
 import time
@@ -53,6 +57,17 @@ class EncryptFileDialog(dialog.EncryptFileDialog):
         super().__init__(parent, win_title, before_process, processor, success_msg, select_file_dlg_filter,
                          select_file_dlg_title, select_output_dir_title)
         self.label.setText('视频')
+        # 默认与原来的格式相同，新功能需要手动选择
+        self.align_check_box = QCheckBox('在关键帧处分块（跳转时解密更少数据）', self)
+        self.seek_index_check_box = QCheckBox('保存关键帧跳转索引', self)
+        self.envelope_check_box = QCheckBox('使用密钥槽，可以更换密钥（旧版本无法打开）', self)
+        self.compact_info_check_box = QCheckBox('紧凑的视频信息格式（旧版本无法打开）', self)
+        # 需要安装PyAV和Pillow
+        self.trickplay_check_box = QCheckBox('生成预览缩略图', self)
+        self.trickplay_check_box.setEnabled(TrickplayGenerator.is_available())
+        for check_box in (self.align_check_box, self.seek_index_check_box, self.envelope_check_box,
+                          self.compact_info_check_box, self.trickplay_check_box):
+            self.layout().addWidget(check_box)
 
     def showEvent(self, a0: QtGui.QShowEvent) -> None:
         super().showEvent(a0)
@@ -87,7 +102,9 @@ class EncryptFileDialog(dialog.EncryptFileDialog):
                     _, input_file_name = os.path.split(file_path)
                     output_file = os.path.join(self.output_dir_path, input_file_name)
 
-                    head: VideoHead = VideoHead.from_raw_file(input_file)
+                    # 在关键帧处分块时跳转只需要解密一个数据块
+                    head: VideoHead = VideoHead.from_raw_file(input_file,
+                                                              align_keyframes=self.align_check_box.isChecked())
                     video_info = VideoInfo()
                     video_info.add_info('name'.encode('utf-8'), input_file_name.encode('utf-8'))
 
@@ -99,39 +116,31 @@ class EncryptFileDialog(dialog.EncryptFileDialog):
                         pd.setValue(index * 100 + percent/2)
                         pd.setLabelText(f'正在处理：{(index+1)} / {file_cnt} 当前文件：{percent/2}%')
 
-                    write_encrypt_video(self.key.key, head, [video_info], reader, writer, videowritehook=updater)
+                    trickplay = None
+                    if self.trickplay_check_box.isChecked():
+                        trickplay = TrickplayGenerator(input_file)
+
+                    # 读取、加密、写入同时进行，预览缩略图在后台线程中同时生成
+                    pipeline = StagedPipeline()
+                    write_encrypt_video(self.key.key, head, [video_info], reader, writer, videowritehook=updater,
+                                        workers=os.cpu_count() or 1, pipeline=pipeline, digest=True, key_check=True,
+                                        envelope=self.envelope_check_box.isChecked(),
+                                        seek_index=self.seek_index_check_box.isChecked(), trickplay=trickplay,
+                                        info_format=INFO_FORMAT_COMPACT
+                                        if self.compact_info_check_box.isChecked() else None)
+                    logging.getLogger('EncryptFileDialog').info(f'{input_file_name}\n{pipeline.report()}')
                     writer.close()
                     reader.close()
 
-                    #校验文件
-                    bufsize = 8 * 1024
-                    file_size = os.stat(output_file).st_size
-                    readed_size = 0
-                    verify_result = True
-                    fp1 = VideoStream(output_file, self.key.key)
-                    fp2 = open(input_file, 'rb')
-                    fp1.open()
-
-                    try:
-                        while True:
-                            b1 = fp1.read(bufsize)
-                            b2 = fp2.read(bufsize)
-                            readed_size += len(b1)
-                            if b1 != b2:
-                                QMessageBox.critical(pd, '处理失败', f'文件{input_file_name}校验失败')
-                                verify_result = False
-                                break
-                            if not b2:
-                                verify_result = True
-                                break
-
-                            pd.setLabelText(f'正在处理：{(index + 1)} / {file_cnt} 当前文件：{50 + round((readed_size/file_size)*50)}%')
-                            pd.setValue(index * 100 + 50 + (readed_size/file_size)*50)
-                    finally:
-                        fp2.close()
-                        fp1.close()
+                    # 使用加密时计算的摘要校验文件，不需要再读取原始文件
+                    def verify_updater(i, length):
+                        percent = int((i + 1) / length * 100)
+                        pd.setValue(index * 100 + 50 + percent / 2)
+                        pd.setLabelText(f'正在处理：{(index + 1)} / {file_cnt} 当前文件：{50 + percent / 2}%')
 
+                    verify_result = verify_encrypt_video(self.key.key, output_file, videoverifyhook=verify_updater)
                     if not verify_result:
+                        QMessageBox.critical(pd, '处理失败', f'文件{input_file_name}校验失败')
                         break
 
 
@@ -189,24 +198,15 @@ class DecryptFileDialog(dialog.EncryptFileDialog):
                     _, input_file_name = os.path.split(file_path)
                     output_file = os.path.join(self.output_dir_path, input_file_name)
 
-                    reader = VideoStream(input_file, self.key.key)
-                    reader.open()
-                    file_size = reader.head.raw_file_size
-
-                    writer = open(output_file, 'wb')
-                    write_size = 0
-                    while True:
-                        data = reader.read(1024*1024)
-                        if len(data) == 0:
-                            break
-                        writer.write(data)
-                        write_size += len(data)
-                        percent = int((write_size + 1) / file_size * 100)
+                    def updater(i, length):
+                        percent = int((i + 1) / length * 100)
                         pd.setValue(index * 100 + percent)
                         pd.setLabelText(f'正在处理：{(index + 1)} / {file_cnt} 当前文件：{percent}%')
 
-                    writer.close()
-                    reader.close()
+                    # 多个线程同时解密，按顺序写入
+                    with open(output_file, 'wb') as writer:
+                        decrypt_video(self.key.key, input_file, writer, workers=os.cpu_count() or 1,
+                                      videodecrypthook=updater)
 
             if not pd.wasCanceled():
                 QMessageBox.information(pd, '处理完成', self.success_msg)
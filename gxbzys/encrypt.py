@@ -0,0 +1,42 @@
+"""
+从标准输入读取原始数据，加密后写入标准输出，输出流不需要支持`seek`
+
+    python -m gxbzys.encrypt 密钥文件 < 原始文件 > 加密文件
+"""
+import argparse
+import sys
+
+from gxbzys.video import BLOCK_SIZE, CIPHER_MODE_CBC, CIPHER_MODE_GCM, INFO_FORMAT_COMPACT, EncryptedVideoWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式加密标准输入')
+    parser.add_argument('key_file', help='密钥文件')
+    parser.add_argument('--gcm', action='store_true', help='使用AES-GCM加密，使用紧凑索引')
+    parser.add_argument('--envelope', action='store_true', help='使用随机生成的数据密钥加密')
+    parser.add_argument('--digest', action='store_true', help='保存原始数据的摘要')
+    parser.add_argument('--compact-info', action='store_true', help='使用紧凑的视频信息格式')
+    args = parser.parse_args()
+
+    with open(args.key_file, 'rb') as f:
+        key = f.read()
+
+    input_stream = sys.stdin.buffer
+    output_stream = sys.stdout.buffer
+    with EncryptedVideoWriter(key,
+                              output_stream,
+                              cipher_mode=CIPHER_MODE_GCM if args.gcm else CIPHER_MODE_CBC,
+                              envelope=args.envelope,
+                              key_check=True,
+                              digest=args.digest,
+                              compact=args.gcm,
+                              info_format=INFO_FORMAT_COMPACT if args.compact_info else None) as writer:
+        while True:
+            data = input_stream.read(BLOCK_SIZE)
+            if len(data) == 0:
+                break
+            writer.write(data)
+
+
+if __name__ == '__main__':
+    main()
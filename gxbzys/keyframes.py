@@ -0,0 +1,469 @@
+"""
+从MP4、MKV、MPEG-TS文件中找出关键帧（或cluster、fragment）在原始文件中的位置和时间，
+加密时用于对齐数据块的边界和生成跳转索引（`VideoSeekIndex`）
+
+只解析定位需要的结构，不解码视频数据：
+
+* MP4：`moov`中视频轨道的`stss`、`stsz`、`stsc`、`stco`/`co64`、`stts`，分片的MP4使用`moof`的位置和`tfdt`
+* MKV：`Cluster`的位置和`Timecode`
+* MPEG-TS：`random_access_indicator`为1且是PES开头的视频数据包的位置和PTS，只使用第一个视频PES所在的PID
+"""
+import logging
+import os
+import struct
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+
+class Keyframe:
+    """
+    原始文件中可以开始解码的位置
+    :param pos: 在原始文件中的位置
+    :param time: 时间（秒），未知时为`None`
+    """
+
+    def __init__(self, pos: int, time: Optional[float] = None):
+        self.pos = pos
+        self.time = time
+
+    def __repr__(self):
+        return f'Keyframe(pos={self.pos}, time={self.time})'
+
+    def __eq__(self, other):
+        return isinstance(other, Keyframe) and self.pos == other.pos and self.time == other.time
+
+
+def find_keyframes(file: Union[str, BinaryIO]) -> List[Keyframe]:
+    """
+    根据文件内容判断格式，找出关键帧
+    :param file: 原始文件路径或支持`seek`的输入流，输入流的位置不变
+    :return 按位置排序的关键帧，不支持的格式或解析失败时返回空列表
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as reader:
+            return find_keyframes(reader)
+    reader = file
+    pos = reader.tell()
+    try:
+        reader.seek(0)
+        head = reader.read(16)
+        if head[4:8] == b'ftyp':
+            keyframes = find_mp4_keyframes(reader)
+        elif head[:4] == EBML_MAGIC:
+            keyframes = find_mkv_keyframes(reader)
+        elif _is_ts(reader):
+            keyframes = find_ts_keyframes(reader)
+        else:
+            return []
+    except (struct.error, ValueError, EOFError, TypeError, IndexError) as e:
+        logging.getLogger('keyframes').warning(f'parse {getattr(reader, "name", "stream")} failed: {e}')
+        return []
+    finally:
+        reader.seek(pos)
+    keyframes.sort(key=lambda k: k.pos)
+    return keyframes
+
+
+def plan_block_boundaries(file_size: int,
+                          keyframes: List[Keyframe],
+                          block_size: int,
+                          tolerance: float = 0.25,
+                          max_block_size: int = None) -> List[int]:
+    """
+    根据关键帧的位置规划数据块的起始位置，在`block_size`附近的关键帧处分块，跳转到关键帧时只需要解密一个数据块
+    :param file_size: 原始文件大小
+    :param keyframes: 按位置排序的关键帧
+    :param block_size: 默认数据块大小
+    :param tolerance: 数据块大小可以偏离`block_size`的比例，附近没有关键帧时按`block_size`分块，
+        最后剩余的数据不超过上限时作为一个数据块
+    :param max_block_size: 数据块大小的上限
+    :return 所有数据块在原始文件中的起始位置，第一个为0
+    """
+    min_size = max(int(block_size * (1 - tolerance)), 1)
+    max_size = int(block_size * (1 + tolerance))
+    if max_block_size is not None:
+        max_size = min(max_size, max_block_size)
+        block_size = min(block_size, max_size)
+    positions = sorted({k.pos for k in keyframes if 0 < k.pos < file_size})
+
+    boundaries = [0]
+    i = 0
+    start = 0
+    while file_size - start > max_size:
+        target = start + block_size
+        # 跳过太近的关键帧
+        while i < len(positions) and positions[i] < start + min_size:
+            i += 1
+        best = None
+        j = i
+        while j < len(positions) and positions[j] <= start + max_size:
+            if best is None or abs(positions[j] - target) < abs(best - target):
+                best = positions[j]
+            j += 1
+        start = best if best is not None else target
+        boundaries.append(start)
+    return boundaries
+
+
+# ---------------------------------------------------------------- MP4
+
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'moof', b'traf', b'mvex', b'edts', b'dinf'}
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    """遍历内存中的box，返回类型、内容起始位置和结束位置"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise ValueError(f'invalid box size {size}')
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _read_top_boxes(reader: BinaryIO):
+    """遍历文件中的顶层box，返回类型、box起始位置、内容起始位置和box大小，不读取内容"""
+    file_size = reader.seek(0, os.SEEK_END)
+    pos = 0
+    while pos + 8 <= file_size:
+        reader.seek(pos)
+        size, box_type = struct.unpack('>I4s', reader.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', reader.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            raise ValueError(f'invalid box size {size}')
+        yield box_type, pos, pos + header_size, size
+        pos += size
+
+
+def _find_box(data: bytes, path: List[bytes], start: int = 0, end: int = None) -> Optional[Tuple[int, int]]:
+    for box_type, box_start, box_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return _find_box(data, path[1:], box_start, box_end)
+    return None
+
+
+def _full_box_entries(data: bytes, box: Optional[Tuple[int, int]], fmt: str, offset: int = 0) -> list:
+    """读取full box中的表，`offset`为entry_count之前除version和flags以外的字节数"""
+    if box is None:
+        return []
+    start, _ = box
+    count = struct.unpack_from('>I', data, start + 4 + offset)[0]
+    size = struct.calcsize('>' + fmt)
+    pos = start + 8 + offset
+    return [struct.unpack_from('>' + fmt, data, pos + i * size) for i in range(count)]
+
+
+def _parse_video_trak(data: bytes, start: int, end: int) -> Optional[Dict]:
+    hdlr = _find_box(data, [b'mdia', b'hdlr'], start, end)
+    if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+        return None
+    tkhd = _find_box(data, [b'tkhd'], start, end)
+    mdhd = _find_box(data, [b'mdia', b'mdhd'], start, end)
+    stbl = _find_box(data, [b'mdia', b'minf', b'stbl'], start, end)
+    if tkhd is None or mdhd is None or stbl is None:
+        return None
+    version = data[tkhd[0]]
+    track_id = struct.unpack_from('>I', data, tkhd[0] + (20 if version == 1 else 12))[0]
+    version = data[mdhd[0]]
+    timescale = struct.unpack_from('>I', data, mdhd[0] + (20 if version == 1 else 12))[0]
+    return {'track_id': track_id, 'timescale': timescale, 'stbl': stbl}
+
+
+def _sample_keyframes(data: bytes, stbl: Optional[Tuple[int, int]], timescale: int) -> List[Keyframe]:
+    if stbl is None:
+        return []
+    start, end = stbl
+    stss = _find_box(data, [b'stss'], start, end)
+    stsz = _find_box(data, [b'stsz'], start, end)
+    stsc = _full_box_entries(data, _find_box(data, [b'stsc'], start, end), 'III')
+    stts = _full_box_entries(data, _find_box(data, [b'stts'], start, end), 'II')
+    co64 = _find_box(data, [b'co64'], start, end)
+    if co64 is not None:
+        chunk_offsets = [e[0] for e in _full_box_entries(data, co64, 'Q')]
+    else:
+        chunk_offsets = [e[0] for e in _full_box_entries(data, _find_box(data, [b'stco'], start, end), 'I')]
+    if stsz is None or len(chunk_offsets) == 0:
+        return []
+
+    sample_size, sample_count = struct.unpack_from('>II', data, stsz[0] + 4)
+    if sample_size == 0:
+        sizes = struct.unpack_from(f'>{sample_count}I', data, stsz[0] + 12)
+    else:
+        sizes = [sample_size] * sample_count
+    sync_samples = None if stss is None else {e[0] for e in _full_box_entries(data, stss, 'I')}
+
+    # 每个样本的解码时间
+    times = []
+    t = 0
+    for count, delta in stts:
+        for _ in range(count):
+            times.append(t)
+            t += delta
+
+    keyframes = []
+    sample = 0
+    for run, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+        last_chunk = stsc[run + 1][0] - 1 if run + 1 < len(stsc) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            pos = chunk_offsets[chunk - 1]
+            for _ in range(samples_per_chunk):
+                if sample >= sample_count:
+                    break
+                # 样本序号从1开始
+                if sync_samples is None or sample + 1 in sync_samples:
+                    time = times[sample] / timescale if sample < len(times) and timescale > 0 else None
+                    keyframes.append(Keyframe(pos, time))
+                pos += sizes[sample]
+                sample += 1
+    return keyframes
+
+
+def find_mp4_keyframes(reader: BinaryIO) -> List[Keyframe]:
+    """MP4关键帧，分片的MP4（有`moof`）使用每个分片的起始位置"""
+    moov = None
+    moofs = []
+    for box_type, pos, content_start, size in _read_top_boxes(reader):
+        if box_type == b'moov':
+            reader.seek(pos)
+            moov = reader.read(size)
+        elif box_type == b'moof':
+            reader.seek(content_start)
+            moofs.append((pos, reader.read(size - (content_start - pos))))
+    if moov is None:
+        return []
+
+    tracks = []
+    for box_type, start, end in _iter_boxes(moov, 8):
+        if box_type == b'trak':
+            track = _parse_video_trak(moov, start, end)
+            if track is not None:
+                tracks.append(track)
+    if len(tracks) == 0:
+        return []
+    track = tracks[0]
+
+    if len(moofs) == 0:
+        return _sample_keyframes(moov, track['stbl'], track['timescale'])
+
+    keyframes = []
+    for pos, moof in moofs:
+        time = None
+        for box_type, start, end in _iter_boxes(moof):
+            if box_type != b'traf':
+                continue
+            tfhd = _find_box(moof, [b'tfhd'], start, end)
+            tfdt = _find_box(moof, [b'tfdt'], start, end)
+            if tfhd is None or tfdt is None:
+                continue
+            if struct.unpack_from('>I', moof, tfhd[0] + 4)[0] != track['track_id']:
+                continue
+            if moof[tfdt[0]] == 1:
+                decode_time = struct.unpack_from('>Q', moof, tfdt[0] + 4)[0]
+            else:
+                decode_time = struct.unpack_from('>I', moof, tfdt[0] + 4)[0]
+            time = decode_time / track['timescale'] if track['timescale'] > 0 else None
+        keyframes.append(Keyframe(pos, time))
+    return keyframes
+
+
+# ---------------------------------------------------------------- MKV
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_CLUSTER = 0x1F43B675
+_MKV_CLUSTER_TIMECODE = 0xE7
+#: Segment下的顶层元素，大小未知的Cluster遇到这些元素时结束
+_MKV_SEGMENT_CHILDREN = {0x114D9B74, _MKV_INFO, 0x1654AE6B, _MKV_CLUSTER, 0x1C53BB6B, 0x1941A469, 0x1043A770,
+                         0x1254C367}
+
+
+def _read_vint(reader: BinaryIO, keep_marker: bool) -> Tuple[int, int, bool]:
+    """读取EBML变长整数，返回数值、占用字节数和是否为未知大小"""
+    first = reader.read(1)
+    if len(first) == 0:
+        raise EOFError()
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not b & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('invalid ebml vint')
+    rest = reader.read(length - 1)
+    if len(rest) != length - 1:
+        raise EOFError()
+    value = b if keep_marker else b & (mask - 1)
+    for c in rest:
+        value = (value << 8) | c
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _read_element_header(reader: BinaryIO) -> Tuple[int, int, Optional[int]]:
+    """读取元素ID和大小，返回ID、头部长度和内容大小（未知时为`None`）"""
+    element_id, id_len, _ = _read_vint(reader, True)
+    size, size_len, unknown = _read_vint(reader, False)
+    return element_id, id_len + size_len, None if unknown else size
+
+
+def find_mkv_keyframes(reader: BinaryIO) -> List[Keyframe]:
+    """MKV中每个Cluster的起始位置和时间"""
+    file_size = reader.seek(0, os.SEEK_END)
+    reader.seek(0)
+    timecode_scale = 1000000
+    keyframes = []
+
+    # EBML头
+    _, header_len, size = _read_element_header(reader)
+    if size is None:
+        return []
+    pos = header_len + size
+    reader.seek(pos)
+    element_id, header_len, size = _read_element_header(reader)
+    if element_id != _MKV_SEGMENT:
+        return []
+    segment_end = file_size if size is None else min(pos + header_len + size, file_size)
+    pos += header_len
+
+    while pos < segment_end:
+        reader.seek(pos)
+        try:
+            element_id, header_len, size = _read_element_header(reader)
+        except EOFError:
+            break
+        content_start = pos + header_len
+        if element_id == _MKV_INFO and size is not None:
+            info = reader.read(size)
+            timecode_scale = _find_mkv_uint(info, _MKV_TIMECODE_SCALE, timecode_scale)
+        if element_id == _MKV_CLUSTER:
+            timecode, cluster_end = _read_mkv_cluster(reader, content_start, size, segment_end)
+            time = None if timecode is None else timecode * timecode_scale / 1e9
+            keyframes.append(Keyframe(pos, time))
+            pos = cluster_end
+            continue
+        if size is None:
+            break
+        pos = content_start + size
+    return keyframes
+
+
+def _read_mkv_cluster(reader: BinaryIO, start: int, size: Optional[int], segment_end: int) -> Tuple[Optional[int], int]:
+    """读取Cluster的Timecode，返回Timecode和Cluster的结束位置"""
+    end = segment_end if size is None else start + size
+    timecode = None
+    pos = start
+    while pos < end:
+        reader.seek(pos)
+        try:
+            element_id, header_len, child_size = _read_element_header(reader)
+        except EOFError:
+            return timecode, segment_end
+        if size is None and element_id in _MKV_SEGMENT_CHILDREN:
+            return timecode, pos
+        if element_id == _MKV_CLUSTER_TIMECODE:
+            timecode = int.from_bytes(reader.read(child_size), byteorder='big')
+            if size is not None:
+                return timecode, end
+        if child_size is None:
+            break
+        pos += header_len + child_size
+    return timecode, end
+
+
+def _find_mkv_uint(data: bytes, target_id: int, default: int) -> int:
+    from io import BytesIO
+    reader = BytesIO(data)
+    while reader.tell() < len(data):
+        try:
+            element_id, _, size = _read_element_header(reader)
+        except EOFError:
+            break
+        if size is None:
+            break
+        value = reader.read(size)
+        if element_id == target_id:
+            return int.from_bytes(value, byteorder='big')
+    return default
+
+
+# ---------------------------------------------------------------- MPEG-TS
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+_TS_READ_SIZE = TS_PACKET_SIZE * 8192
+
+
+def _is_ts(reader: BinaryIO) -> bool:
+    reader.seek(0)
+    data = reader.read(TS_PACKET_SIZE * 4)
+    return len(data) >= TS_PACKET_SIZE and all(b == TS_SYNC_BYTE for b in data[::TS_PACKET_SIZE])
+
+
+def _is_video_pes(packet: bytes, payload_start: int) -> bool:
+    pes = packet[payload_start:payload_start + 4]
+    return len(pes) == 4 and pes[:3] == b'\x00\x00\x01' and 0xE0 <= pes[3] <= 0xEF
+
+
+def _parse_pes_pts(packet: bytes, payload_start: int) -> Optional[float]:
+    pes = packet[payload_start:]
+    if len(pes) < 14 or not _is_video_pes(packet, payload_start):
+        return None
+    if not pes[7] & 0x80:
+        return None
+    p = pes[9:14]
+    pts = ((p[0] >> 1) & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15 | p[3] << 7 | p[4] >> 1
+    return pts / 90000
+
+
+def find_ts_keyframes(reader: BinaryIO) -> List[Keyframe]:
+    """
+    MPEG-TS中`random_access_indicator`为1的视频PES的起始位置和PTS，
+    音频等其他流也会设置`random_access_indicator`，只使用第一个视频PES（stream_id为0xE0-0xEF）所在的PID
+    """
+    keyframes = []
+    video_pid = None
+    reader.seek(0)
+    offset = 0
+    while True:
+        data = reader.read(_TS_READ_SIZE)
+        if len(data) < TS_PACKET_SIZE:
+            break
+        # 先按字节筛选：PES开头的数据包
+        for i, b1 in enumerate(data[1::TS_PACKET_SIZE]):
+            if not b1 & 0x40:
+                continue
+            pos = i * TS_PACKET_SIZE
+            packet = data[pos:pos + TS_PACKET_SIZE]
+            if len(packet) < TS_PACKET_SIZE or packet[0] != TS_SYNC_BYTE:
+                continue
+            pid = (b1 & 0x1F) << 8 | packet[2]
+            b3 = packet[3]
+            has_af = b3 & 0x20
+            payload_start = 5 + packet[4] if has_af else 4
+            if video_pid is None:
+                if not b3 & 0x10 or not _is_video_pes(packet, payload_start):
+                    continue
+                video_pid = pid
+            if pid != video_pid or not has_af or packet[4] == 0 or not packet[5] & 0x40:
+                continue
+            time = _parse_pes_pts(packet, payload_start) if b3 & 0x10 else None
+            keyframes.append(Keyframe(offset + pos, time))
+        offset += len(data) - len(data) % TS_PACKET_SIZE
+        reader.seek(offset)
+    return keyframes
@@ -1624,8 +1624,7 @@ class MPV(object):
 
                 def read_backend(_userdata, buf, bufsize):
                     data = frontend.read(bufsize)
-                    for i in range(len(data)):
-                        buf[i] = data[i]
+                    memmove(buf, data, len(data))
                     return len(data)
 
                 cb_info.contents.cookie = None
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_END = object()  #: 阶段结束的标记
+
+
+class _Failure:
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class StageStats:
+    """
+    流水线阶段的耗时统计，用于判断哪个阶段（设备）是瓶颈
+    :param name: 阶段名字
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy_time = 0.0  #: 处理数据的时间
+        self.idle_time = 0.0  #: 等待上一个阶段数据的时间
+        self.blocked_time = 0.0  #: 等待下一个阶段空出队列的时间
+        self.items = 0  #: 处理的数据数量
+
+    def __repr__(self):
+        return f'{self.name}: busy {self.busy_time:.3f}s, idle {self.idle_time:.3f}s, ' \
+               f'blocked {self.blocked_time:.3f}s, items {self.items}'
+
+
+class _QueueIterator:
+
+    def __init__(self, pipeline, input_queue: queue.Queue, stats: StageStats):
+        self.pipeline = pipeline
+        self.input_queue = input_queue
+        self.stats = stats
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        item = self.pipeline._get(self.input_queue)
+        self.stats.idle_time += time.perf_counter() - start
+        if item is _END:
+            raise StopIteration
+        if isinstance(item, _Failure):
+            raise item.error
+        return item
+
+
+class StagedPipeline:
+    """
+    多阶段流水线，除最后一个阶段以外每个阶段一个线程，阶段之间通过有界队列传递数据，
+    上一个阶段处理速度快时会阻塞等待，占用的内存有上限
+
+    每个阶段是一个函数，参数是上一个阶段输出数据的迭代器（第一个阶段为`None`），返回本阶段输出数据的迭代器。
+    最后一个阶段在调用`run`的线程中执行，即遍历`run`返回的迭代器
+
+    :param queue_size: 阶段之间队列的长度
+    :param sink_name: 最后一个阶段的名字
+    """
+
+    def __init__(self, queue_size: int = 4, sink_name: str = 'write'):
+        self.queue_size = queue_size
+        self.sink_name = sink_name
+        self.stages: List[Tuple[str, Callable[[Optional[Iterator]], Iterable], int]] = []
+        self.stats: Dict[str, StageStats] = {}
+        self._stop = threading.Event()
+
+    def add_stage(self, name: str, func: Callable[[Optional[Iterator]], Iterable], queue_size: int = None):
+        """
+        添加一个阶段
+        :param name: 阶段名字
+        :param func: 阶段处理函数
+        :param queue_size: 本阶段输出队列的长度，默认为`queue_size`
+        """
+        self.stages.append((name, func, queue_size or self.queue_size))
+        self.stats[name] = StageStats(name)
+
+    def run(self) -> Iterator:
+        """启动所有阶段，返回最后一个阶段的输入数据"""
+        self._stop.clear()
+        sink_stats = self.stats[self.sink_name] = StageStats(self.sink_name)
+        threads = []
+        input_queue = None
+        for name, func, queue_size in self.stages:
+            output_queue = queue.Queue(queue_size)
+            thread = threading.Thread(target=self._run_stage,
+                                      args=(name, func, input_queue, output_queue),
+                                      name=f'pipeline-{name}',
+                                      daemon=True)
+            threads.append(thread)
+            input_queue = output_queue
+
+        for thread in threads:
+            thread.start()
+        try:
+            for item in _QueueIterator(self, input_queue, sink_stats):
+                start = time.perf_counter()
+                yield item
+                sink_stats.busy_time += time.perf_counter() - start
+                sink_stats.items += 1
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self) -> str:
+        """各阶段的耗时统计，busy时间最长的阶段是瓶颈"""
+        lines = [repr(stats) for stats in self.stats.values()]
+        if len(self.stats) > 0:
+            bottleneck = max(self.stats.values(), key=lambda s: s.busy_time)
+            lines.append(f'bottleneck: {bottleneck.name}')
+        return '\n'.join(lines)
+
+    def _run_stage(self, name, func, input_queue, output_queue):
+        stats = self.stats[name]
+        try:
+            inputs = None if input_queue is None else _QueueIterator(self, input_queue, stats)
+            iterator = iter(func(inputs))
+            while True:
+                start = time.perf_counter()
+                idle_time = stats.idle_time
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.busy_time += time.perf_counter() - start - (stats.idle_time - idle_time)
+                stats.items += 1
+                self._put(output_queue, item, stats)
+            self._put(output_queue, _END, stats)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            try:
+                self._put(output_queue, _Failure(e), stats)
+            except PipelineStopped:
+                pass
+
+    def _put(self, output_queue: queue.Queue, item, stats: StageStats):
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                output_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        stats.blocked_time += time.perf_counter() - start
+
+    def _get(self, input_queue: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
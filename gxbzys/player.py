@@ -94,6 +94,8 @@ class SMPVPlayer(QObject):
                 msg = '没有加载默认的密钥'
             elif e.crypto_type == CryptoType.timeout:
                 msg = '默认密钥已经超时，需重新加载'
+            elif e.crypto_type == CryptoType.wrongkey:
+                msg = '密钥与文件不匹配，请加载加密文件使用的密钥'
             else:
                 msg = '未知错误:' + str(e.crypto_type)
             QMessageBox.critical(None, '错误', msg)
@@ -637,7 +639,7 @@ class SMPVPlayer(QObject):
                                 self.player.playlist_pos = i_in_mpv
                                 try:
                                     self.player.wait_until_playing()
-                                    self.player.command('seek', f.time_pos, 'absolute')
+                                    self.player.seek(f.time_pos, 'absolute')
                                 except Exception as e:
                                     print(str(e))
                                 found = True
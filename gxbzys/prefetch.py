@@ -0,0 +1,167 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional, Set, Tuple
+
+from gxbzys.cache import DecryptedBlockCache
+
+
+class BlockPrefetcher:
+    """
+    后台预读解密线程，保持当前读取位置之后的若干数据块已经解密并放入缓存
+
+    预读深度根据读取速度调整，保证能预读`lookahead_time`秒内会读到的数据块，
+    例如2倍速播放时读取速度翻倍，预读深度也随之翻倍。读取位置跳转（seek）时，
+    正在进行的和已经预读但还没有读取的数据块都会被丢弃，缓存被多个视频流共用时，
+    其他视频流已经读取的数据块保留在缓存中，按LRU规则淘汰
+
+    :param load_block: 读取并解密数据块的函数，参数为数据块序号，必须是线程安全的
+    :param block_cache: 保存预读结果的缓存
+    :param block_num: 数据块数量
+    :param max_depth: 最大预读深度（数据块数量）
+    :param min_depth: 最小预读深度（数据块数量）
+    :param lookahead_time: 预读多少秒内会读到的数据
+    """
+
+    def __init__(self,
+                 load_block: Callable[[int], bytes],
+                 block_cache: DecryptedBlockCache,
+                 block_num: int,
+                 max_depth: int = 8,
+                 min_depth: int = 2,
+                 lookahead_time: float = 1.0):
+        self.load_block = load_block
+        self.block_cache = block_cache
+        self.block_num = block_num
+        self.max_depth = max_depth
+        self.min_depth = min(min_depth, max_depth)
+        self.lookahead_time = lookahead_time
+        self.depth = self.min_depth  #: 当前预读深度
+        self.read_rate = 0.0  #: 读取速度（数据块/秒）
+        self.prefetched = 0  #: 预读的数据块数量
+        self.discarded = 0  #: 因为跳转丢弃的数据块数量
+
+        self._current = -1
+        self._last_time: Optional[float] = None
+        self._generation = 0
+        self._prefetched: Set[int] = set()  #: 已经预读但还没有读取的数据块
+        self._requested: Deque[int] = deque()  #: 请求优先预读的数据块
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger('BlockPrefetcher')
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='BlockPrefetcher', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.logger.debug(f'prefetched: {self.prefetched}, discarded: {self.discarded}, '
+                          f'depth: {self.depth}, read rate: {self.read_rate:.2f} blocks/s')
+
+    def update(self, idx: int):
+        """
+        通知当前正在读取的数据块，读取下一个数据块时更新读取速度，否则视为跳转
+        :param idx: 当前数据块序号
+        """
+        now = time.monotonic()
+        with self._cond:
+            if idx == self._current:
+                return
+            if idx == self._current + 1 and self._last_time is not None:
+                interval = max(now - self._last_time, 1e-6)
+                rate = 1 / interval
+                self.read_rate = rate if self.read_rate == 0 else self.read_rate * 0.7 + rate * 0.3
+                depth = math.ceil(self.read_rate * self.lookahead_time)
+                self.depth = max(self.min_depth, min(self.max_depth, depth))
+                self._prefetched = {i for i in self._prefetched if i > idx}
+            else:
+                self._discard()
+            self._current = idx
+            self._last_time = now
+            self._cond.notify_all()
+
+    def request(self, idx: int):
+        """
+        请求尽快预读指定的数据块，例如播放器即将跳转到的位置，优先于顺序预读，跳转时不会被丢弃
+        :param idx: 数据块序号
+        """
+        with self._cond:
+            if 0 <= idx < self.block_num and idx not in self._requested and idx not in self.block_cache:
+                self._requested.append(idx)
+                self._cond.notify_all()
+
+    def _discard(self):
+        """丢弃正在进行和已经预读的数据，只移除这个预读线程加入缓存并且还没有被读取的数据块"""
+        self._generation += 1
+        for i in self._prefetched:
+            if self.block_cache.discard_unread(i):
+                self.discarded += 1
+        self._prefetched.clear()
+        self.read_rate = 0.0
+        self.depth = self.min_depth
+
+    def _next_block(self) -> Optional[int]:
+        if self._current < 0:
+            return None
+        end = min(self._current + 1 + self.depth, self.block_num)
+        for idx in range(self._current + 1, end):
+            if idx not in self._prefetched and idx not in self.block_cache:
+                return idx
+        return None
+
+    def _next_task(self) -> Optional[Tuple[int, bool]]:
+        """返回下一个需要预读的数据块序号和是否是请求的数据块"""
+        while len(self._requested) > 0:
+            idx = self._requested.popleft()
+            if idx not in self.block_cache:
+                return idx, True
+        idx = self._next_block()
+        return None if idx is None else (idx, False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while not self._closed and task is None:
+                    self._cond.wait()
+                    task = self._next_task()
+                if self._closed:
+                    return
+                idx, requested = task
+                generation = self._generation
+                # 先标记，避免重复预读
+                if not requested:
+                    self._prefetched.add(idx)
+
+            try:
+                data = self.load_block(idx)
+            except Exception as e:
+                self.logger.warning(f'prefetch block {idx} failed: {e}')
+                if requested:
+                    continue
+                with self._cond:
+                    # 读取失败时等待下一次读取位置变化
+                    self._prefetched.discard(idx)
+                    while not self._closed and generation == self._generation and self._current < idx:
+                        self._cond.wait()
+                continue
+
+            with self._cond:
+                if requested:
+                    self.block_cache.put(idx, data)
+                    self.prefetched += 1
+                    continue
+                if generation != self._generation or idx not in self._prefetched:
+                    self.discarded += 1
+                    continue
+                self.block_cache.put(idx, data, prefetched=True)
+                self.prefetched += 1
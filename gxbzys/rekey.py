@@ -0,0 +1,68 @@
+"""
+批量修改目录中加密文件的授权密钥，只重写文件头
+
+    python -m gxbzys.rekey 目录 旧密钥文件 新密钥文件 [--keep-old]
+"""
+import argparse
+import logging
+import os
+from typing import Callable, List, Tuple
+
+from gxbzys.video import VideoDecryptException, VideoHead, update_video_keys
+
+
+def rewrap_directory(dir_path: str,
+                     key: bytes,
+                     new_key: bytes,
+                     remove_old: bool = True,
+                     hook: Callable[[str, bool], None] = None) -> Tuple[List[str], List[str]]:
+    """
+    修改目录（包括子目录）中所有使用数据密钥加密的文件的授权密钥
+    :param dir_path: 目录
+    :param key: 已经授权的用户密钥
+    :param new_key: 新的用户密钥
+    :param remove_old: 为`True`时取消`key`的授权，否则两个密钥都可以使用
+    :param hook: 处理一个文件后调用，参数为文件路径和是否成功
+    :return 修改成功和失败的文件列表，不是加密视频的文件不计入
+    """
+    logger = logging.getLogger('rekey')
+    succeeded = []
+    failed = []
+    for root, _, files in os.walk(dir_path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            if not VideoHead.is_encrypt_video(file_path):
+                continue
+            try:
+                update_video_keys(file_path, key, add_keys=[new_key], remove_keys=[key] if remove_old else [])
+                succeeded.append(file_path)
+            except (VideoDecryptException, OSError) as e:
+                logger.warning(f'{file_path}: {e}')
+                failed.append(file_path)
+            if hook is not None:
+                hook(file_path, failed[-1:] != [file_path])
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='修改加密文件的授权密钥')
+    parser.add_argument('dir', help='加密文件所在目录')
+    parser.add_argument('key_file', help='已经授权的密钥文件')
+    parser.add_argument('new_key_file', help='新的密钥文件')
+    parser.add_argument('--keep-old', action='store_true', help='保留旧密钥的授权')
+    args = parser.parse_args()
+
+    with open(args.key_file, 'rb') as f:
+        key = f.read()
+    with open(args.new_key_file, 'rb') as f:
+        new_key = f.read()
+
+    def hook(file_path, success):
+        print(f'{"ok" if success else "failed"}: {file_path}')
+
+    succeeded, failed = rewrap_directory(args.dir, key, new_key, not args.keep_old, hook)
+    print(f'succeeded: {len(succeeded)}, failed: {len(failed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import json
 import platform
 import time
+from ctypes import c_ubyte, addressof
 from math import isclose
 from enum import Enum
 from pathlib import Path
@@ -11,8 +12,9 @@ from PySide6.QtCore import QEvent, QObject
 from PySide6.QtWidgets import QApplication
 
 from gxbzys import mpv
-from gxbzys.mpv import MPV, StreamOpenFn, StreamReadFn, StreamCloseFn, StreamSeekFn, StreamSizeFn, register_protocol
-from gxbzys.video import VideoStream
+from gxbzys.mpv import MPV, StreamOpenFn, StreamReadFn, StreamCloseFn, StreamSeekFn, StreamSizeFn, register_protocol, \
+    ErrorCode
+from gxbzys.video import VideoStream, VIDEO_FILE_REGISTRY, KeyRing, VideoDecryptException
 from keymanager.key import KEY_CACHE
 
 
@@ -21,6 +23,9 @@ class EmptyStream:
     def read(self, length):
         return ''
 
+    def readinto(self, buffer):
+        return 0
+
     def seek(self, pos):
         return 0
 
@@ -33,9 +38,14 @@ class EmptyStream:
     def open(self):
         pass
 
+    def prefetch_time(self, time):
+        return None
+
 
 class SMPV(MPV):
 
+    crypto_prefetch_depth = 8  #: 加密视频流后台预读解密的最大数据块数量，为0时不预读
+
     def __init__(self,
                  event_object: QObject = None,
                  *extra_mpv_flags,
@@ -48,7 +58,11 @@ class SMPV(MPV):
 
         self.register_crypto_protocol()
         self.opened_streams = {}
+        self._closed_streams = []
+        self.key_ring = KeyRing()  #: 使用过的密钥，播放列表中的文件可以使用不同的密钥
+        self._ring_keys = {}
         self.event_object: QObject = event_object
+        self.register_event_callback(self._seek_event_handler)
 
     def set_option(self, name, value):
         mpv._mpv_set_option_string(self.handle, name.encode('utf-8'), value.encode('utf-8'))
@@ -79,23 +93,69 @@ class SMPV(MPV):
             self.stream_open_filename = ''
             return EmptyStream()
 
-        stream = VideoStream(file_path, key.key)
+        self._update_key_ring(key)
+
+        # 同一个文件的多个视频流共用文件头、文件描述符和解密后数据块的缓存
+        stream = VideoStream(file_path,
+                             key.key,
+                             prefetch_depth=self.crypto_prefetch_depth,
+                             registry=VIDEO_FILE_REGISTRY,
+                             key_ring=self.key_ring)
         return stream
 
+    def prefetch_seek(self, time: float):
+        """
+        跳转前调用，根据加密视频中保存的关键帧跳转索引在后台预读目标数据块
+        :param time: 目标时间（秒）
+        """
+        for stream in list(self.opened_streams.values()):
+            stream.prefetch_time(time)
+
+    def _seek_event_handler(self, event):
+        """
+        mpv开始跳转时调用，包括快捷键、进度条和脚本发起的跳转。
+        跳转完成前`time-pos`是跳转的目标时间，demuxer读取数据前在后台预读
+        """
+        if event['event_id'] != mpv.MpvEventID.SEEK:
+            return
+        target = self.time_pos
+        if target is not None:
+            self.prefetch_seek(max(target, 0))
+
+    def _update_key_ring(self, cur_key):
+        """记住当前密钥，移除已经超时的密钥"""
+        self._ring_keys[cur_key.key] = cur_key
+        for k in list(self._ring_keys.values()):
+            if k.timeout:
+                self._ring_keys.pop(k.key)
+                self.key_ring.remove(k.key)
+        self.key_ring.add(cur_key.key)
+
     def register_crypto_protocol(self):
         @StreamOpenFn
         def _open(_userdata, uri, cb_info):
+            # 上次关闭的流的回调函数已经执行完毕，可以释放
+            self._closed_streams.clear()
             stream = self._crypto_stream_open(uri.decode('utf-8'))
-            stream.open()
+            try:
+                stream.open()
+            except VideoDecryptException:
+                # 密钥错误时立即失败，不让mpv探测解密错误的数据
+                if self.event_object is not None:
+                    event = MpvCryptoEvent(CryptoType.wrongkey, MpvEventType.MpvCryptoEventType.value)
+                    QApplication.instance().postEvent(self.event_object, event)
+                return ErrorCode.LOADING_FAILED
 
             def read(_userdata, buf, bufsize):
-                data = stream.read(bufsize)
-                for i in range(len(data)):
-                    buf[i] = data[i]
-                return len(data)
+                # 直接解密到mpv提供的缓冲区中
+                view = (c_ubyte * bufsize).from_address(addressof(buf.contents))
+                return stream.readinto(view)
 
             def close(_userdata):
                 stream.close()
+                # 回调函数还在执行，暂时保留引用，下次打开时释放
+                self.opened_streams.pop(id(stream), None)
+                self._closed_streams.append(stream)
 
             def seek(_userdata, offset):
                 return stream.seek(offset)
@@ -110,8 +170,8 @@ class SMPV(MPV):
             _size = cb_info.contents.size = StreamSizeFn(size)
 
             stream._mpv_callbacks_ = [_read, _close, _seek, _size]
-            # TODO 流关闭时移除opened_streams的value
-            self.opened_streams[uri.decode('utf-8')] = stream
+            # 同一个uri可能同时打开多次，按流保存
+            self.opened_streams[id(stream)] = stream
 
             return 0
 
@@ -130,6 +190,7 @@ class MpvEventType(Enum):
 class CryptoType(Enum):
     timeout = 0
     nokey = 1
+    wrongkey = 2
 
 
 class MpvCryptoEvent(QEvent):
@@ -0,0 +1,193 @@
+"""
+加密时生成预览缩略图（trickplay）拼图
+
+需要安装PyAV（`av`）和Pillow，没有安装时`TrickplayGenerator.enabled`为`False`，加密时不生成缩略图
+"""
+import logging
+import math
+import threading
+from io import BytesIO
+from typing import List, Optional
+
+from gxbzys.video import TrickplayIndex, VideoInfo, INFO_TRICKPLAY_INDEX, INFO_TRICKPLAY_SHEET
+
+try:
+    import av
+    from PIL import Image
+except ImportError:
+    av = None
+    Image = None
+
+TILE_BITS_PER_PIXEL = 3  #: 每张缩略图预留的JPEG数据大小（每个像素的位数），拼图超过预留大小时降低质量
+JPEG_HEADER_SIZE = 1024  #: 每张拼图额外预留给JPEG文件头和量化表、哈夫曼表的字节数
+
+
+class TrickplayGenerator:
+    """
+    在后台线程中按固定间隔解码视频帧，生成缩略图拼图，用于`write_encrypt_video`的`trickplay`参数
+
+    缩略图的数量由视频时长决定，拼图按预留的大小保存，加密数据块之前就可以写入长度相同的占位数据，
+    数据块写入后再写入缩略图，解码与加密同时进行
+
+    :param input_file: 原始视频文件路径
+    :param interval: 缩略图间隔（秒）
+    :param tile_width: 缩略图宽度，高度按视频宽高比计算
+    :param columns: 每张拼图的列数
+    :param rows: 每张拼图的行数
+    :param quality: JPEG质量
+    """
+
+    def __init__(self,
+                 input_file: str,
+                 interval: float = 10.0,
+                 tile_width: int = 160,
+                 columns: int = 10,
+                 rows: int = 10,
+                 quality: int = 75):
+        self.input_file = input_file
+        self.quality = quality
+        self.index: Optional[TrickplayIndex] = None
+        self._tile_num = 0
+        self._tiles = []
+        self._infos: Optional[List[VideoInfo]] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger('TrickplayGenerator')
+        self._probe(interval, tile_width, columns, rows)
+
+    @staticmethod
+    def is_available() -> bool:
+        """是否安装了PyAV和Pillow"""
+        return av is not None and Image is not None
+
+    @property
+    def enabled(self) -> bool:
+        """原始文件可以生成缩略图"""
+        return self.index is not None
+
+    def _probe(self, interval: float, tile_width: int, columns: int, rows: int):
+        if not self.is_available():
+            return
+        try:
+            with av.open(self.input_file) as container:
+                stream = container.streams.video[0]
+                width, height = stream.codec_context.width, stream.codec_context.height
+                if container.duration is not None:
+                    duration = container.duration / av.time_base
+                else:
+                    duration = float(stream.duration * stream.time_base)
+        except Exception as e:
+            self.logger.info(f'{self.input_file} not supported: {e}')
+            return
+        if width <= 0 or height <= 0 or duration <= 0:
+            return
+        tile_height = max(2, round(tile_width * height / width / 2) * 2)
+        self.index = TrickplayIndex(int(interval * 1000), tile_width, tile_height, columns, rows)
+        self._tile_num = max(1, math.ceil(duration / interval))
+
+    def get_sheet_size(self, sheet: int) -> int:
+        """第`sheet`张拼图预留的字节数"""
+        tiles = min(self.index.tiles_per_sheet, self._tile_num - sheet * self.index.tiles_per_sheet)
+        return tiles * self.index.tile_width * self.index.tile_height * TILE_BITS_PER_PIXEL // 8 + JPEG_HEADER_SIZE
+
+    @staticmethod
+    def _create_infos(index_bytes: bytes, sheets: List[bytes]) -> List[VideoInfo]:
+        index_info = VideoInfo()
+        index_info.add_info(INFO_TRICKPLAY_INDEX, index_bytes)
+        infos = [index_info]
+        for sheet in sheets:
+            sheet_info = VideoInfo()
+            sheet_info.add_info(INFO_TRICKPLAY_SHEET, sheet)
+            infos.append(sheet_info)
+        return infos
+
+    def create_placeholder_infos(self) -> List[VideoInfo]:
+        """与生成结果长度相同的占位视频信息"""
+        sheet_num = (self._tile_num + self.index.tiles_per_sheet - 1) // self.index.tiles_per_sheet
+        index_len = TrickplayIndex.get_bytes_len(self._tile_num, sheet_num)
+        return self._create_infos(bytes(index_len), [bytes(self.get_sheet_size(i)) for i in range(sheet_num)])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._generate, name='TrickplayGenerator', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止生成"""
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _generate(self):
+        interval = self.index.interval / 1000
+        size = (self.index.tile_width, self.index.tile_height)
+        try:
+            with av.open(self.input_file) as container:
+                stream = container.streams.video[0]
+                stream.thread_type = 'AUTO'
+                for i in range(self._tile_num):
+                    if self._closed:
+                        return
+                    # 从目标时间之前的关键帧开始解码，只解码一帧
+                    container.seek(int(i * interval / stream.time_base), stream=stream, backward=True)
+                    frame = next(container.decode(stream), None)
+                    if frame is None:
+                        break
+                    time = frame.time if frame.time is not None else i * interval
+                    self._tiles.append((int(max(time, 0) * 1000), frame.to_image().resize(size)))
+        except Exception as e:
+            self.logger.warning(f'generate thumbnails for {self.input_file} failed: {e}')
+
+    def _encode_sheet(self, sheet: int, tiles) -> bytes:
+        """拼接并压缩一张拼图，超过预留大小时降低质量，最低质量仍然超过时放弃这张拼图，返回空数据"""
+        index = self.index
+        image = Image.new('RGB', (index.tile_width * index.columns, index.tile_height * index.rows))
+        for n, tile in enumerate(tiles):
+            _, x, y, _, _ = index.get_tile_rect(sheet * index.tiles_per_sheet + n)
+            image.paste(tile, (x, y))
+        budget = self.get_sheet_size(sheet)
+        quality = self.quality
+        while True:
+            bos = BytesIO()
+            image.save(bos, format='JPEG', quality=quality)
+            data = bos.getvalue()
+            if len(data) <= budget or quality <= 10:
+                break
+            quality -= 15
+        if len(data) > budget:
+            # 预留的长度已经写入文件，不能增加，这张拼图的长度记为0，读取时没有缩略图
+            self.logger.error(f'thumbnail sheet {sheet} of {self.input_file} dropped: '
+                              f'{len(data)} bytes at quality {quality} > reserved {budget} bytes')
+            return b''
+        return data
+
+    def create_infos(self) -> List[VideoInfo]:
+        """等待生成结束，返回索引和拼图的视频信息，长度与`create_placeholder_infos`相同"""
+        if self._infos is not None:
+            return self._infos
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        index = TrickplayIndex(self.index.interval, self.index.tile_width, self.index.tile_height,
+                               self.index.columns, self.index.rows)
+        tiles = []
+        for i in range(self._tile_num):
+            if i < len(self._tiles):
+                time, tile = self._tiles[i]
+            else:
+                # 解码失败的位置使用空白缩略图
+                time, tile = index.interval * i, Image.new('RGB', (index.tile_width, index.tile_height))
+            # 时间必须递增
+            index.times.append(max(time, index.times[-1] if i > 0 else 0))
+            tiles.append(tile)
+
+        sheets = []
+        for sheet in range(index.sheet_num):
+            start = sheet * index.tiles_per_sheet
+            data = self._encode_sheet(sheet, tiles[start:start + index.tiles_per_sheet])
+            index.sheet_lengths.append(len(data))
+            sheets.append(data + bytes(self.get_sheet_size(sheet) - len(data)))
+        self.index = index
+        self._infos = self._create_infos(index.to_bytes(), sheets)
+        return self._infos
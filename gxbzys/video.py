@@ -1,19 +1,432 @@
+import hashlib
 import logging
+import mmap
 import os
-from typing import List, Union, Dict, Callable
-from io import BytesIO, FileIO
+import sys
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from typing import List, Union, Dict, Callable, Iterator, Optional
+from io import BytesIO, FileIO, RawIOBase, SEEK_SET, SEEK_CUR, SEEK_END
 from typing import TypeVar
 
-from typing import IO
+from typing import IO, Tuple
 
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+from Crypto.Util.strxor import strxor
 from keymanager.encryptor import encrypt_data1, decrypt_data1
 
+from gxbzys.cache import DecryptedBlockCache
+from gxbzys.keyframes import Keyframe, find_keyframes, plan_block_boundaries
+from gxbzys.pipeline import StagedPipeline
+from gxbzys.prefetch import BlockPrefetcher
+
 BLOCK_SIZE = 1024 * 1024
+MAX_BLOCK_SIZE = 256 ** 3 - 1 - 16  #: 数据块原始数据的最大字节数，加密后的大小需要能保存在3个字节中
 HEAD_FILE_MARKER = b'EV000001'
+HEAD_FILE_MARKER_V2 = b'EV000002'  #: 文件头中包含加密方式和扩展区
+HEAD_FILE_MARKERS = (HEAD_FILE_MARKER, HEAD_FILE_MARKER_V2)
+HEAD_FILE_MARKER_STREAM = b'EV000003'  #: 文件头在文件末尾（`EncryptedVideoWriter`），文件开头只有文件标记
+STREAM_FOOTER_SIZE_BYTES_LEN = 4  #: 文件末尾保存文件头长度的字节数，之后是文件标记
 EMPTY_IV = b'\0' * 16
 
+CIPHER_MODE_CBC = 0  #: AES-CBC，PKCS7填充，与EV000001相同
+CIPHER_MODE_GCM = 1  #: AES-GCM，可以按16字节解密数据块中的任意部分，每个数据块末尾附带16字节的认证标签
+
+GCM_NONCE_LEN = 12
+GCM_TAG_LEN = 16
+
+DIGEST_ALGORITHM = 'sha256'  #: 校验数据使用的摘要算法
+INFO_DIGEST_ALGORITHM = b'digest_algorithm'  #: 视频信息中摘要算法的名字
+INFO_BLOCK_DIGESTS = b'block_digests'  #: 视频信息中所有数据块原始数据摘要的名字
+INFO_FILE_DIGEST = b'file_digest'  #: 视频信息中原始文件摘要的名字
+INFO_SEEK_INDEX = b'seek_index'  #: 视频信息中关键帧跳转索引（`VideoSeekIndex`）的名字
+INFO_TRICKPLAY_INDEX = b'trickplay_index'  #: 视频信息中预览缩略图索引（`TrickplayIndex`）的名字
+INFO_TRICKPLAY_SHEET = b'trickplay_sheet'  #: 视频信息中预览缩略图拼图的名字
+
+HEAD_EXT_KEY_SLOTS = 1  #: 扩展数据类型，使用用户密钥加密的数据密钥
+KEY_SLOT_NUM = 4  #: 默认的密钥槽数量，预留空的密钥槽，增加密钥时文件头长度不变
+DATA_KEY_LEN = 32
+KEY_SLOT_SIZE = GCM_NONCE_LEN + DATA_KEY_LEN + GCM_TAG_LEN  #: 一个密钥槽占用的字节数，空的密钥槽全部为0
+
+HEAD_EXT_KEY_CHECK = 2  #: 扩展数据类型，用户密钥的标识和校验值，使用密钥槽时与密钥槽一一对应
+KEY_ID_LEN = 8
+KEY_CHECK_VALUE_LEN = 8
+KEY_CHECK_SIZE = KEY_ID_LEN + KEY_CHECK_VALUE_LEN  #: 一个密钥标识和校验值占用的字节数
+
+HEAD_EXT_DERIVED_INDEX = 3  #: 扩展数据类型，根据数据块序号计算数据块索引，文件头中不保存每个数据块的索引
+FILE_NONCE_LEN = 8  #: 文件nonce的字节数，数据块的nonce为文件nonce加4字节的数据块序号
+DERIVED_BLOCK_SIZE_BYTES_LEN = 4  #: 紧凑索引中数据块大小占用的字节数
+
+HEAD_EXT_INFO_FORMAT = 4  #: 扩展数据类型，视频信息的编码格式，1个字节，没有时为`INFO_FORMAT_PADDED`
+INFO_FORMAT_PADDED = 0  #: 名字补齐到1024字节，数据长度3个字节，每项数据最大16M
+INFO_FORMAT_LARGE = 1  #: 名字补齐到1024字节，数据长度8个字节
+INFO_FORMAT_COMPACT = 2  #: 开头是所有名字和数据长度的列表，名字前保存长度，之后是所有数据
+INFO_CHUNK_SIZE = 1024 * 1024  #: 分块序列化和加密视频信息时每次处理的字节数
+INFO_TABLE_READ_SIZE = 4096  #: 读取`INFO_FORMAT_COMPACT`名字表时第一次解密的字节数，不够时再增加
+
 VideoContentIndexType = TypeVar("VideoContentIndexType", bound="VideoContentIndex")
 VideoHeadType = TypeVar("VideoHeadType", bound="VideoHead")
+VideoBlockTableType = TypeVar("VideoBlockTableType", bound="VideoBlockTable")
+
+
+class VideoDecryptException(Exception):
+    pass
+
+
+def can_decrypt_block_range(cipher_mode: int) -> bool:
+    """加密方式是否支持只解密数据块中的一部分"""
+    return cipher_mode in (CIPHER_MODE_CBC, CIPHER_MODE_GCM)
+
+
+def get_block_range_window(cipher_mode: int, offset: int, length: int) -> Tuple[int, int]:
+    """
+    解密数据块中`[offset, offset + length)`的数据需要读取的加密数据范围
+    :param cipher_mode: 加密方式
+    :param offset: 原始数据在数据块中的起始位置
+    :param length: 原始数据长度
+    :return 加密数据在数据块中的起始和结束位置，起始位置按16字节对齐，
+        CBC需要多读取前一个16字节作为偏移向量，结束位置也要对齐
+    """
+    start = offset - offset % AES.block_size
+    end = offset + length
+    if cipher_mode == CIPHER_MODE_CBC:
+        end += -end % AES.block_size
+        if start > 0:
+            start -= AES.block_size
+    return start, end
+
+
+def get_key_id(key: bytes) -> bytes:
+    """用户密钥的标识，用于在多个密钥中查找文件使用的密钥"""
+    return hashlib.sha256(b'gxbzys key id' + key).digest()[:KEY_ID_LEN]
+
+
+def get_key_check_value(key: bytes) -> bytes:
+    """用户密钥的校验值，加密16个0后的前8个字节"""
+    return AES.new(key, AES.MODE_ECB).encrypt(EMPTY_IV)[:KEY_CHECK_VALUE_LEN]
+
+
+def get_key_check(key: bytes) -> bytes:
+    """保存在文件头中的密钥标识和校验值"""
+    return get_key_id(key) + get_key_check_value(key)
+
+
+def wrap_data_key(key: bytes, data_key: bytes) -> bytes:
+    """
+    使用用户密钥加密数据密钥
+    :param key: 用户密钥
+    :param data_key: 数据密钥
+    :return 密钥槽数据
+    """
+    nonce = os.urandom(GCM_NONCE_LEN)
+    enc_data, tag = AES.new(key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(data_key)
+    return nonce + enc_data + tag
+
+
+def unwrap_data_key(key: bytes, slot: bytes) -> Optional[bytes]:
+    """
+    使用用户密钥解密密钥槽中的数据密钥
+    :param key: 用户密钥
+    :param slot: 密钥槽数据
+    :return 数据密钥，密钥不匹配时返回`None`
+    """
+    nonce = slot[:GCM_NONCE_LEN]
+    enc_data = slot[GCM_NONCE_LEN:GCM_NONCE_LEN + DATA_KEY_LEN]
+    tag = slot[GCM_NONCE_LEN + DATA_KEY_LEN:KEY_SLOT_SIZE]
+    try:
+        return AES.new(key, AES.MODE_GCM, nonce=nonce).decrypt_and_verify(enc_data, tag)
+    except ValueError:
+        return None
+
+
+class StreamEncryptor:
+    """
+    分块加密一段数据，结果与使用`CipherEngine.encrypt`一次加密整段数据相同，
+    只保存不足16字节的剩余数据，内存占用与数据长度无关
+
+    :param key: 密钥
+    :param cipher_mode: 加密方式
+    """
+
+    def __init__(self, key: bytes, cipher_mode: int):
+        self.cipher_mode = cipher_mode
+        if cipher_mode == CIPHER_MODE_CBC:
+            self.iv = os.urandom(AES.block_size)  #: 偏移向量
+            self._cipher = AES.new(key, AES.MODE_CBC, iv=self.iv)
+        else:
+            nonce = os.urandom(GCM_NONCE_LEN)
+            self.iv = nonce.ljust(len(EMPTY_IV), b'\0')
+            self._cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        self._remain = b''
+
+    def update(self, data: bytes) -> bytes:
+        """加密一部分数据，返回已经可以输出的加密数据"""
+        if self.cipher_mode == CIPHER_MODE_GCM:
+            return self._cipher.encrypt(data)
+        data = self._remain + data
+        size = len(data) - len(data) % AES.block_size
+        self._remain = data[size:]
+        return self._cipher.encrypt(data[:size])
+
+    def finalize(self) -> bytes:
+        """返回剩余的加密数据，CBC为填充后的最后一块，GCM为认证标签"""
+        if self.cipher_mode == CIPHER_MODE_GCM:
+            return self._cipher.digest()
+        return self._cipher.encrypt(pad(self._remain, AES.block_size))
+
+
+class CipherEngine(ABC):
+    """
+    数据块加密引擎，保存一个密钥和加密方式，提供单个和批量的加解密接口
+
+    子类实现CBC的加解密，GCM和只解密部分数据直接使用pycryptodome。
+    使用`create_cipher_engine`创建第一次使用时选择的引擎，同一个密钥只创建一次，
+    `write_encrypt_video`、`VideoStream`、`VideoInfoReader`通过批量接口加解密
+
+    :param key: 密钥
+    :param cipher_mode: 加密方式，`CIPHER_MODE_CBC`或`CIPHER_MODE_GCM`
+    """
+
+    name = ''  #: 引擎名字，写入日志
+    releases_gil = False  #: 加解密时是否释放GIL，释放时批量接口使用多线程
+
+    def __init__(self, key: bytes, cipher_mode: int = CIPHER_MODE_CBC):
+        if cipher_mode not in (CIPHER_MODE_CBC, CIPHER_MODE_GCM):
+            raise VideoDecryptException(f'unsupported cipher mode {cipher_mode}')
+        self.key = key
+        self.cipher_mode = cipher_mode
+
+    @abstractmethod
+    def _encrypt_cbc(self, data: bytes) -> Tuple[bytes, bytes]:
+        """使用随机偏移向量和PKCS7填充加密，返回偏移向量和加密后的数据"""
+
+    @abstractmethod
+    def _decrypt_cbc(self, iv: bytes, data_size: int, enc_data: bytes) -> bytes:
+        """解密，`data_size`为-1时去掉PKCS7填充，否则截取前`data_size`个字节"""
+
+    def _decrypt_cbc_raw(self, iv: bytes, enc_data: bytes) -> bytes:
+        """解密CBC数据，不去掉填充字符"""
+        return AES.new(self.key, AES.MODE_CBC, iv=iv).decrypt(enc_data)
+
+    def encrypt(self, data: bytes, iv: bytes = None) -> Tuple[bytes, bytes]:
+        """
+        加密数据块
+        :param data: 原始数据
+        :param iv: 指定AES-GCM使用的nonce（偏移向量的前12个字节），为`None`时随机生成，同一个密钥下不能重复
+        :return 偏移向量和加密后的数据
+        """
+        if self.cipher_mode == CIPHER_MODE_CBC:
+            if iv is not None:
+                raise VideoDecryptException('iv of cbc mode must be random')
+            return self._encrypt_cbc(data)
+        nonce = os.urandom(GCM_NONCE_LEN) if iv is None else iv[:GCM_NONCE_LEN]
+        enc_data, tag = AES.new(self.key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(data)
+        return nonce.ljust(len(EMPTY_IV), b'\0'), enc_data + tag
+
+    def create_encryptor(self) -> StreamEncryptor:
+        """
+        创建分块加密对象，用于较大的数据，偏移向量随机生成。
+        CBC的结果与`KeymanagerCipherEngine`相同，总是使用pycryptodome
+        """
+        return StreamEncryptor(self.key, self.cipher_mode)
+
+    def decrypt(self, iv: bytes, data_size: int, enc_data: bytes) -> bytes:
+        """
+        解密数据块
+        :param iv: 偏移向量
+        :param data_size: 原始数据长度，为-1时根据加密数据计算
+        :param enc_data: 加密后的数据
+        :return 原始数据
+        """
+        if self.cipher_mode == CIPHER_MODE_CBC:
+            return self._decrypt_cbc(iv, data_size, enc_data)
+        if data_size == -1:
+            data_size = len(enc_data) - GCM_TAG_LEN
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=iv[:GCM_NONCE_LEN])
+        try:
+            return cipher.decrypt_and_verify(enc_data[:data_size], enc_data[data_size:data_size + GCM_TAG_LEN])
+        except ValueError:
+            raise VideoDecryptException('block authentication failed')
+
+    def decrypt_range(self, iv: bytes, enc_data: bytes, offset: int) -> bytes:
+        """
+        只解密数据块中的一部分，不校验认证标签，不去掉填充字符
+        :param iv: 偏移向量
+        :param enc_data: 按`get_block_range_window`读取的加密数据
+        :param offset: 解密数据在数据块中的起始位置，必须是16的倍数
+        :return 从`offset`开始的原始数据
+        """
+        if offset % AES.block_size != 0:
+            raise ValueError(f'offset {offset} not aligned')
+        if self.cipher_mode == CIPHER_MODE_CBC:
+            # CBC的每个16字节只依赖前一个16字节的加密数据
+            if offset > 0:
+                iv, enc_data = enc_data[:AES.block_size], enc_data[AES.block_size:]
+            return self._decrypt_cbc_raw(iv, enc_data)
+        # GCM使用的计数器从2开始
+        counter = 2 + offset // AES.block_size
+        return AES.new(self.key, AES.MODE_CTR, nonce=iv[:GCM_NONCE_LEN], initial_value=counter).decrypt(enc_data)
+
+    def encrypt_many(self,
+                     data_list,
+                     workers: int = 1,
+                     ivs=None,
+                     use_processes: bool = False,
+                     digest: bool = False) -> Iterator[tuple]:
+        """
+        批量加密，按顺序返回偏移向量和加密后的数据，`digest`为`True`时还返回原始数据的摘要
+        :param data_list: 原始数据列表，可以是迭代器，按需读取
+        :param workers: 线程或进程数量，使用线程且引擎不释放GIL时忽略
+        :param ivs: 按数据序号指定偏移向量（见`encrypt`），为`None`时随机生成
+        :param use_processes: 为`True`时使用进程池，引擎复制到每个进程中
+        :param digest: 为`True`时在工作线程中同时计算原始数据的摘要
+        """
+        if not use_processes and not self.releases_gil:
+            workers = 1
+        items = ((self, data, None if ivs is None else ivs[i], digest) for i, data in enumerate(data_list))
+        return _ordered_map(_engine_encrypt, items, workers, use_processes)
+
+    def decrypt_many(self,
+                     items,
+                     workers: int = 1,
+                     digest: bool = False,
+                     max_in_flight: int = None) -> Iterator[Union[bytes, Tuple[bytes, bytes]]]:
+        """
+        批量解密，按顺序返回原始数据，`digest`为`True`时返回原始数据和摘要
+        :param items: (偏移向量, 原始数据长度, 加密后的数据)列表，可以是迭代器，按需读取
+        :param workers: 线程数量，引擎不释放GIL时忽略
+        :param digest: 为`True`时在工作线程中同时计算原始数据的摘要
+        :param max_in_flight: 最多提前解密的数量，为`None`时为`workers`的2倍
+        """
+        workers = workers if self.releases_gil else 1
+        items = ((self, iv, data_size, enc_data, digest) for iv, data_size, enc_data in items)
+        return _ordered_map(_engine_decrypt, items, workers, max_in_flight=max_in_flight)
+
+
+def _engine_encrypt(engine: CipherEngine, data: bytes, iv: Optional[bytes], digest: bool):
+    iv, enc_data = engine.encrypt(data, iv)
+    if digest:
+        return iv, enc_data, hashlib.new(DIGEST_ALGORITHM, data).digest()
+    return iv, enc_data
+
+
+def _engine_decrypt(engine: CipherEngine, iv: bytes, data_size: int, enc_data: bytes, digest: bool):
+    data = engine.decrypt(iv, data_size, enc_data)
+    if digest:
+        return data, hashlib.new(DIGEST_ALGORITHM, data).digest()
+    return data
+
+
+class KeymanagerCipherEngine(CipherEngine):
+    """使用keymanager加解密CBC数据"""
+
+    name = 'keymanager'
+
+    def _encrypt_cbc(self, data: bytes) -> Tuple[bytes, bytes]:
+        return encrypt_data1(self.key, data)
+
+    def _decrypt_cbc(self, iv: bytes, data_size: int, enc_data: bytes) -> bytes:
+        return decrypt_data1(self.key, iv, data_size, enc_data)
+
+
+class CryptodomeCipherEngine(CipherEngine):
+    """
+    使用pycryptodome加解密CBC数据，加解密在C代码中进行并释放GIL，结果与keymanager相同
+
+    创建时准备好密钥扩展后的ECB上下文，CBC解密使用ECB解密后与前一个16字节的加密数据异或，
+    不需要每次创建cipher对象，多个线程可以共用。加密（CBC需要逐块进行）和GCM的cipher对象与偏移向量绑定，仍然每次创建
+    """
+
+    name = 'pycryptodome'
+    releases_gil = True
+
+    def __init__(self, key: bytes, cipher_mode: int = CIPHER_MODE_CBC):
+        super().__init__(key, cipher_mode)
+        self._ecb = AES.new(key, AES.MODE_ECB)
+
+    def __getstate__(self):
+        # ECB上下文不能序列化，进程池中重新创建
+        state = self.__dict__.copy()
+        del state['_ecb']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ecb = AES.new(self.key, AES.MODE_ECB)
+
+    def _encrypt_cbc(self, data: bytes) -> Tuple[bytes, bytes]:
+        iv = os.urandom(AES.block_size)
+        return iv, AES.new(self.key, AES.MODE_CBC, iv=iv).encrypt(pad(data, AES.block_size))
+
+    def _decrypt_cbc_raw(self, iv: bytes, enc_data: bytes) -> bytes:
+        if len(enc_data) == 0:
+            return b''
+        view = memoryview(enc_data)
+        return strxor(self._ecb.decrypt(view), iv + view[:-AES.block_size])
+
+    def _decrypt_cbc(self, iv: bytes, data_size: int, enc_data: bytes) -> bytes:
+        data = self._decrypt_cbc_raw(iv, enc_data)
+        if data_size == -1:
+            return unpad(data, AES.block_size)
+        return data[:data_size]
+
+
+CIPHER_ENGINES = {engine.name: engine for engine in (CryptodomeCipherEngine, KeymanagerCipherEngine)}
+
+
+def _check_cipher_engine(engine_class: type) -> bool:
+    """与keymanager互相加解密，确认引擎可以读写已有的加密文件"""
+    key = os.urandom(32)
+    data = os.urandom(AES.block_size * 3 + 5)
+    engine = engine_class(key)
+    iv, enc_data = engine.encrypt(data)
+    if decrypt_data1(key, iv, len(data), enc_data) != data:
+        return False
+    iv, enc_data = encrypt_data1(key, data)
+    return engine.decrypt(iv, -1, enc_data) == data
+
+
+def select_cipher_engine(name: str = None) -> type:
+    """
+    选择加密引擎，优先使用释放GIL的引擎，不可用时使用keymanager
+    :param name: 引擎名字，为`None`时自动选择
+    :return 引擎类
+    """
+    global CIPHER_ENGINE
+    logger = logging.getLogger('CipherEngine')
+    candidates = [CIPHER_ENGINES[name]] if name is not None else list(CIPHER_ENGINES.values())
+    for engine_class in candidates:
+        try:
+            if engine_class is KeymanagerCipherEngine or _check_cipher_engine(engine_class):
+                CIPHER_ENGINE = engine_class
+                logger.info(f'cipher engine: {engine_class.name}, releases GIL: {engine_class.releases_gil}')
+                return engine_class
+        except Exception as e:
+            logger.warning(f'cipher engine {engine_class.name} unavailable: {e}')
+        else:
+            logger.warning(f'cipher engine {engine_class.name} unavailable: result mismatch')
+    CIPHER_ENGINE = KeymanagerCipherEngine
+    logger.info(f'cipher engine: {KeymanagerCipherEngine.name}')
+    return CIPHER_ENGINE
+
+
+def create_cipher_engine(key: bytes, cipher_mode: int = CIPHER_MODE_CBC) -> CipherEngine:
+    """使用选择的引擎创建加密引擎，第一次调用时选择引擎（程序已经配置好日志）"""
+    if CIPHER_ENGINE is None:
+        with _CIPHER_ENGINE_LOCK:
+            if CIPHER_ENGINE is None:
+                select_cipher_engine()
+    return CIPHER_ENGINE(key, cipher_mode)
+
+
+CIPHER_ENGINE: Optional[type] = None  #: 当前使用的引擎类，为`None`时在第一次创建引擎时选择
+_CIPHER_ENGINE_LOCK = threading.Lock()
 
 
 class VideoContentIndex:
@@ -96,6 +509,425 @@ class VideoContentIndex:
         return vbi
 
 
+class VideoBlockSpan:
+    """
+    原始文件中的一段数据落在某个数据块中的部分
+    :param index: 数据块序号
+    :param raw_start_pos: 数据块在原始文件中的起始位置
+    :param offset: 数据在解密后的数据块中的起始位置
+    :param length: 数据在本数据块中的长度
+    :param start_pos: 数据块在加密文件中的起始位置
+    :param block_size: 加密以后的数据块大小
+    """
+
+    def __init__(self, index: int, raw_start_pos: int, offset: int, length: int, start_pos: int, block_size: int):
+        self.index = index
+        self.raw_start_pos = raw_start_pos
+        self.offset = offset
+        self.length = length
+        self.start_pos = start_pos
+        self.block_size = block_size
+
+    def __repr__(self):
+        return f'VideoBlockSpan(index={self.index}, offset={self.offset}, length={self.length}, ' \
+               f'start_pos={self.start_pos}, block_size={self.block_size})'
+
+
+class _IvColumn:
+    """所有数据块的偏移向量，连续保存在一个`bytearray`中"""
+
+    def __init__(self, data: bytearray):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // VideoContentIndex.iv_len
+
+    def __getitem__(self, idx: int) -> bytes:
+        if idx < 0:
+            idx += len(self)
+        pos = idx * VideoContentIndex.iv_len
+        return bytes(self.data[pos:pos + VideoContentIndex.iv_len])
+
+    def __setitem__(self, idx: int, iv: bytes):
+        if len(iv) != VideoContentIndex.iv_len:
+            raise ValueError(f'iv length should be {VideoContentIndex.iv_len}')
+        if idx < 0:
+            idx += len(self)
+        pos = idx * VideoContentIndex.iv_len
+        self.data[pos:pos + VideoContentIndex.iv_len] = iv
+
+
+class VideoBlockTable:
+    """
+    加密视频文件块索引表，按列保存所有数据块的索引，代替逐个创建`VideoContentIndex`对象
+
+    每一列可以按数据块序号直接读写，例如 `table.start_pos[idx]`，
+    与`bytes`之间的转换按列整体进行，格式与逐个写入`VideoContentIndex`完全相同
+    """
+
+    #: 数值列名及其在索引中占用的字节长度，顺序即写入顺序
+    int_columns = (
+        ('start_pos', VideoContentIndex.start_pos_bytes_len),
+        ('raw_start_pos', VideoContentIndex.raw_start_pos_bytes_len),
+        ('data_size', VideoContentIndex.data_bytes_cnt_len),
+        ('block_size', VideoContentIndex.block_bytes_cnt_len),
+    )
+
+    def __init__(self, block_num: int = 0):
+        self.iv = _IvColumn(bytearray(EMPTY_IV * block_num))
+        self.start_pos = array('Q', bytes(8 * block_num))  #: 数据块在加密文件中的起始位置
+        self.raw_start_pos = array('Q', bytes(8 * block_num))  #: 数据块在原始文件中的起始位置
+        self.data_size = array('Q', bytes(8 * block_num))  #: 未加密的数据块大小
+        self.block_size = array('Q', bytes(8 * block_num))  #: 加密以后的数据块大小
+
+    fixed_iv = False  #: 偏移向量是否由索引表决定，为`True`时加密使用`iv`列中的偏移向量
+
+    def __len__(self):
+        return len(self.start_pos)
+
+    def get_index_bytes_len(self) -> int:
+        """索引在文件头中占用的字节数"""
+        return len(self) * VideoContentIndex.video_content_index_bytes
+
+    def set_block(self, idx: int, iv: bytes, data_size: int, start_pos: int, raw_start_pos: int, block_size: int):
+        """写入一个数据块的索引"""
+        self.iv[idx] = iv
+        self.data_size[idx] = data_size
+        self.start_pos[idx] = start_pos
+        self.raw_start_pos[idx] = raw_start_pos
+        self.block_size[idx] = block_size
+
+    def append(self,
+               iv: bytes = EMPTY_IV,
+               data_size: int = 0,
+               start_pos: int = 0,
+               raw_start_pos: int = 0,
+               block_size: int = 0):
+        if len(iv) != VideoContentIndex.iv_len:
+            raise ValueError(f'iv length should be {VideoContentIndex.iv_len}')
+        self.iv.data += iv
+        self.start_pos.append(start_pos)
+        self.raw_start_pos.append(raw_start_pos)
+        self.data_size.append(data_size)
+        self.block_size.append(block_size)
+
+    def to_bytes(self) -> bytes:
+        record_len = VideoContentIndex.video_content_index_bytes
+        iv_len = VideoContentIndex.iv_len
+        block_num = len(self)
+        data = bytearray(record_len * block_num)
+
+        for k in range(iv_len):
+            data[k::record_len] = self.iv.data[k::iv_len]
+
+        offset = iv_len
+        for name, width in self.int_columns:
+            column = getattr(self, name)
+            if block_num > 0 and max(column) >> (width * 8) != 0:
+                raise OverflowError(f'{name} too big to convert')
+            column = array('Q', column)
+            if sys.byteorder == 'little':
+                column.byteswap()
+            b_column = column.tobytes()
+            # 取每个8字节大端数值的低位字节
+            for k in range(width):
+                data[offset + k::record_len] = b_column[8 - width + k::8]
+            offset += width
+
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data) -> VideoBlockTableType:
+        record_len = VideoContentIndex.video_content_index_bytes
+        iv_len = VideoContentIndex.iv_len
+        if len(data) % record_len != 0:
+            raise Exception('block index size incorrect', len(data))
+        block_num = len(data) // record_len
+        data = memoryview(data)
+
+        table = cls()
+
+        iv = bytearray(iv_len * block_num)
+        for k in range(iv_len):
+            iv[k::iv_len] = data[k::record_len]
+        table.iv = _IvColumn(iv)
+
+        offset = iv_len
+        for name, width in cls.int_columns:
+            # 补齐为8字节大端数值
+            b_column = bytearray(8 * block_num)
+            for k in range(width):
+                b_column[8 - width + k::8] = data[offset + k::record_len]
+            column = array('Q')
+            column.frombytes(b_column)
+            if sys.byteorder == 'little':
+                column.byteswap()
+            setattr(table, name, column)
+            offset += width
+
+        return table
+
+    def find_block(self, pos: int) -> int:
+        """
+        二分查找原始文件中的位置所在的数据块，数据块大小可以不同
+        :param pos: 原始文件中的位置
+        :return 数据块序号，找不到时返回数据块数量
+        """
+        idx = bisect_right(self.raw_start_pos, pos) - 1
+        if idx >= 0 and pos < self.raw_start_pos[idx] + self.data_size[idx]:
+            return idx
+        return len(self)
+
+    def get_block_range(self, start: int, end: int) -> range:
+        """
+        二分查找原始文件中`[start, end)`范围的数据所在的数据块
+        :param start: 原始文件中的起始位置
+        :param end: 原始文件中的结束位置，不包含
+        :return 数据块序号的范围
+        """
+        if start < 0 or end <= start:
+            return range(0)
+        first = max(bisect_right(self.raw_start_pos, start) - 1, 0)
+        last = bisect_left(self.raw_start_pos, end)
+        # 起始位置超出了第一个数据块的末尾（文件末尾之后）
+        if first < last and start >= self.raw_start_pos[first] + self.data_size[first]:
+            first += 1
+        return range(first, last)
+
+    def get_block_spans(self, start: int, end: int) -> Iterator[VideoBlockSpan]:
+        """
+        将原始文件中`[start, end)`范围的数据映射到数据块及其在加密文件中的位置
+        :param start: 原始文件中的起始位置
+        :param end: 原始文件中的结束位置，不包含
+        """
+        for idx in self.get_block_range(start, end):
+            raw_start_pos = self.raw_start_pos[idx]
+            offset = max(start - raw_start_pos, 0)
+            length = min(end - raw_start_pos, self.data_size[idx]) - offset
+            yield VideoBlockSpan(idx, raw_start_pos, offset, length, self.start_pos[idx], self.block_size[idx])
+
+    def close(self):
+        pass
+
+    @classmethod
+    def from_index_list(cls, index_list: List[VideoContentIndex]) -> VideoBlockTableType:
+        table = cls()
+        for vbi in index_list:
+            table.append(vbi.iv, vbi.data_size, vbi.start_pos, vbi.raw_start_pos, vbi.block_size)
+        return table
+
+
+class _MappedColumn:
+    """从内存映射的文件头中按需读取某一列数据，只读"""
+
+    def __init__(self, buffer, offset: int, block_num: int, field_offset: int, width: int, is_bytes: bool = False):
+        self.buffer = buffer
+        self.offset = offset + field_offset
+        self.block_num = block_num
+        self.width = width
+        self.is_bytes = is_bytes
+
+    def __len__(self):
+        return self.block_num
+
+    def __getitem__(self, idx: int):
+        if idx < 0:
+            idx += self.block_num
+        if not 0 <= idx < self.block_num:
+            raise IndexError('block index out of range')
+        pos = self.offset + idx * VideoContentIndex.video_content_index_bytes
+        data = self.buffer[pos:pos + self.width]
+        if self.is_bytes:
+            return data
+        return int.from_bytes(data, byteorder='big')
+
+    def __setitem__(self, idx: int, value):
+        raise TypeError('mapped block index is read only')
+
+
+class MappedVideoBlockTable(VideoBlockTable):
+    """
+    从文件头的内存映射中按需解析数据块索引，打开文件时不需要读取和解析全部索引，只读
+    :param buffer: 文件头的内存映射
+    :param offset: 数据块索引在文件头中的起始位置
+    :param block_num: 数据块数量
+    """
+
+    def __init__(self, buffer: mmap.mmap, offset: int, block_num: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.block_num = block_num
+
+        self.iv = _MappedColumn(buffer, offset, block_num, 0, VideoContentIndex.iv_len, is_bytes=True)
+        field_offset = VideoContentIndex.iv_len
+        for name, width in self.int_columns:
+            setattr(self, name, _MappedColumn(buffer, offset, block_num, field_offset, width))
+            field_offset += width
+
+    def __len__(self):
+        return self.block_num
+
+    def append(self, *args, **kwargs):
+        raise TypeError('mapped block index is read only')
+
+    def to_bytes(self) -> bytes:
+        return self.buffer[self.offset:self.offset + self.block_num * VideoContentIndex.video_content_index_bytes]
+
+    def close(self):
+        self.buffer.close()
+
+
+class _DerivedColumn:
+    """根据数据块序号计算的一列数据，只读"""
+
+    def __init__(self, table, func: Callable[[int], Union[int, bytes]]):
+        self.table = table
+        self.func = func
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, idx: int):
+        block_num = len(self.table)
+        if idx < 0:
+            idx += block_num
+        if not 0 <= idx < block_num:
+            raise IndexError('block index out of range')
+        return self.func(idx)
+
+    def __setitem__(self, idx: int, value):
+        raise TypeError('derived block index is read only')
+
+
+class DerivedVideoBlockTable(VideoBlockTable):
+    """
+    紧凑的数据块索引，数据块大小固定（最后一个数据块除外）且使用AES-GCM时，
+    数据块的位置、大小和nonce都可以根据数据块序号计算，文件头中只保存文件nonce和数据块大小，只读
+
+    AES-CBC的偏移向量必须不可预测，不能使用这种索引
+
+    :param file_nonce: 文件nonce，每个文件随机生成
+    :param raw_block_size: 原始数据块的大小
+    :param raw_file_size: 原始文件的大小
+    :param data_start: 第一个数据块在加密文件中的起始位置，写入时在写完视频信息以后设置
+    """
+
+    fixed_iv = True
+
+    def __init__(self, file_nonce: bytes, raw_block_size: int, raw_file_size: int, data_start: int = 0):
+        if len(file_nonce) != FILE_NONCE_LEN:
+            raise ValueError(f'file nonce length should be {FILE_NONCE_LEN}')
+        self.file_nonce = file_nonce
+        self.raw_block_size = raw_block_size
+        self.raw_file_size = raw_file_size
+        self.data_start = data_start
+        self.block_num = (raw_file_size + raw_block_size - 1) // raw_block_size
+
+        self.iv = _DerivedColumn(self, lambda idx: file_nonce + idx.to_bytes(4, byteorder='big') + bytes(4))
+        self.raw_start_pos = _DerivedColumn(self, lambda idx: idx * raw_block_size)
+        self.data_size = _DerivedColumn(self, lambda idx: min(raw_block_size, raw_file_size - idx * raw_block_size))
+        self.block_size = _DerivedColumn(self, lambda idx: self.data_size[idx] + GCM_TAG_LEN)
+        self.start_pos = _DerivedColumn(self, lambda idx: self.data_start + idx * (raw_block_size + GCM_TAG_LEN))
+
+    def __len__(self):
+        return self.block_num
+
+    def get_index_bytes_len(self) -> int:
+        return 0
+
+    def set_block(self, idx: int, iv: bytes, data_size: int, start_pos: int, raw_start_pos: int, block_size: int):
+        """只检查写入的数据块与计算的索引是否一致"""
+        if (iv, data_size, start_pos, raw_start_pos, block_size) != \
+                (self.iv[idx], self.data_size[idx], self.start_pos[idx], self.raw_start_pos[idx], self.block_size[idx]):
+            raise Exception('block does not match derived index', idx)
+
+    def append(self, *args, **kwargs):
+        raise TypeError('derived block index is read only')
+
+    def to_bytes(self) -> bytes:
+        return b''
+
+    def to_ext_bytes(self) -> bytes:
+        """保存在文件头扩展区中的数据"""
+        return self.file_nonce + self.raw_block_size.to_bytes(DERIVED_BLOCK_SIZE_BYTES_LEN, byteorder='big')
+
+    @classmethod
+    def from_ext_bytes(cls, data: bytes, raw_file_size: int, data_start: int) -> VideoBlockTableType:
+        file_nonce = bytes(data[:FILE_NONCE_LEN])
+        raw_block_size = int.from_bytes(data[FILE_NONCE_LEN:FILE_NONCE_LEN + DERIVED_BLOCK_SIZE_BYTES_LEN],
+                                        byteorder='big')
+        return cls(file_nonce, raw_block_size, raw_file_size, data_start)
+
+    def find_block(self, pos: int) -> int:
+        if 0 <= pos < self.raw_file_size:
+            return pos // self.raw_block_size
+        return len(self)
+
+    def get_block_range(self, start: int, end: int) -> range:
+        end = min(end, self.raw_file_size)
+        if start < 0 or end <= start:
+            return range(0)
+        return range(start // self.raw_block_size, (end + self.raw_block_size - 1) // self.raw_block_size)
+
+
+def _table_column_property(name: str):
+
+    def getter(self):
+        return getattr(self.table, name)[self.idx]
+
+    def setter(self, value):
+        getattr(self.table, name)[self.idx] = value
+
+    return property(getter, setter)
+
+
+class VideoContentIndexView(VideoContentIndex):
+    """
+    `VideoBlockTable`中单个数据块索引的视图，读写直接作用于索引表
+    :param table: 数据块索引表
+    :param idx: 数据块序号
+    """
+
+    iv = _table_column_property('iv')
+    start_pos = _table_column_property('start_pos')
+    raw_start_pos = _table_column_property('raw_start_pos')
+    data_size = _table_column_property('data_size')
+    block_size = _table_column_property('block_size')
+
+    def __init__(self, table: VideoBlockTable, idx: int):
+        self.table = table
+        self.idx = idx
+
+
+class VideoBlockIndexList:
+    """
+    以`VideoContentIndex`列表的方式访问`VideoBlockTable`，兼容原有的`VideoHead.block_index`用法
+    :param table: 数据块索引表
+    """
+
+    def __init__(self, table: VideoBlockTable):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [VideoContentIndexView(self.table, i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('block index out of range')
+        return VideoContentIndexView(self.table, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield VideoContentIndexView(self.table, idx)
+
+    def append(self, vbi: VideoContentIndex):
+        self.table.append(vbi.iv, vbi.data_size, vbi.start_pos, vbi.raw_start_pos, vbi.block_size)
+
+
 class VideoHead:
     video_marker_bytes_cnt = len(HEAD_FILE_MARKER)  #: 文件标记占用的字节数
     video_file_size_bytes_cnt_len = 5  #: 包括文件标记在内的加密文件字节数量的数值所占用的字节数
@@ -104,18 +936,214 @@ class VideoHead:
     video_info_index_bytes_cnt_len = 5  #: 视频信息索引字节数量的数值所占用的字节数
     video_info_index_cnt_bytes_len = 2  #: 视频信息索引数量的字节数量的数值所占用的字节数
 
+    video_fixed_head_bytes_cnt = (
+            video_marker_bytes_cnt +  # 8
+            video_file_size_bytes_cnt_len +  # 5
+            video_head_size_bytes_cnt_len +  # 4
+            video_raw_file_size_bytes_cnt_len +  # 5
+            video_info_index_bytes_cnt_len +  # 5
+            video_info_index_cnt_bytes_len  # 2
+    )  #: 文件头中固定长度部分占用的字节数
+
+    video_cipher_mode_bytes_cnt_len = 1  #: 加密方式占用的字节数，EV000002
+    video_ext_size_bytes_cnt_len = 4  #: 扩展区字节数量的数值所占用的字节数，EV000002
+    video_ext_type_bytes_cnt_len = 2  #: 扩展数据类型占用的字节数
+    video_ext_data_bytes_cnt_len = 4  #: 扩展数据长度的数值占用的字节数
+
     """
     加密视频文件文件头
     """
 
     def __init__(self):
+        self.cipher_mode = CIPHER_MODE_CBC  #: 数据块的加密方式
+        self.extensions: Dict[int, bytes] = {}  #: 扩展区数据，按类型保存，读取时保留不认识的类型
         self.file_size = 0  #: 包括文件标记在内的加密文件的大小
         self.head_size = 0  #: 文件头字节数，包含文件头中所有数据，包括head_size变量本身
         self.raw_file_size = 0  #: 未加密的文件字节数
         self.video_info_index_size = 0  #: 视频信息块索引占用字节数
         self.video_info_index_cnt = 0  #: 视频信息块数量
         self.video_info_index: List[VideoInfoIndex] = []  #: 视频信息块索引
-        self.block_index: List[VideoContentIndex] = []  #: 加密视频文件块索引
+        self.block_table: VideoBlockTable = VideoBlockTable()  #: 加密视频文件块索引表
+        self.head_offset = 0  #: 文件头在加密文件中的起始位置，文件头在文件末尾时不为0
+        self.keyframes: Optional[List[Keyframe]] = None  #: `from_raw_file`解析的关键帧，不保存在文件头中
+
+    @property
+    def block_index(self) -> VideoBlockIndexList:
+        """加密视频文件块索引，以`VideoContentIndex`列表的方式访问`block_table`"""
+        return VideoBlockIndexList(self.block_table)
+
+    @block_index.setter
+    def block_index(self, index_list: List[VideoContentIndex]):
+        self.block_table = VideoBlockTable.from_index_list(index_list)
+
+    @property
+    def marker(self) -> bytes:
+        """文件标记，使用CBC加密且没有扩展数据时与原来的格式相同"""
+        if self.cipher_mode == CIPHER_MODE_CBC and len(self.extensions) == 0:
+            return HEAD_FILE_MARKER
+        return HEAD_FILE_MARKER_V2
+
+    def _ext_to_bytes(self) -> bytes:
+        bos = BytesIO()
+        for ext_type in sorted(self.extensions):
+            ext_data = self.extensions[ext_type]
+            bos.write(ext_type.to_bytes(self.video_ext_type_bytes_cnt_len, byteorder='big'))  # 2
+            bos.write(len(ext_data).to_bytes(self.video_ext_data_bytes_cnt_len, byteorder='big'))  # 4
+            bos.write(ext_data)  # dynamic
+        return bos.getvalue()
+
+    @classmethod
+    def _ext_from_bytes(cls, data: bytes) -> Dict[int, bytes]:
+        extensions = {}
+        bis = BytesIO(data)
+        while bis.tell() < len(data):
+            ext_type = int.from_bytes(bis.read(cls.video_ext_type_bytes_cnt_len), byteorder='big')
+            ext_len = int.from_bytes(bis.read(cls.video_ext_data_bytes_cnt_len), byteorder='big')
+            extensions[ext_type] = bis.read(ext_len)
+        return extensions
+
+    @property
+    def info_format(self) -> int:
+        """视频信息的编码格式"""
+        ext_data = self.extensions.get(HEAD_EXT_INFO_FORMAT)
+        return INFO_FORMAT_PADDED if ext_data is None else ext_data[0]
+
+    @info_format.setter
+    def info_format(self, info_format: int):
+        if info_format == INFO_FORMAT_PADDED:
+            # 与原来的格式相同，不需要扩展数据
+            self.extensions.pop(HEAD_EXT_INFO_FORMAT, None)
+        else:
+            self.extensions[HEAD_EXT_INFO_FORMAT] = bytes([info_format])
+
+    def has_key_slots(self) -> bool:
+        """是否使用数据密钥加密（信封加密）"""
+        return HEAD_EXT_KEY_SLOTS in self.extensions
+
+    def get_key_slots(self) -> List[bytes]:
+        data = self.extensions.get(HEAD_EXT_KEY_SLOTS, b'')
+        return [data[i:i + KEY_SLOT_SIZE] for i in range(0, len(data), KEY_SLOT_SIZE)]
+
+    def _set_key_slots(self, slots: List[bytes]):
+        self.extensions[HEAD_EXT_KEY_SLOTS] = b''.join(slots)
+
+    def get_key_checks(self) -> List[bytes]:
+        """文件头中保存的密钥标识和校验值，空的记录全部为0"""
+        data = self.extensions.get(HEAD_EXT_KEY_CHECK, b'')
+        return [data[i:i + KEY_CHECK_SIZE] for i in range(0, len(data), KEY_CHECK_SIZE)]
+
+    def _set_key_checks(self, key_checks: List[bytes]):
+        self.extensions[HEAD_EXT_KEY_CHECK] = b''.join(key_checks)
+
+    def set_key_check(self, key: bytes):
+        """
+        保存用户密钥的标识和校验值，打开文件时可以立即发现密钥错误。使用密钥槽时不需要调用
+        :param key: 用户密钥
+        """
+        self._set_key_checks([get_key_check(key)])
+
+    def get_key_ids(self) -> List[bytes]:
+        """文件头中保存的所有用户密钥的标识"""
+        return [key_check[:KEY_ID_LEN] for key_check in self.get_key_checks() if key_check != bytes(KEY_CHECK_SIZE)]
+
+    def match_key(self, key: bytes) -> Optional[bool]:
+        """
+        使用文件头中的密钥标识和校验值检查用户密钥
+        :param key: 用户密钥
+        :return 文件头中没有保存时返回`None`
+        """
+        if HEAD_EXT_KEY_CHECK not in self.extensions:
+            return None
+        return get_key_check(key) in self.get_key_checks()
+
+    def _find_key_slot(self, key: bytes) -> Tuple[int, Optional[bytes]]:
+        """查找用户密钥对应的密钥槽，返回序号和数据密钥，找不到时返回-1和`None`"""
+        if HEAD_EXT_KEY_CHECK in self.extensions:
+            # 按密钥标识直接找到密钥槽
+            try:
+                i = self.get_key_checks().index(get_key_check(key))
+            except ValueError:
+                return -1, None
+            data_key = unwrap_data_key(key, self.get_key_slots()[i])
+            return (i, data_key) if data_key is not None else (-1, None)
+        for i, slot in enumerate(self.get_key_slots()):
+            if slot == bytes(KEY_SLOT_SIZE):
+                continue
+            data_key = unwrap_data_key(key, slot)
+            if data_key is not None:
+                return i, data_key
+        return -1, None
+
+    def create_key_slots(self, key: bytes, slot_num: int = KEY_SLOT_NUM) -> bytes:
+        """
+        生成随机的数据密钥，使用用户密钥加密后保存在第一个密钥槽中，其余密钥槽为空
+        :param key: 用户密钥
+        :param slot_num: 密钥槽数量，决定最多可以授权多少个用户密钥
+        :return 数据密钥，数据块和视频信息使用数据密钥加密
+        """
+        data_key = os.urandom(DATA_KEY_LEN)
+        self._set_key_slots([wrap_data_key(key, data_key)] + [bytes(KEY_SLOT_SIZE)] * (slot_num - 1))
+        self._set_key_checks([get_key_check(key)] + [bytes(KEY_CHECK_SIZE)] * (slot_num - 1))
+        return data_key
+
+    def get_data_key(self, key: bytes) -> bytes:
+        """
+        获取加密数据使用的密钥，没有密钥槽时就是用户密钥
+        :param key: 用户密钥
+        """
+        if not self.has_key_slots():
+            return key
+        _, data_key = self._find_key_slot(key)
+        if data_key is None:
+            raise VideoDecryptException('key not authorized')
+        return data_key
+
+    def add_key(self, key: bytes, new_key: bytes):
+        """
+        授权新的用户密钥，使用空的密钥槽，文件头长度不变
+        :param key: 已经授权的用户密钥
+        :param new_key: 新的用户密钥
+        """
+        data_key = self.get_data_key(key)
+        if self._find_key_slot(new_key)[0] >= 0:
+            return
+        slots = self.get_key_slots()
+        try:
+            i = slots.index(bytes(KEY_SLOT_SIZE))
+        except ValueError:
+            raise VideoDecryptException('no free key slot')
+        slots[i] = wrap_data_key(new_key, data_key)
+        self._set_key_slots(slots)
+        if HEAD_EXT_KEY_CHECK in self.extensions:
+            key_checks = self.get_key_checks()
+            key_checks[i] = get_key_check(new_key)
+            self._set_key_checks(key_checks)
+
+    def remove_key(self, key: bytes):
+        """
+        取消用户密钥的授权，清空对应的密钥槽，不能删除最后一个密钥
+        :param key: 需要删除的用户密钥
+        """
+        i, _ = self._find_key_slot(key)
+        if i < 0:
+            return
+        slots = self.get_key_slots()
+        if sum(1 for slot in slots if slot != bytes(KEY_SLOT_SIZE)) <= 1:
+            raise VideoDecryptException('can not remove the last key')
+        slots[i] = bytes(KEY_SLOT_SIZE)
+        self._set_key_slots(slots)
+        if HEAD_EXT_KEY_CHECK in self.extensions:
+            key_checks = self.get_key_checks()
+            key_checks[i] = bytes(KEY_CHECK_SIZE)
+            self._set_key_checks(key_checks)
+
+    def get_block_index_start(self) -> int:
+        """数据块索引在文件头中的起始位置"""
+        start = self.video_fixed_head_bytes_cnt + self.video_info_index_size
+        if self.marker == HEAD_FILE_MARKER_V2:
+            start += self.video_cipher_mode_bytes_cnt_len + self.video_ext_size_bytes_cnt_len
+            start += len(self._ext_to_bytes())
+        return start
 
     def update_head_size(self):
         """更新文件头数据"""
@@ -133,26 +1161,34 @@ class VideoHead:
         self.head_size += self.video_raw_file_size_bytes_cnt_len  # raw_file_size, 5
         self.head_size += self.video_info_index_bytes_cnt_len  # video_info_index_size, 5
         self.head_size += self.video_info_index_cnt_bytes_len  # video_info_index_cnt, 2
+        if self.marker == HEAD_FILE_MARKER_V2:
+            self.head_size += self.video_cipher_mode_bytes_cnt_len  # cipher_mode, 1
+            self.head_size += self.video_ext_size_bytes_cnt_len  # ext_size, 4
+            self.head_size += len(self._ext_to_bytes())  # ext
         self.head_size += self.video_info_index_size  # video_info_index_size
-        self.head_size += len(self.block_index) * VideoContentIndex.video_content_index_bytes  # block_index
+        self.head_size += self.block_table.get_index_bytes_len()  # block_index
 
     def to_bytes(self) -> bytes:
 
         self.update_head_size()
 
         bos = BytesIO()
-        bos.write(HEAD_FILE_MARKER)  # 8
+        bos.write(self.marker)  # 8
         bos.write(self.file_size.to_bytes(self.video_file_size_bytes_cnt_len, byteorder='big'))  # 5
         bos.write(self.head_size.to_bytes(self.video_head_size_bytes_cnt_len, byteorder='big'))  # 4
         bos.write(self.raw_file_size.to_bytes(self.video_raw_file_size_bytes_cnt_len, byteorder='big'))  # 5
         bos.write(self.video_info_index_size.to_bytes(self.video_info_index_bytes_cnt_len, byteorder='big'))  # 5
         bos.write(self.video_info_index_cnt.to_bytes(self.video_info_index_cnt_bytes_len, byteorder='big'))  # 2
+        if self.marker == HEAD_FILE_MARKER_V2:
+            ext_data = self._ext_to_bytes()
+            bos.write(self.cipher_mode.to_bytes(self.video_cipher_mode_bytes_cnt_len, byteorder='big'))  # 1
+            bos.write(len(ext_data).to_bytes(self.video_ext_size_bytes_cnt_len, byteorder='big'))  # 4
+            bos.write(ext_data)  # dynamic
 
         for info_index in self.video_info_index:
             bos.write(info_index.to_bytes())  # 20
 
-        for vbi in self.block_index:
-            bos.write(vbi.to_bytes())  # 32
+        bos.write(self.block_table.to_bytes())  # 32 * block num
 
         return bos.getvalue()
 
@@ -168,7 +1204,46 @@ class VideoHead:
         b_marker = stream.read(cls.video_marker_bytes_cnt)
         if close:
             stream.close()
-        return b_marker.hex() == HEAD_FILE_MARKER.hex()
+        return b_marker in HEAD_FILE_MARKERS or b_marker == HEAD_FILE_MARKER_STREAM
+
+    def get_info_start(self) -> int:
+        """视频信息在加密文件中的起始位置，文件头在文件末尾时视频信息在文件头之前"""
+        if self.head_offset > 0:
+            return self.head_offset - sum(info_index.length for info_index in self.video_info_index)
+        return self.head_size
+
+    @classmethod
+    def from_file(cls, reader, lazy: bool = False) -> VideoHeadType:
+        """
+        读取加密文件的文件头，支持文件头在文件开头和文件末尾两种格式
+        :param reader: 加密文件的输入流
+        :param lazy: 为`True`时文件头在文件开头的按`from_file_lazy`读取，需要调用`close`
+        :return `VideoHead`对象
+        """
+        reader.seek(0)
+        if reader.read(cls.video_marker_bytes_cnt) == HEAD_FILE_MARKER_STREAM:
+            return cls._from_trailer(reader)
+        if lazy:
+            return cls.from_file_lazy(reader)
+        return cls.from_bytes(cls.get_head_block(reader))
+
+    @classmethod
+    def _from_trailer(cls, reader) -> VideoHeadType:
+        """读取文件末尾的文件头，文件末尾依次是文件头、文件头长度和文件标记"""
+        footer_size = STREAM_FOOTER_SIZE_BYTES_LEN + cls.video_marker_bytes_cnt
+        end = reader.seek(0, os.SEEK_END)
+        reader.seek(end - footer_size)
+        head_size = int.from_bytes(reader.read(STREAM_FOOTER_SIZE_BYTES_LEN), byteorder='big')  # 4
+        if reader.read(cls.video_marker_bytes_cnt) != HEAD_FILE_MARKER_STREAM:  # 8
+            raise Exception('stream footer incorrect')
+        head_offset = end - footer_size - head_size
+        reader.seek(head_offset)
+        vh = cls.from_bytes(reader.read(head_size))
+        vh.head_offset = head_offset
+        derived_table = vh._create_derived_table()
+        if derived_table is not None:
+            vh.block_table = derived_table
+        return vh
 
     @classmethod
     def get_head_block(cls, reader) -> bytes:
@@ -184,59 +1259,144 @@ class VideoHead:
         return reader.read(head_size)
 
     @classmethod
-    def from_bytes(cls, data) -> VideoHeadType:
-        bis = BytesIO(data)
-        bis.seek(cls.video_marker_bytes_cnt)  # 8
+    def _from_fixed_head(cls, reader) -> VideoHeadType:
+        """读取文件头中固定长度的部分、扩展区和视频信息索引"""
+        reader.seek(0)
+        b_marker = reader.read(cls.video_marker_bytes_cnt)  # 8
+        if b_marker not in HEAD_FILE_MARKERS:
+            raise Exception('not an encrypted video', b_marker)
         vh = VideoHead()
-        vh.file_size = int.from_bytes(bis.read(cls.video_file_size_bytes_cnt_len), byteorder='big')  # 5
-        vh.head_size = int.from_bytes(bis.read(cls.video_head_size_bytes_cnt_len), byteorder='big')  # 4
-        vh.raw_file_size = int.from_bytes(bis.read(cls.video_raw_file_size_bytes_cnt_len), byteorder='big')  # 5
-        vh.video_info_index_size = int.from_bytes(bis.read(cls.video_info_index_bytes_cnt_len), byteorder='big')  # 5
-        vh.video_info_index_cnt = int.from_bytes(bis.read(cls.video_info_index_cnt_bytes_len), byteorder='big')  # 2
+        vh.file_size = int.from_bytes(reader.read(cls.video_file_size_bytes_cnt_len), byteorder='big')  # 5
+        vh.head_size = int.from_bytes(reader.read(cls.video_head_size_bytes_cnt_len), byteorder='big')  # 4
+        vh.raw_file_size = int.from_bytes(reader.read(cls.video_raw_file_size_bytes_cnt_len), byteorder='big')  # 5
+        vh.video_info_index_size = int.from_bytes(reader.read(cls.video_info_index_bytes_cnt_len), byteorder='big')  # 5
+        vh.video_info_index_cnt = int.from_bytes(reader.read(cls.video_info_index_cnt_bytes_len), byteorder='big')  # 2
+
+        if b_marker == HEAD_FILE_MARKER_V2:
+            vh.cipher_mode = int.from_bytes(reader.read(cls.video_cipher_mode_bytes_cnt_len), byteorder='big')  # 1
+            ext_size = int.from_bytes(reader.read(cls.video_ext_size_bytes_cnt_len), byteorder='big')  # 4
+            vh.extensions = cls._ext_from_bytes(reader.read(ext_size))
 
         if vh.video_info_index_size > 0:
             for i in range(vh.video_info_index_cnt):
-                index_data = bis.read(VideoInfoIndex.video_info_index_len)
+                index_data = reader.read(VideoInfoIndex.video_info_index_len)
                 info_index = VideoInfoIndex.from_bytes(index_data)
                 vh.video_info_index.append(info_index)
 
-        block_index_size = vh.head_size - (
-                cls.video_marker_bytes_cnt +  # 7
-                cls.video_file_size_bytes_cnt_len +  # 5
-                cls.video_head_size_bytes_cnt_len +  # 4
-                cls.video_raw_file_size_bytes_cnt_len +  # 5
-                cls.video_info_index_bytes_cnt_len +  # 5
-                cls.video_info_index_cnt_bytes_len +  # 2
-                vh.video_info_index_size)
+        block_index_size = vh.head_size - vh.get_block_index_start()
         if block_index_size % VideoContentIndex.video_content_index_bytes != 0:
             raise Exception('head size incorrect', vh)
-        block_num = int(block_index_size / VideoContentIndex.video_content_index_bytes)
-        for idx in range(block_num):
-            block_data = bis.read(VideoContentIndex.video_content_index_bytes)
-            vbi = VideoContentIndex.from_bytes(block_data)
-            vh.block_index.append(vbi)
         return vh
 
+    def _create_derived_table(self) -> Optional[DerivedVideoBlockTable]:
+        """使用紧凑索引时根据扩展区中的数据创建索引表，数据块紧接在视频信息之后"""
+        ext_data = self.extensions.get(HEAD_EXT_DERIVED_INDEX)
+        if ext_data is None:
+            return None
+        if self.head_offset > 0:
+            # 文件头在文件末尾，数据块紧接在文件标记之后
+            data_start = self.video_marker_bytes_cnt
+        else:
+            data_start = self.head_size + sum(info_index.length for info_index in self.video_info_index)
+        return DerivedVideoBlockTable.from_ext_bytes(ext_data, self.raw_file_size, data_start)
+
+    @classmethod
+    def from_bytes(cls, data) -> VideoHeadType:
+        vh = cls._from_fixed_head(BytesIO(data))
+        derived_table = vh._create_derived_table()
+        if derived_table is not None:
+            vh.block_table = derived_table
+            return vh
+        block_index_start = vh.get_block_index_start()
+        vh.block_table = VideoBlockTable.from_bytes(memoryview(data)[block_index_start:vh.head_size])
+        return vh
+
+    @classmethod
+    def from_file_lazy(cls, reader) -> VideoHeadType:
+        """
+        只读取文件头中固定长度的部分和视频信息索引，数据块索引通过内存映射按需读取，
+        打开文件的耗时与文件大小无关。使用完毕后需要调用`close`
+        :param reader: 加密文件的输入流，必须是真实的文件
+        :return `VideoHead`对象
+
+        """
+        vh = cls._from_fixed_head(reader)
+        derived_table = vh._create_derived_table()
+        if derived_table is not None:
+            vh.block_table = derived_table
+            return vh
+        block_index_start = vh.get_block_index_start()
+        block_num = (vh.head_size - block_index_start) // VideoContentIndex.video_content_index_bytes
+        buffer = mmap.mmap(reader.fileno(), vh.head_size, access=mmap.ACCESS_READ)
+        vh.block_table = MappedVideoBlockTable(buffer, block_index_start, block_num)
+        return vh
+
+    def find_block(self, pos: int) -> int:
+        """查找原始文件中的位置所在的数据块，找不到时返回数据块数量"""
+        return self.block_table.find_block(pos)
+
+    def get_block_range(self, start: int, end: int) -> range:
+        """查找原始文件中`[start, end)`范围的数据所在的数据块"""
+        return self.block_table.get_block_range(start, end)
+
+    def get_block_spans(self, start: int, end: int) -> Iterator[VideoBlockSpan]:
+        """将原始文件中`[start, end)`范围的数据映射到数据块及其在加密文件中的位置"""
+        return self.block_table.get_block_spans(start, end)
+
+    def close(self):
+        """释放数据块索引占用的资源"""
+        self.block_table.close()
+
     @classmethod
-    def from_raw_file(cls, input_file: str, default_block_size: int = BLOCK_SIZE) -> VideoHeadType:
+    def from_raw_file(cls,
+                      input_file: str,
+                      default_block_size: int = BLOCK_SIZE,
+                      cipher_mode: int = CIPHER_MODE_CBC,
+                      compact: bool = False,
+                      align_keyframes: bool = False,
+                      tolerance: float = 0.25) -> VideoHeadType:
         """
         从文件中创建`VideoHead`对象
         :param input_file: 文件路径
         :param default_block_size: 数据块字节数，默认为1M
+        :param cipher_mode: 数据块的加密方式，`CIPHER_MODE_GCM`时使用EV000002格式
+        :param compact: 为`True`时使用紧凑索引（`DerivedVideoBlockTable`），文件头长度与文件大小无关，
+            只能与`CIPHER_MODE_GCM`一起使用
+        :param align_keyframes: 为`True`时解析MP4、MKV、MPEG-TS文件，在关键帧处分块，数据块大小不固定，
+            不能与`compact`一起使用。不支持的格式按`default_block_size`分块
+        :param tolerance: 对齐关键帧时数据块大小可以偏离`default_block_size`的比例
         :return `VideoHead`对象
 
         """
         file_size = os.path.getsize(input_file)
 
         vh = VideoHead()
+        vh.cipher_mode = cipher_mode
         vh.raw_file_size = file_size
         block_num = int(file_size / default_block_size)
         if file_size % default_block_size != 0:
             block_num += 1
 
-        for _ in range(block_num):
-            vbi = VideoContentIndex()
-            vh.block_index.append(vbi)
+        if compact:
+            if cipher_mode != CIPHER_MODE_GCM:
+                raise ValueError('compact block index requires CIPHER_MODE_GCM')
+            if align_keyframes:
+                raise ValueError('compact block index requires fixed block size')
+            vh.block_table = DerivedVideoBlockTable(os.urandom(FILE_NONCE_LEN), default_block_size, file_size)
+            vh.extensions[HEAD_EXT_DERIVED_INDEX] = vh.block_table.to_ext_bytes()
+        elif align_keyframes:
+            vh.keyframes = find_keyframes(input_file)
+            boundaries = plan_block_boundaries(file_size, vh.keyframes, default_block_size, tolerance, MAX_BLOCK_SIZE)
+            if file_size == 0:
+                boundaries = []
+            # 预先写入每个数据块在原始文件中的位置和大小，write_encrypt_video按此读取
+            vh.block_table = VideoBlockTable(len(boundaries))
+            for i, raw_start_pos in enumerate(boundaries):
+                raw_end_pos = boundaries[i + 1] if i + 1 < len(boundaries) else file_size
+                vh.block_table.raw_start_pos[i] = raw_start_pos
+                vh.block_table.data_size[i] = raw_end_pos - raw_start_pos
+        else:
+            vh.block_table = VideoBlockTable(block_num)
 
         vh.update_head_size()
         return vh
@@ -276,6 +1436,8 @@ class VideoInfo:
     head_all_info_bytes_cnt_len = 2  # 所有信息数量的数值占用的字节数
 
     data_bytes_cnt_len = 3  # 信息数据长度的数值占用的字节数
+    large_data_bytes_cnt_len = 8  # `INFO_FORMAT_LARGE`、`INFO_FORMAT_COMPACT`中信息数据长度的数值占用的字节数
+    name_bytes_cnt_len = 2  # `INFO_FORMAT_COMPACT`中名字长度的数值占用的字节数
     name_max_length = 1024  # 信息名字最大长度
     data_max_len = pow(2, 3 * 8) - 1  # 信息数据的最大长度
 
@@ -299,17 +1461,37 @@ class VideoInfo:
             return os.stat(data.name).st_size
         raise Exception('Unsupported IO')
 
-    def _load_data(self, data: Union[bytes, BytesIO, FileIO]) -> bytes:
+    def _iter_data(self, data: Union[bytes, BytesIO, FileIO], chunk_size: int) -> Iterator[bytes]:
+        """按`chunk_size`分块返回数据，文件每次只读取一块"""
         if isinstance(data, bytes):
-            return data
-        if isinstance(data, BytesIO):
-            data.seek(0)
-            return data.read()
-        if isinstance(data, FileIO):
+            view = memoryview(data)
+            for start in range(0, len(data), chunk_size):
+                yield view[start:start + chunk_size]
+            return
+        if isinstance(data, (BytesIO, FileIO)):
             data.seek(0)
-            return data.read()
+            while True:
+                chunk = data.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
         raise Exception('Unsupported IO')
 
+    @classmethod
+    def get_data_bytes_cnt_len(cls, info_format: int = INFO_FORMAT_PADDED) -> int:
+        if info_format == INFO_FORMAT_PADDED:
+            return cls.data_bytes_cnt_len
+        if info_format in (INFO_FORMAT_LARGE, INFO_FORMAT_COMPACT):
+            return cls.large_data_bytes_cnt_len
+        raise VideoInfoException(f'unsupported info format {info_format}')
+
+    def get_info_format(self) -> int:
+        """能够保存所有数据的编码格式，数据都不超过16M时与原来的格式相同"""
+        for name in self.info:
+            if self._get_data_length(self.info[name]) > self.data_max_len:
+                return INFO_FORMAT_LARGE
+        return INFO_FORMAT_PADDED
+
     def _close_data(self, data: Union[bytes, BytesIO, FileIO]) -> None:
         if isinstance(data, bytes):
             return
@@ -327,55 +1509,96 @@ class VideoInfo:
     def update_video_info_cnt(self):
         self.video_info_cnt = len(self.info)
 
-    def to_bytes(self) -> bytes:
+    def to_bytes(self, info_format: int = INFO_FORMAT_PADDED) -> bytes:
+        return b''.join(self.iter_bytes(info_format))
 
+    def iter_bytes(self, info_format: int = INFO_FORMAT_PADDED, chunk_size: int = INFO_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        分块返回序列化以后的数据，数据按`chunk_size`读取，内存占用与数据大小无关
+        :param info_format: 编码格式
+        :param chunk_size: 每次读取的数据长度
+        """
         self.update_video_info_cnt()
-        bos = BytesIO()
-        bos.write(self.video_info_cnt.to_bytes(self.head_all_info_bytes_cnt_len, byteorder='big'))  # 2
+        data_bytes_cnt_len = self.get_data_bytes_cnt_len(info_format)
+        yield self.video_info_cnt.to_bytes(self.head_all_info_bytes_cnt_len, byteorder='big')  # 2
+        if info_format == INFO_FORMAT_COMPACT:
+            # 先写入所有名字和数据长度，再写入所有数据
+            table = bytearray()
+            for name in self.info:
+                table += len(name).to_bytes(self.name_bytes_cnt_len, byteorder='big')  # 2
+                table += name  # dynamic
+                table += self._get_data_length(self.info[name]).to_bytes(data_bytes_cnt_len, byteorder='big')  # 8
+            yield bytes(table)
+            for name in self.info:
+                yield from self._iter_data(self.info[name], chunk_size)  # dynamic
+                self._close_data(self.info[name])
+            return
         for name in self.info:
             data = self.info[name]
-            bos.write(self.pad(name, self.name_max_length))  # 1024
-            # bos.write(len(data).to_bytes(self.data_bytes_cnt_len, byteorder='big'))  # 3
             data_len = self._get_data_length(data)
-            bos.write(data_len.to_bytes(self.data_bytes_cnt_len, byteorder='big'))  # 3
-            loaded_data = self._load_data(data)
-            bos.write(loaded_data)  # dynamic
+            # 1024 + 3（INFO_FORMAT_LARGE为8）
+            yield self.pad(name, self.name_max_length) + data_len.to_bytes(data_bytes_cnt_len, byteorder='big')
+            yield from self._iter_data(data, chunk_size)  # dynamic
             self._close_data(data)
 
-        bos.seek(0)
-        return bos.read()
-
     def close_all_data_io(self):
         for name in self.info:
             data = self.info[name]
             self._close_data(data)
 
-    def create_video_info_index(self) -> VideoInfoIndex:
+    def create_video_info_index(self, info_format: int = INFO_FORMAT_PADDED) -> VideoInfoIndex:
         video_info_index = VideoInfoIndex()
         video_info_index.length = self.head_all_info_bytes_cnt_len
         for name in self.info:
             data = self.info[name]
-            video_info_index.length += self.name_max_length
-            video_info_index.length += self.data_bytes_cnt_len
+            if info_format == INFO_FORMAT_COMPACT:
+                video_info_index.length += self.name_bytes_cnt_len + len(name)
+            else:
+                video_info_index.length += self.name_max_length
+            video_info_index.length += self.get_data_bytes_cnt_len(info_format)
             video_info_index.length += self._get_data_length(data)
         return video_info_index
 
     @classmethod
-    def from_bytes(cls, data):
+    def from_bytes(cls, data, info_format: int = INFO_FORMAT_PADDED):
         vi = VideoInfo()
-        bis = BytesIO(data)
-        b_video_info_cnt = bis.read(cls.head_all_info_bytes_cnt_len)
-        vi.video_info_cnt = int.from_bytes(b_video_info_cnt, byteorder='big')
-        for i in range(vi.video_info_cnt):
-            b_name = bis.read(cls.name_max_length)
-            b_name = VideoInfo.unpad(b_name)
-            b_data_len = bis.read(cls.data_bytes_cnt_len)
-            data_len = int.from_bytes(b_data_len, byteorder='big')
-            b_data = bis.read(data_len)
-            vi.info[b_name] = b_data
+        view = memoryview(data)
+        data_bytes_cnt_len = cls.get_data_bytes_cnt_len(info_format)
+        pos = cls.head_all_info_bytes_cnt_len
+        vi.video_info_cnt = int.from_bytes(view[:pos], byteorder='big')
+        if info_format == INFO_FORMAT_COMPACT:
+            entries, pos = cls._read_compact_table(view, vi.video_info_cnt)
+            for name, data_len in entries:
+                vi.info[name] = bytes(view[pos:pos + data_len])
+                pos += data_len
+        else:
+            for i in range(vi.video_info_cnt):
+                b_name = VideoInfo.unpad(bytes(view[pos:pos + cls.name_max_length]))
+                pos += cls.name_max_length
+                data_len = int.from_bytes(view[pos:pos + data_bytes_cnt_len], byteorder='big')
+                pos += data_bytes_cnt_len
+                vi.info[b_name] = bytes(view[pos:pos + data_len])
+                pos += data_len
         vi.update_video_info_cnt()
         return vi
 
+    @classmethod
+    def _read_compact_table(cls, view: memoryview, count: int) -> Tuple[List[Tuple[bytes, int]], int]:
+        """读取`INFO_FORMAT_COMPACT`开头的名字和数据长度，返回列表和第一个数据的位置"""
+        entries = []
+        pos = cls.head_all_info_bytes_cnt_len
+        for _ in range(count):
+            name_len = int.from_bytes(view[pos:pos + cls.name_bytes_cnt_len], byteorder='big')
+            pos += cls.name_bytes_cnt_len
+            name = bytes(view[pos:pos + name_len])
+            pos += name_len
+            data_len = int.from_bytes(view[pos:pos + cls.large_data_bytes_cnt_len], byteorder='big')
+            pos += cls.large_data_bytes_cnt_len
+            if pos > len(view):
+                raise VideoInfoException('video info table truncated')
+            entries.append((name, data_len))
+        return entries, pos
+
     @classmethod
     def pad(cls, data: bytes, length: int) -> bytes:
         data_len = len(data)
@@ -386,13 +1609,294 @@ class VideoInfo:
 
     @classmethod
     def unpad(cls, data: bytes) -> bytes:
-        result = bytearray(b'')
-        data_array = [b'%c' % i for i in data]
-        for b in data_array:
-            if b == cls.PAD_DATA:
-                continue
-            result += b
-        return bytes(result)
+        return data.replace(cls.PAD_DATA, b'')
+
+
+class VideoSeekIndex:
+    """
+    关键帧的时间到原始文件位置和数据块序号的索引，加密时生成，保存在视频信息中（`INFO_SEEK_INDEX`），
+    播放器跳转时不需要通过解密流读取容器中的索引就能找到目标数据块
+
+    每个关键帧按时间、位置、数据块序号的顺序保存，按时间排序
+    """
+
+    time_bytes_len = 5  #: 关键帧时间（毫秒）的数值占用的字节长度
+    pos_bytes_len = VideoContentIndex.raw_start_pos_bytes_len  #: 关键帧在原始文件中位置的数值占用的字节长度
+    block_bytes_len = 4  #: 数据块序号的数值占用的字节长度
+    entry_bytes_len = time_bytes_len + pos_bytes_len + block_bytes_len
+
+    def __init__(self):
+        self.times = array('Q')  #: 关键帧的时间（毫秒）
+        self.positions = array('Q')  #: 关键帧在原始文件中的位置
+        self.blocks = array('Q')  #: 关键帧所在的数据块序号
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, time_ms: int, pos: int, block: int):
+        self.times.append(time_ms)
+        self.positions.append(pos)
+        self.blocks.append(block)
+
+    def find(self, time: float) -> int:
+        """
+        找到时间不晚于`time`的最后一个关键帧
+        :param time: 时间（秒）
+        :return 关键帧序号，索引为空时返回-1
+        """
+        if len(self) == 0:
+            return -1
+        return max(bisect_right(self.times, int(time * 1000)) - 1, 0)
+
+    def get_position(self, time: float) -> Optional[int]:
+        """跳转到`time`时开始读取的原始文件位置"""
+        idx = self.find(time)
+        return None if idx < 0 else self.positions[idx]
+
+    def get_block(self, time: float) -> Optional[int]:
+        """跳转到`time`时开始读取的数据块序号"""
+        idx = self.find(time)
+        return None if idx < 0 else self.blocks[idx]
+
+    def to_bytes(self) -> bytes:
+        bos = BytesIO()
+        for i in range(len(self)):
+            bos.write(self.times[i].to_bytes(self.time_bytes_len, byteorder='big'))
+            bos.write(self.positions[i].to_bytes(self.pos_bytes_len, byteorder='big'))
+            bos.write(self.blocks[i].to_bytes(self.block_bytes_len, byteorder='big'))
+        return bos.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if len(data) % cls.entry_bytes_len != 0:
+            raise VideoInfoException('invalid seek index length')
+        seek_index = VideoSeekIndex()
+        for start in range(0, len(data), cls.entry_bytes_len):
+            pos_start = start + cls.time_bytes_len
+            block_start = pos_start + cls.pos_bytes_len
+            seek_index.append(int.from_bytes(data[start:pos_start], byteorder='big'),
+                              int.from_bytes(data[pos_start:block_start], byteorder='big'),
+                              int.from_bytes(data[block_start:start + cls.entry_bytes_len], byteorder='big'))
+        return seek_index
+
+    @classmethod
+    def from_keyframes(cls, keyframes: List[Keyframe], block_starts: List[int]):
+        """
+        根据关键帧创建索引，没有时间的关键帧不加入索引
+        :param keyframes: 关键帧
+        :param block_starts: 按顺序排列的每个数据块在原始文件中的起始位置
+        """
+        seek_index = VideoSeekIndex()
+        for k in sorted((k for k in keyframes if k.time is not None and k.time >= 0), key=lambda k: k.time):
+            seek_index.append(int(k.time * 1000), k.pos, max(bisect_right(block_starts, k.pos) - 1, 0))
+        return seek_index
+
+
+class TrickplayIndex:
+    """
+    预览缩略图（trickplay）索引，保存在视频信息中（`INFO_TRICKPLAY_INDEX`）
+
+    缩略图按时间顺序从左到右、从上到下排列在多张拼图（sprite sheet）中，每张拼图保存在单独的视频信息中（`INFO_TRICKPLAY_SHEET`），
+    依次位于索引之后，显示一张缩略图只需要解密一个视频信息。拼图为JPEG格式，末尾可能有填充的0
+    """
+
+    interval_bytes_len = 4  #: 缩略图间隔（毫秒）的数值占用的字节长度
+    size_bytes_len = 2  #: 缩略图宽度、高度、拼图列数、行数的数值占用的字节长度
+    count_bytes_len = 4  #: 缩略图数量的数值占用的字节长度
+    time_bytes_len = 5  #: 缩略图时间（毫秒）的数值占用的字节长度
+    sheet_len_bytes_len = 4  #: 拼图数据长度的数值占用的字节长度
+    fixed_bytes_len = interval_bytes_len + size_bytes_len * 4 + count_bytes_len
+
+    def __init__(self, interval: int = 0, tile_width: int = 0, tile_height: int = 0, columns: int = 0, rows: int = 0):
+        self.interval = interval  #: 缩略图间隔（毫秒）
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = columns  #: 每张拼图的列数
+        self.rows = rows  #: 每张拼图的行数
+        self.times = array('Q')  #: 每张缩略图实际的时间（毫秒）
+        self.sheet_lengths = array('Q')  #: 每张拼图JPEG数据的长度，不包括填充的0
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def tiles_per_sheet(self) -> int:
+        return self.columns * self.rows
+
+    @property
+    def sheet_num(self) -> int:
+        return (len(self) + self.tiles_per_sheet - 1) // self.tiles_per_sheet
+
+    @classmethod
+    def get_bytes_len(cls, tile_num: int, sheet_num: int) -> int:
+        """索引数据的字节数，与缩略图的内容无关，可以在生成缩略图之前占位"""
+        return cls.fixed_bytes_len + tile_num * cls.time_bytes_len + sheet_num * cls.sheet_len_bytes_len
+
+    def find(self, time: float) -> int:
+        """
+        找到时间不晚于`time`的最后一张缩略图
+        :param time: 时间（秒）
+        :return 缩略图序号，没有缩略图时返回-1
+        """
+        if len(self) == 0:
+            return -1
+        return max(bisect_right(self.times, int(time * 1000)) - 1, 0)
+
+    def get_tile_rect(self, idx: int) -> Tuple[int, int, int, int, int]:
+        """
+        缩略图所在的拼图序号和在拼图中的位置
+        :return 拼图序号、x、y、宽度、高度
+        """
+        sheet, n = divmod(idx, self.tiles_per_sheet)
+        row, column = divmod(n, self.columns)
+        return sheet, column * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height
+
+    def to_bytes(self) -> bytes:
+        bos = BytesIO()
+        bos.write(self.interval.to_bytes(self.interval_bytes_len, byteorder='big'))
+        for value in (self.tile_width, self.tile_height, self.columns, self.rows):
+            bos.write(value.to_bytes(self.size_bytes_len, byteorder='big'))
+        bos.write(len(self).to_bytes(self.count_bytes_len, byteorder='big'))
+        for t in self.times:
+            bos.write(t.to_bytes(self.time_bytes_len, byteorder='big'))
+        for length in self.sheet_lengths:
+            bos.write(length.to_bytes(self.sheet_len_bytes_len, byteorder='big'))
+        return bos.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        bis = BytesIO(data)
+        index = TrickplayIndex(int.from_bytes(bis.read(cls.interval_bytes_len), byteorder='big'),
+                               *[int.from_bytes(bis.read(cls.size_bytes_len), byteorder='big') for _ in range(4)])
+        tile_num = int.from_bytes(bis.read(cls.count_bytes_len), byteorder='big')
+        if index.tiles_per_sheet == 0 or len(data) != cls.get_bytes_len(
+                tile_num, (tile_num + index.tiles_per_sheet - 1) // index.tiles_per_sheet):
+            raise VideoInfoException('invalid trickplay index')
+        for _ in range(tile_num):
+            index.times.append(int.from_bytes(bis.read(cls.time_bytes_len), byteorder='big'))
+        for _ in range(index.sheet_num):
+            index.sheet_lengths.append(int.from_bytes(bis.read(cls.sheet_len_bytes_len), byteorder='big'))
+        return index
+
+
+def _ordered_map(func: Callable, items, workers: int = 1, use_processes: bool = False, max_in_flight: int = None):
+    """
+    并行执行`func`，按`items`的顺序返回结果，同时处理中的数据数量有上限，避免占用过多内存
+
+    :param func: 处理函数，使用进程池时必须是模块级的函数
+    :param items: 处理函数的参数列表
+    :param workers: 线程或进程数量，为1时在当前线程中执行
+    :param use_processes: 为`True`时使用进程池，否则使用线程池
+    :param max_in_flight: 同时处理中的数据数量上限，为`None`时为`workers`的2倍
+    """
+    if workers <= 1:
+        for args in items:
+            yield func(*args)
+        return
+
+    max_in_flight = max(max_in_flight or workers * 2, 1)
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        pending = deque()
+        for args in items:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def _read_blocks(input_stream: IO, block_sizes, file_hash=None):
+    """
+    依次读取原始文件的数据块，返回数据块序号、在原始文件中的起始位置和数据
+    :param block_sizes: 每个数据块的原始数据大小
+    :param file_hash: 指定时计算原始文件的摘要
+    """
+    for i, block_size in enumerate(block_sizes):
+        raw_start_pos = input_stream.tell()
+        data = input_stream.read(block_size)
+        if file_hash is not None:
+            file_hash.update(data)
+        yield i, raw_start_pos, data
+
+
+def _encrypt_blocks(cipher: CipherEngine,
+                    blocks,
+                    workers: int = 1,
+                    use_processes: bool = False,
+                    digest: bool = False,
+                    ivs=None):
+    """
+    加密数据块，按原来的顺序返回数据块序号、在原始文件中的起始位置、数据长度、偏移向量、加密后的数据和原始数据的摘要
+
+    :param cipher: 加密引擎，整个文件共用一个
+    :param blocks: `_read_blocks`返回的数据块，序号从0开始连续
+    :param workers: 并行加密的线程或进程数量，为1时在当前线程中加密
+    :param use_processes: 为`True`时使用进程池，否则使用线程池
+    :param digest: 为`True`时计算原始数据的摘要，否则摘要为`None`
+    :param ivs: 按数据块序号指定偏移向量，为`None`时随机生成
+    """
+    # 批量接口只接收数据，数据块的位置按顺序保存，与结果一一对应
+    positions = deque()
+
+    def data_list():
+        for i, raw_start_pos, data in blocks:
+            positions.append((i, raw_start_pos, len(data)))
+            yield data
+
+    for result in cipher.encrypt_many(data_list(), workers, ivs, use_processes, digest):
+        i, raw_start_pos, data_size = positions.popleft()
+        iv, enc_data, block_digest = result if digest else (*result, None)
+        yield i, raw_start_pos, data_size, iv, enc_data, block_digest
+
+
+def _write_encrypt_info(cipher: CipherEngine, info: VideoInfo, info_format: int, write: Callable[[bytes], None]):
+    """
+    分块序列化并加密视频信息，每次只处理`INFO_CHUNK_SIZE`字节
+    :param write: 写入加密数据的函数
+    :return 视频信息索引
+    """
+    encryptor = cipher.create_encryptor()
+    length = 0
+    for chunk in info.iter_bytes(info_format):
+        enc_data = encryptor.update(chunk)
+        write(enc_data)
+        length += len(enc_data)
+    enc_data = encryptor.finalize()
+    write(enc_data)
+    info_index = VideoInfoIndex(length + len(enc_data))
+    info_index.iv = encryptor.iv
+    return info_index
+
+
+def _get_info_format(info_list: List[VideoInfo], info_format: int = None) -> int:
+    """
+    选择视频信息的编码格式
+    :param info_format: 指定的格式，为`None`或`INFO_FORMAT_PADDED`时根据数据长度选择原来的格式
+    """
+    if info_format is not None and info_format != INFO_FORMAT_PADDED:
+        return info_format
+    return max((info.get_info_format() for info in info_list), default=INFO_FORMAT_PADDED)
+
+
+def create_digest_info(block_digests: bytes, file_digest: bytes) -> VideoInfo:
+    """
+    创建保存原始数据摘要的视频信息
+    :param block_digests: 按顺序连接的所有数据块原始数据的摘要
+    :param file_digest: 原始文件的摘要
+    """
+    video_info = VideoInfo()
+    video_info.add_info(INFO_DIGEST_ALGORITHM, DIGEST_ALGORITHM.encode('utf-8'))
+    video_info.add_info(INFO_BLOCK_DIGESTS, block_digests)
+    video_info.add_info(INFO_FILE_DIGEST, file_digest)
+    return video_info
+
+
+def create_seek_index_info(seek_index: VideoSeekIndex) -> VideoInfo:
+    """创建保存关键帧跳转索引的视频信息"""
+    video_info = VideoInfo()
+    video_info.add_info(INFO_SEEK_INDEX, seek_index.to_bytes())
+    return video_info
 
 
 def write_encrypt_video(key: bytes,
@@ -401,160 +1905,831 @@ def write_encrypt_video(key: bytes,
                         input_stream: IO,
                         output_stream: IO,
                         default_block_size=BLOCK_SIZE,
-                        videowritehook: Callable[[int, int], None] = None) -> None:
+                        videowritehook: Callable[[int, int], None] = None,
+                        workers: int = 1,
+                        use_processes: bool = False,
+                        pipeline: StagedPipeline = None,
+                        digest: bool = False,
+                        envelope: bool = False,
+                        key_check: bool = False,
+                        seek_index: bool = False,
+                        trickplay=None,
+                        info_format: int = None) -> None:
     """
         写加密视频文件
 
         :param key: 加密使用的密钥
-        :param head: 视频头
+        :param head: 视频头，数据块和视频信息使用`head.cipher_mode`指定的方式加密
         :param info_list: 视频信息
         :param input_stream: 原始文件的输入流
         :param output_stream: 目标文件的输出流
         :param default_block_size: 视频文件默认块字节数
         :param videowritehook: 写入文件后调用
+        :param workers: 并行加密数据块的线程或进程数量，数据块仍按顺序写入
+        :param use_processes: 为`True`时使用进程池并行加密，否则使用线程池
+        :param pipeline: 指定时读取、加密、写入分别在不同的线程中同时进行，阶段之间的队列长度由`pipeline`指定，
+            写入完成后可以通过`pipeline.stats`查看各阶段的耗时。每次写入需要使用新的`StagedPipeline`
+        :param digest: 为`True`时在加密的同时计算每个数据块和整个原始文件的摘要，保存在最后一个视频信息中，
+            可以使用`verify_encrypt_video`校验
+        :param envelope: 为`True`时使用随机生成的数据密钥加密，`key`只用于加密文件头中的数据密钥，
+            更换密钥时使用`update_video_keys`只重写文件头。`head`中已经有密钥槽时也使用数据密钥
+        :param key_check: 为`True`时在文件头中保存密钥标识和校验值，使用数据密钥时总是保存
+        :param seek_index: 为`True`时解析MP4、MKV、MPEG-TS文件的关键帧，将时间到原始文件位置和数据块序号的索引
+            （`VideoSeekIndex`）保存在视频信息中。`head`由`from_raw_file(align_keyframes=True)`创建时不再重复解析
+        :param trickplay: 预览缩略图生成器（`gxbzys.trickplay.TrickplayGenerator`），指定时在加密数据块的同时
+            在后台线程中生成缩略图拼图，保存在视频信息中
+        :param info_format: 视频信息的编码格式，`INFO_FORMAT_COMPACT`不再把名字补齐到1024字节，解析更快。
+            为`None`时使用原来的格式，有超过16M的数据时使用`INFO_FORMAT_LARGE`
 
     """
 
+    if envelope and not head.has_key_slots():
+        head.create_key_slots(key)
+    elif key_check and not head.has_key_slots():
+        head.set_key_check(key)
+    key = head.get_data_key(key)
+    cipher = create_cipher_engine(key, head.cipher_mode)
+    logging.getLogger('write_encrypt_video').debug(f'cipher engine: {cipher.name}, workers: {workers}')
+    block_table = head.block_table
+    block_num = len(block_table)
+    digest_size = hashlib.new(DIGEST_ALGORITHM).digest_size
+    file_hash = hashlib.new(DIGEST_ALGORITHM) if digest else None
+    if block_num > 0 and not block_table.fixed_iv and block_table.data_size[0] > 0:
+        # 数据块大小已经由from_raw_file确定（对齐关键帧）
+        block_sizes = list(block_table.data_size)
+    else:
+        block_sizes = [default_block_size] * block_num
+    if seek_index:
+        keyframes = head.keyframes if head.keyframes is not None else find_keyframes(input_stream)
+        block_starts = [0] + list(accumulate(block_sizes[:-1]))
+        index = VideoSeekIndex.from_keyframes(keyframes, block_starts)
+        if len(index) > 0:
+            info_list = list(info_list) + [create_seek_index_info(index)]
+    # 先用长度相同的空数据占位，数据块写入后再生成的视频信息，按序号保存生成函数
+    deferred_infos: Dict[int, Callable[[], VideoInfo]] = {}
+    if trickplay is not None and trickplay.enabled:
+        trickplay_infos = trickplay.create_placeholder_infos()
+        for i in range(len(trickplay_infos)):
+            deferred_infos[len(info_list) + i] = lambda i=i: trickplay.create_infos()[i]
+        info_list = list(info_list) + trickplay_infos
+        trickplay.start()
+    if digest:
+        deferred_infos[len(info_list)] = lambda: create_digest_info(bytes(block_digests), file_hash.digest())
+        info_list = list(info_list) + [create_digest_info(bytes(digest_size * block_num), bytes(digest_size))]
+
     video_info_index = [VideoInfoIndex() for _ in info_list]
     head.video_info_index = video_info_index
+    head.info_format = info_format = _get_info_format(info_list, info_format)
 
     head.update_head_size()
     output_stream.write(head.to_bytes())
 
-    # 写入信息块
+    # 写入信息块，较大的数据分块读取和加密
+    info_positions = []
     for i, info in enumerate(info_list):
-        info_bytes = info.to_bytes()
-        iv, enc_info_bytes = encrypt_data1(key, info_bytes)
-        head.video_info_index[i].iv = iv
-        head.video_info_index[i].length = len(enc_info_bytes)
-        output_stream.write(enc_info_bytes)
+        info_positions.append(output_stream.tell())
+        head.video_info_index[i] = _write_encrypt_info(cipher, info, info_format, output_stream.write)
 
     # 写入视频内容
-    block_index = head.block_index
     start_pos = output_stream.tell()
     input_stream.seek(0)
-    for i, block in enumerate(block_index):
-
-        block.raw_start_pos = input_stream.tell()
-        video_data = input_stream.read(default_block_size)
-
-        iv, enc_data = encrypt_data1(key, video_data)
-
-        block.data_size = len(video_data)
-        block.block_size = len(enc_data)
-        block.start_pos = start_pos
-        block.iv = iv
-
-        start_pos += block.block_size
-        output_stream.write(enc_data)
-        if videowritehook is not None:
-            videowritehook(i, len(block_index))
+    block_digests = bytearray()
+    ivs = None
+    if block_table.fixed_iv:
+        block_table.data_start = start_pos
+        ivs = block_table.iv
+    if pipeline is None:
+        blocks = _read_blocks(input_stream, block_sizes, file_hash)
+        encrypted_blocks = _encrypt_blocks(cipher, blocks, workers, use_processes, digest, ivs)
+    else:
+        # 写入在当前线程中进行，videowritehook也在当前线程中调用
+        pipeline.add_stage('read', lambda _: _read_blocks(input_stream, block_sizes, file_hash))
+        pipeline.add_stage('encrypt',
+                           lambda blocks: _encrypt_blocks(cipher, blocks, workers, use_processes, digest, ivs))
+        encrypted_blocks = pipeline.run()
+
+    try:
+        for i, raw_start_pos, data_size, iv, enc_data, block_digest in encrypted_blocks:
+
+            block_table.set_block(i, iv, data_size, start_pos, raw_start_pos, len(enc_data))
+
+            start_pos += len(enc_data)
+            output_stream.write(enc_data)
+            if digest:
+                block_digests += block_digest
+            if videowritehook is not None:
+                videowritehook(i, block_num)
+    except BaseException:
+        if trickplay is not None:
+            trickplay.close()
+        raise
+    finally:
+        encrypted_blocks.close()
 
     head.file_size = output_stream.tell()
 
+    # 写入摘要等数据块写入后生成的视频信息，加密后的长度与占位数据相同
+    for i, create_info in deferred_infos.items():
+        iv, enc_info_bytes = cipher.encrypt(create_info().to_bytes(info_format))
+        if len(enc_info_bytes) != head.video_info_index[i].length:
+            raise VideoInfoException('deferred info length changed')
+        head.video_info_index[i].iv = iv
+        output_stream.seek(info_positions[i])
+        output_stream.write(enc_info_bytes)
+
     # 头信息更新，重新写入
     output_stream.seek(0)
     output_stream.write(head.to_bytes())
 
 
-class VideoStream:
+def verify_encrypt_video(key: bytes,
+                         file_path: str,
+                         workers: int = os.cpu_count() or 1,
+                         videoverifyhook: Callable[[int, int], None] = None) -> bool:
+    """
+        使用`write_encrypt_video`写入的摘要校验加密视频文件，并行解密数据块并计算摘要，不需要原始文件
+
+        :param key: 密钥
+        :param file_path: 加密文件路径
+        :param workers: 并行解密的线程数量
+        :param videoverifyhook: 校验一个数据块后调用，参数为数据块序号和数据块数量
+        :return 所有数据块和整个文件的摘要都一致时返回`True`
+
+    """
+    stream = VideoStream(file_path, key)
+    stream.open()
+    try:
+        digest_info = None
+        if stream.video_info_reader is not None:
+            stream.video_info_reader.open()
+            for video_info in stream.video_info_reader.read():
+                if INFO_BLOCK_DIGESTS in video_info.info:
+                    digest_info = video_info
+        if digest_info is None:
+            raise VideoInfoException('digest not found')
+
+        algorithm = digest_info.info[INFO_DIGEST_ALGORITHM].decode('utf-8')
+        digest_size = hashlib.new(algorithm).digest_size
+        block_digests = digest_info.info[INFO_BLOCK_DIGESTS]
+        block_num = len(stream.head.block_table)
+        if algorithm != DIGEST_ALGORITHM or len(block_digests) != block_num * digest_size:
+            return False
+
+        file_hash = hashlib.new(algorithm)
+        results = stream.cipher.decrypt_many(stream._read_blocks(range(block_num)), workers, digest=True)
+        try:
+            for idx, (data, block_digest) in enumerate(results):
+                if block_digest != block_digests[idx * digest_size:(idx + 1) * digest_size]:
+                    return False
+                file_hash.update(data)
+                if videoverifyhook is not None:
+                    videoverifyhook(idx, block_num)
+        finally:
+            # 等待所有解密任务结束后再关闭文件
+            results.close()
+        return file_hash.digest() == digest_info.info[INFO_FILE_DIGEST]
+    finally:
+        stream.close()
+
+
+def decrypt_video(key: bytes,
+                  file_path: str,
+                  writer: IO,
+                  start: int = 0,
+                  end: int = None,
+                  workers: int = os.cpu_count() or 1,
+                  videodecrypthook: Callable[[int, int], None] = None) -> int:
+    """
+        并行解密加密视频文件，按顺序把原始数据写入`writer`
+
+        :param key: 密钥
+        :param file_path: 加密文件路径
+        :param writer: 输出流
+        :param start: 导出范围在原始文件中的起始位置
+        :param end: 导出范围在原始文件中的结束位置，不包含，为`None`时到文件末尾。只解密范围涉及的数据块
+        :param workers: 并行解密的线程数量
+        :param videodecrypthook: 写入一个数据块后调用，参数为范围内的数据块序号和数据块数量
+        :return 写入的字节数
+
+    """
+    with VideoStream(file_path, key) as stream:
+        end = stream.head.raw_file_size if end is None else min(end, stream.head.raw_file_size)
+        block_num = len(stream.head.get_block_range(start, end))
+        size = 0
+        for i, data in enumerate(stream.iter_blocks(start, end, workers=workers)):
+            writer.write(data)
+            size += len(data)
+            if videodecrypthook is not None:
+                videodecrypthook(i, block_num)
+        return size
+
+
+def update_video_keys(file_path: str,
+                      key: bytes,
+                      add_keys: List[bytes] = (),
+                      remove_keys: List[bytes] = ()) -> None:
+    """
+        修改使用数据密钥加密的文件的授权密钥，只重写文件头，文件头长度不变
+
+        更换密钥：`update_video_keys(file_path, old_key, add_keys=[new_key], remove_keys=[old_key])`
+
+        :param file_path: 加密文件路径
+        :param key: 已经授权的用户密钥
+        :param add_keys: 需要授权的用户密钥
+        :param remove_keys: 需要取消授权的用户密钥，先增加再删除
+
+    """
+    with open(file_path, 'r+b') as stream:
+        head = VideoHead.from_file(stream)
+        if not head.has_key_slots():
+            raise VideoDecryptException('file is not encrypted with a data key')
+        head.get_data_key(key)
+        for new_key in add_keys:
+            head.add_key(key, new_key)
+        for old_key in remove_keys:
+            head.remove_key(old_key)
+        head_bytes = head.to_bytes()
+        if len(head_bytes) != head.head_size:
+            raise VideoDecryptException('head size changed')
+        stream.seek(head.head_offset)
+        stream.write(head_bytes)
+        stream.flush()
+        os.fsync(stream.fileno())
+
+
+class EncryptedVideoWriter:
+    """
+    流式写加密视频文件，可以写入管道等不能`seek`的输出流，不需要事先知道原始数据的长度
+
+    文件开头只写入文件标记`EV000003`，之后依次是数据块、视频信息、文件头、文件头长度（4个字节）和文件标记，
+    文件头在所有数据写完以后写入，`VideoStream`可以读取
+
+    :param key: 加密使用的密钥
+    :param output_stream: 输出流，只需要`write`
+    :param info_list: 视频信息
+    :param block_size: 原始数据块的大小
+    :param cipher_mode: 加密方式
+    :param envelope: 为`True`时使用随机生成的数据密钥加密，见`write_encrypt_video`
+    :param key_check: 为`True`时在文件头中保存密钥标识和校验值
+    :param digest: 为`True`时计算每个数据块和整个原始文件的摘要，保存在最后一个视频信息中
+    :param compact: 为`True`时使用紧凑索引，只能与`CIPHER_MODE_GCM`一起使用
+    :param info_format: 视频信息的编码格式，见`write_encrypt_video`
+    """
+
+    def __init__(self,
+                 key: bytes,
+                 output_stream: IO,
+                 info_list: List[VideoInfo] = (),
+                 block_size: int = BLOCK_SIZE,
+                 cipher_mode: int = CIPHER_MODE_CBC,
+                 envelope: bool = False,
+                 key_check: bool = False,
+                 digest: bool = False,
+                 compact: bool = False,
+                 info_format: int = None):
+        if compact and cipher_mode != CIPHER_MODE_GCM:
+            raise ValueError('compact block index requires CIPHER_MODE_GCM')
+        self.output_stream = output_stream
+        self.info_list = list(info_list)
+        self.info_format = info_format
+        self.block_size = block_size
+        self.head = VideoHead()
+        self.head.cipher_mode = cipher_mode
+        if envelope:
+            self.head.create_key_slots(key)
+        elif key_check:
+            self.head.set_key_check(key)
+        self.cipher = create_cipher_engine(self.head.get_data_key(key), cipher_mode)
+        self.file_nonce = os.urandom(FILE_NONCE_LEN) if compact else None
+        self.file_hash = hashlib.new(DIGEST_ALGORITHM) if digest else None
+        self.block_digests = bytearray()
+        self.closed = False
+
+        self._buffer = bytearray()
+        self._raw_pos = 0
+        self._pos = 0
+        self._write(HEAD_FILE_MARKER_STREAM)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # 出错时不写入文件头，输出的文件不完整
+        if exc_type is None:
+            self.close()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        """写入原始数据，凑满一个数据块时加密并写入输出流"""
+        if self.closed:
+            raise ValueError('write to closed writer')
+        self._buffer += data
+        offset = 0
+        while len(self._buffer) - offset >= self.block_size:
+            self._write_block(memoryview(self._buffer)[offset:offset + self.block_size])
+            offset += self.block_size
+        del self._buffer[:offset]
+        return len(data)
+
+    def close(self):
+        """加密剩余的数据，写入视频信息和文件头，不关闭输出流"""
+        if self.closed:
+            return
+        if len(self._buffer) > 0:
+            self._write_block(self._buffer)
+            self._buffer = bytearray()
+        self.head.raw_file_size = self._raw_pos
+
+        info_list = self.info_list
+        if self.file_hash is not None:
+            info_list = info_list + [create_digest_info(bytes(self.block_digests), self.file_hash.digest())]
+        self.head.info_format = info_format = _get_info_format(info_list, self.info_format)
+        self.head.video_info_index = [_write_encrypt_info(self.cipher, info, info_format, self._write)
+                                      for info in info_list]
+
+        if self.file_nonce is not None:
+            self.head.block_table = DerivedVideoBlockTable(self.file_nonce, self.block_size, self._raw_pos,
+                                                           VideoHead.video_marker_bytes_cnt)
+            self.head.extensions[HEAD_EXT_DERIVED_INDEX] = self.head.block_table.to_ext_bytes()
+        self.head.update_head_size()
+        self.head.head_offset = self._pos
+        footer_size = STREAM_FOOTER_SIZE_BYTES_LEN + VideoHead.video_marker_bytes_cnt
+        self.head.file_size = self._pos + self.head.head_size + footer_size
+        head_bytes = self.head.to_bytes()
+        self._write(head_bytes)
+        self._write(len(head_bytes).to_bytes(STREAM_FOOTER_SIZE_BYTES_LEN, byteorder='big'))
+        self._write(HEAD_FILE_MARKER_STREAM)
+        if hasattr(self.output_stream, 'flush'):
+            self.output_stream.flush()
+        self.closed = True
+
+    def _write(self, data):
+        self.output_stream.write(data)
+        self._pos += len(data)
+
+    def _write_block(self, data):
+        iv = None
+        if self.file_nonce is not None:
+            idx = self._raw_pos // self.block_size
+            iv = self.file_nonce + idx.to_bytes(4, byteorder='big') + bytes(4)
+        data = bytes(data)
+        iv, enc_data = self.cipher.encrypt(data, iv)
+        if self.file_nonce is None:
+            self.head.block_table.append(iv, len(data), self._pos, self._raw_pos, len(enc_data))
+        if self.file_hash is not None:
+            self.file_hash.update(data)
+            self.block_digests += hashlib.new(DIGEST_ALGORITHM, data).digest()
+        self._write(enc_data)
+        self._raw_pos += len(data)
+
+
+class PositionalFileReader:
+    """
+    按位置读取文件，多个线程同时读取时不会相互影响文件指针。
+    系统支持`os.pread`时直接使用，否则加锁以后`seek`再`read`
+    :param file_path: 文件路径
+    """
+
+    def __init__(self, file_path: str):
+        self.file_stream = open(file_path, 'rb')
+        self._lock = threading.Lock()
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if hasattr(os, 'pread'):
+            fd = self.file_stream.fileno()
+            data = os.pread(fd, size, offset)
+            # 一次读取的数据可能不完整
+            while 0 < len(data) < size:
+                new_data = os.pread(fd, size - len(data), offset + len(data))
+                if len(new_data) == 0:
+                    break
+                data += new_data
+            return data
+        with self._lock:
+            self.file_stream.seek(offset)
+            return self.file_stream.read(size)
+
+    def close(self):
+        self.file_stream.close()
+
+
+class SharedVideoFile:
+    """
+    同一个加密文件在进程内共享的资源：解析后的文件头、按位置读取的文件和解密后数据块的缓存
+    :param file_path: 加密文件路径
+    :param cache_size: 解密后数据块缓存占用内存的上限（字节）
+    """
+
+    def __init__(self, file_path: str, cache_size: int):
+        self.file_path = file_path
+        self.reader = PositionalFileReader(file_path)
+        self.head = VideoHead.from_file(self.reader.file_stream, lazy=True)
+        self.block_cache = DecryptedBlockCache(cache_size)
+        self.ref_count = 0
+
+    def close(self):
+        self.head.close()
+        self.reader.close()
+        self.block_cache.clear()
+
+
+class KeyRing:
+    """
+    按密钥标识保存多个用户密钥，打开文件时根据文件头中的密钥标识直接找到密钥，不需要逐个尝试
+    """
+
+    def __init__(self):
+        self._keys: Dict[bytes, bytes] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: bytes) -> bool:
+        return get_key_id(key) in self._keys
+
+    def add(self, key: bytes):
+        with self._lock:
+            self._keys[get_key_id(key)] = key
+
+    def remove(self, key: bytes):
+        with self._lock:
+            self._keys.pop(get_key_id(key), None)
+
+    def get(self, key_id: bytes) -> Optional[bytes]:
+        return self._keys.get(key_id)
+
+    def find_key(self, head: VideoHead) -> Optional[bytes]:
+        """
+        查找文件使用的用户密钥
+        :param head: 文件头
+        :return 用户密钥，文件头中没有密钥标识或者没有对应的密钥时返回`None`
+        """
+        for key_id in head.get_key_ids():
+            key = self._keys.get(key_id)
+            if key is not None and head.match_key(key):
+                return key
+        return None
+
+
+class VideoFileRegistry:
+    """
+    进程内加密文件共享资源的注册表，按文件路径和密钥共享，按引用计数释放
+
+    mpv会多次打开同一个文件（探测、外部音轨、重新打开播放列表），
+    通过注册表打开的`VideoStream`共用一份文件头、文件描述符和解密后数据块的缓存，
+    最后一个视频流关闭时释放所有资源
+
+    :param cache_size: 每个文件解密后数据块缓存占用内存的上限（字节）
+    """
+
+    def __init__(self, cache_size: int = 64 * 1024 * 1024):
+        self.cache_size = cache_size
+        self._files: Dict[tuple, SharedVideoFile] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    @staticmethod
+    def _get_file_key(file_path: str, key: bytes) -> tuple:
+        return os.path.normcase(os.path.abspath(file_path)), key
+
+    def acquire(self, file_path: str, key: bytes) -> SharedVideoFile:
+        """获取文件的共享资源，引用计数加1"""
+        file_key = self._get_file_key(file_path, key)
+        with self._lock:
+            shared_file = self._files.get(file_key)
+            if shared_file is None:
+                shared_file = SharedVideoFile(file_path, self.cache_size)
+                self._files[file_key] = shared_file
+            shared_file.ref_count += 1
+            return shared_file
+
+    def release(self, shared_file: SharedVideoFile, key: bytes):
+        """引用计数减1，减到0时释放文件的共享资源"""
+        file_key = self._get_file_key(shared_file.file_path, key)
+        with self._lock:
+            shared_file.ref_count -= 1
+            if shared_file.ref_count > 0:
+                return
+            if self._files.get(file_key) is shared_file:
+                del self._files[file_key]
+        shared_file.close()
+
+
+VIDEO_FILE_REGISTRY = VideoFileRegistry()  #: 进程内共享的加密文件注册表
+
+
+class VideoStream(RawIOBase):
+    """
+    加密视频文件解密读取流，可以用于`io.BufferedReader`、`shutil.copyfileobj`等需要文件对象的地方。
+    需要先调用`open`（或使用`with`），关闭后不能再打开
+    :param file_path: 加密文件路径
+    :param key: 密钥
+    :param lazy_head: 为`True`时通过内存映射按需读取数据块索引，不在打开时解析整个文件头
+    :param block_cache: 解密后数据块的缓存，为`None`时不缓存
+    :param prefetch_depth: 后台预读解密的最大数据块数量，为0时不预读
+    :param registry: 共享文件资源的注册表，指定时与同一文件的其他视频流共用文件头、文件描述符和缓存，
+        `lazy_head`和`block_cache`参数不再生效
+    :param key_ring: 已知的用户密钥，文件头中保存了密钥标识时按标识选择密钥，找不到时使用`key`
+    """
+
+    partial_read_ratio = 16  #: 读取长度不超过数据块的1/16时，随机读取只解密需要的部分，为0时总是解密整个数据块
 
-    def __init__(self, file_path: str, key):
+    def __init__(self,
+                 file_path: str,
+                 key,
+                 lazy_head: bool = True,
+                 block_cache: DecryptedBlockCache = None,
+                 prefetch_depth: int = 0,
+                 registry: VideoFileRegistry = None,
+                 key_ring: KeyRing = None):
+        super().__init__()
         self.file_path = file_path
         self.key = key
+        self.key_ring = key_ring
+        self.lazy_head = lazy_head
+        self.block_cache = block_cache
+        self.prefetch_depth = prefetch_depth
+        self.registry = registry
+        self.shared_file: SharedVideoFile = None
+        self.cipher: CipherEngine = None
+        self.prefetcher: BlockPrefetcher = None
         self.head: VideoHead = None
         self.index = 0
         self.position = 0
-        self.block_stream = None
+        self.block_data: Optional[memoryview] = None
+        self.file_reader: PositionalFileReader = None
         self.file_stream = None
         self._mpv_callbacks_ = []
         self.video_info_reader: VideoInfoReader = None
-        self.current_block = None
+        self.current_block_index = -1
+        self._last_read_end = 0
+        self._seek_index: Optional[VideoSeekIndex] = None
+        self._seek_index_loaded = False
+        self._trickplay: Optional[Tuple[int, TrickplayIndex]] = None
+        self._trickplay_loaded = False
+        self._trickplay_sheet: Tuple[int, bytes] = (-1, b'')
         self.logger = logging.getLogger('CryptoVideoStream')
 
     def _debug(self, text):
         self.logger.debug(text)
 
+    def _get_data_key(self) -> bytes:
+        """选择用户密钥，创建加密引擎，密钥错误时抛出`VideoDecryptException`，不需要解密数据块"""
+        key = self.key
+        if self.key_ring is not None:
+            key = self.key_ring.find_key(self.head) or key
+        matched = self.head.match_key(key)
+        if matched is False:
+            raise VideoDecryptException('wrong key')
+        data_key = self.head.get_data_key(key)
+        self.cipher = create_cipher_engine(data_key, self.head.cipher_mode)
+        if matched is None and not self.head.has_key_slots() and not self._check_padding():
+            raise VideoDecryptException('wrong key')
+        return data_key
+
+    def _check_padding(self) -> bool:
+        """
+        文件头中没有密钥校验值时，只解密第一个数据块最后16个字节，检查CBC的填充字符，
+        密钥错误时填充字符正确的概率很低
+        """
+        table = self.head.block_table
+        if self.head.cipher_mode != CIPHER_MODE_CBC or len(table) == 0:
+            return True
+        pad_len = table.block_size[0] - table.data_size[0]
+        if not 0 < pad_len <= AES.block_size:
+            return True
+        offset = table.block_size[0] - AES.block_size
+        start, end = get_block_range_window(self.head.cipher_mode, offset, AES.block_size)
+        enc_data = self.file_reader.read_at(table.start_pos[0] + start, end - start)
+        data = self.cipher.decrypt_range(table.iv[0], enc_data, offset)
+        return data[-pad_len:] == bytes([pad_len]) * pad_len
+
     def open(self):
-        self.file_stream = open(self.file_path, 'rb')
-        head_block = VideoHead.get_head_block(self.file_stream)
-        self.head = VideoHead.from_bytes(head_block)
+        self._checkClosed()
+        if self.registry is not None:
+            self.shared_file = self.registry.acquire(self.file_path, self.key)
+            self.file_reader = self.shared_file.reader
+            self.head = self.shared_file.head
+            self.block_cache = self.shared_file.block_cache
+        else:
+            self.file_reader = PositionalFileReader(self.file_path)
+            self.head = VideoHead.from_file(self.file_reader.file_stream, lazy=self.lazy_head)
+        self.file_stream = self.file_reader.file_stream
+        try:
+            data_key = self._get_data_key()
+        except VideoDecryptException:
+            self.close()
+            raise
+        self._debug(f'cipher engine: {self.cipher.name}')
         if self.head.video_info_index_size > 0:
             self.video_info_reader = VideoInfoReader(
-                self.key,
+                data_key,
                 self.file_path,
-                self.file_stream.tell(),
+                self.head.get_info_start(),
                 self.head.video_info_index_size,
-                self.head.video_info_index
+                self.head.video_info_index,
+                self.head.cipher_mode,
+                self.head.info_format
             )
-            # 计算信息区的总长度
-            video_info_length = 0
-            for info in self.head.video_info_index:
-                video_info_length += info.length
-            # 跳过信息区
-            self.file_stream.seek(video_info_length, 1)
+        if self.block_cache is not None and self.block_cache.pin_first_last and len(self.head.block_table) > 0:
+            # mpv探测文件时会反复读取文件头和文件尾
+            self.block_cache.pin(0)
+            self.block_cache.pin(len(self.head.block_table) - 1)
+        if self.prefetch_depth > 0:
+            if self.block_cache is None:
+                # 预读的数据块保存在缓存中，预留当前块和预读块的空间
+                self.block_cache = DecryptedBlockCache((self.prefetch_depth + 2) * BLOCK_SIZE, pin_first_last=False)
+            self.prefetcher = BlockPrefetcher(
+                self._decrypt_block,
+                self.block_cache,
+                len(self.head.block_table),
+                max_depth=self.prefetch_depth
+            )
+            self.prefetcher.start()
         self.index = 0
         self.position = 0
+        self._last_read_end = 0
 
     def close(self):
-        if self.file_stream is not None:
-            self.file_stream.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+        if self.block_cache is not None:
+            self._debug(f'block cache: {self.block_cache.stats()}')
+
+        if self.shared_file is not None:
+            self.registry.release(self.shared_file, self.key)
+            self.shared_file = None
+        else:
+            if self.head is not None:
+                self.head.close()
+            if self.file_reader is not None:
+                self.file_reader.close()
 
         if self.video_info_reader is not None:
             self.video_info_reader.close()
 
-        if self.block_stream is not None:
-            self.block_stream.close()
-
         self.head: VideoHead = None
         self.index = 0
-        self.block_stream = None
+        self.current_block_index = -1
+        self.block_data = None
+        self.file_reader = None
         self.file_stream = None
+        RawIOBase.close(self)
 
-    def read(self, length):
+    def __enter__(self):
+        if self.head is None:
+            self.open()
+        return self
 
-        self._debug(f'before read, position: {self.position}, to read length: {length}')
+    def _check_opened(self):
+        """关闭后或调用`open`之前读取时抛出`ValueError`"""
+        self._checkClosed()
+        if self.head is None:
+            raise ValueError('stream not opened')
 
-        if length < 0:
-            raise ValueError(f'negative length value {length}')
+    def readable(self) -> bool:
+        return True
 
-        if self.index >= len(self.head.block_index):
-            return b''
+    def seekable(self) -> bool:
+        return True
 
-        # 第一次进入，直接打开数据流
-        if self.block_stream is None:
-            self._open_datablock_stream()
+    def read(self, length: int = -1) -> bytes:
+        """
+        :param length: 读取长度，为`None`或负数时读取到文件末尾
+        """
+        self._check_opened()
+        remaining = max(self.head.raw_file_size - self.position, 0)
+        if length is None or length < 0 or length > remaining:
+            length = remaining
+        buffer = bytearray(length)
+        size = self.readinto(buffer)
+        del buffer[size:]
+        return bytes(buffer)
+
+    def readall(self) -> bytes:
+        return self.read(-1)
+
+    def readinto(self, buffer) -> int:
+        """
+        读取数据并直接写入调用方提供的缓冲区，整块拷贝，不逐字节复制
+        :param buffer: 可写的缓冲区，如`bytearray`、`memoryview`或ctypes数组
+        :return 实际读取的字节数，0表示已经读到文件末尾
+
+        """
+        self._check_opened()
+        view = memoryview(buffer).cast('B')
+        length = len(view)
+
+        self._debug(f'before read, position: {self.position}, to read length: {length}')
+
+        if self.index >= len(self.head.block_table):
+            return 0
 
         # 当前位置不在已经打开的数据流中，找到数据块，重新打开
         if not self.is_in_data_block(self.position):
-            if self.index >= len(self.head.block_index):
-                return b''
+            if self._can_read_range(length):
+                size = self._read_range(view)
+                self._last_read_end = self.position
+                self._debug(f'after range read, data length: {size}, position: {self.position}')
+                return size
             self._open_datablock_stream()
-            self.block_stream.seek(self.position - self.head.block_index[self.index].raw_start_pos)
 
-        remaining = length
-        data = b''
+        table = self.head.block_table
+        size = 0
 
         while True:
 
-            new_data = self.block_stream.read(remaining)
-            self.position += len(new_data)
-            remaining = remaining - len(new_data)
-            data += new_data
+            # 从解密后的数据块切片拷贝到缓冲区，不创建中间对象
+            offset = self.position - table.raw_start_pos[self.index]
+            read_size = max(min(length - size, len(self.block_data) - offset), 0)
+            view[size:size + read_size] = self.block_data[offset:offset + read_size]
+            self.position += read_size
+            size += read_size
 
             # 读取了指定长度的数据，返回
-            if remaining == 0:
+            if size == length:
                 break
 
             # 当前数据块已经读完，需要继续读取
             self.index += 1
-            if self.index >= len(self.head.block_index):
+            if self.index >= len(self.head.block_table):
                 break
             self._open_datablock_stream()
-        self._debug(f'after read, data length: {len(data)}, position: {self.position}')
-        return data
+        self._last_read_end = self.position
+        self._debug(f'after read, data length: {size}, position: {self.position}')
+        return size
+
+    def iter_blocks(self,
+                    start: int = 0,
+                    end: int = None,
+                    workers: int = os.cpu_count() or 1,
+                    lookahead: int = None) -> Iterator[memoryview]:
+        """
+        使用线程池并行解密原始文件`[start, end)`范围涉及的数据块，按顺序返回，不改变读取位置，不使用缓存。
+        第一个和最后一个数据块只返回范围内的部分
+
+        :param start: 原始文件中的起始位置
+        :param end: 原始文件中的结束位置，不包含，为`None`时到文件末尾
+        :param workers: 线程数量，加密引擎不释放GIL时忽略
+        :param lookahead: 最多提前解密的数据块数量，为`None`时为`workers`的2倍
+        """
+        self._check_opened()
+        table = self.head.block_table
+        end = self.head.raw_file_size if end is None else min(end, self.head.raw_file_size)
+        if start < 0:
+            raise ValueError(f'negative start value {start}')
+        blocks = self.head.get_block_range(start, end)
+        results = self.cipher.decrypt_many(self._read_blocks(blocks), workers, max_in_flight=lookahead)
+        try:
+            for idx, data in zip(blocks, results):
+                raw_start_pos = table.raw_start_pos[idx]
+                yield memoryview(data)[max(start - raw_start_pos, 0):end - raw_start_pos]
+        finally:
+            # 等待所有解密任务结束，之后可以关闭文件
+            results.close()
+
+    def read_view(self, length: int) -> memoryview:
+        """
+        不拷贝数据，返回当前数据块中从读取位置开始的切片，最多到数据块末尾，长度为0表示已经读到文件末尾，
+        再次读取后切片的内容仍然有效
+        :param length: 最大长度
+        """
+        self._check_opened()
+        if length <= 0:
+            return memoryview(b'')
+        if not self.is_in_data_block(self.position):
+            # read/readinto读到数据块末尾时不更新index，按读取位置重新查找数据块
+            if self.position >= self.head.raw_file_size:
+                return memoryview(b'')
+            self.index = self.get_block_index(self.position)
+            self._open_datablock_stream()
+        offset = self.position - self.head.block_table.raw_start_pos[self.index]
+        view = self.block_data[offset:offset + length]
+        self.position += len(view)
+        if offset + len(view) >= len(self.block_data):
+            self.index += 1
+        self._last_read_end = self.position
+        return view
 
-    def seek(self, pos):
+    def seek(self, pos: int, whence: int = SEEK_SET) -> int:
+        """
+        :param pos: 偏移
+        :param whence: `SEEK_SET`、`SEEK_CUR`或`SEEK_END`
+        """
+        self._check_opened()
+        if whence == SEEK_CUR:
+            pos += self.position
+        elif whence == SEEK_END:
+            pos += self.head.raw_file_size
+        elif whence != SEEK_SET:
+            raise ValueError(f'invalid whence {whence}')
         if pos < 0:
             raise ValueError(f'negative seek value {pos}')
         if pos > self.head.raw_file_size:
@@ -562,36 +2737,145 @@ class VideoStream:
         self.position = pos
         self.index = self.get_block_index(self.position)
         self._debug(f'seek to {self.position}, block index is {self.index}')
-        self._open_datablock_stream()
-        self.block_stream.seek(self.position - self.head.block_index[self.index].raw_start_pos)
+        # 在下一次读取时再解密数据块
         return self.position
 
-    def tell(self):
+    def tell(self) -> int:
         return self.position
 
     def is_in_data_block(self, pos):
-        block = self.current_block
-        if block.raw_start_pos <= pos < block.raw_start_pos + block.data_size:
+        table = self.head.block_table
+        idx = self.current_block_index
+        if self.block_data is None or idx < 0:
+            return False
+        if table.raw_start_pos[idx] <= pos < table.raw_start_pos[idx] + table.data_size[idx]:
             return True
         return False
 
+    def get_seek_index(self) -> Optional[VideoSeekIndex]:
+        """读取加密时保存的关键帧跳转索引，第一次调用时解密，文件中没有时返回`None`"""
+        if not self._seek_index_loaded:
+            self._seek_index_loaded = True
+            data = None
+            if self.video_info_reader is not None:
+                _, data = self.video_info_reader.find_info(INFO_SEEK_INDEX)
+            if data is not None:
+                self._seek_index = VideoSeekIndex.from_bytes(data)
+        return self._seek_index
+
+    def prefetch_time(self, time: float) -> Optional[int]:
+        """
+        播放器即将跳转到`time`时调用，根据关键帧跳转索引在后台预读目标数据块，不改变读取位置，
+        没有启用预读（`prefetch_depth`为0）时只返回位置
+        :param time: 目标时间（秒）
+        :return `time`之前最近的关键帧在原始文件中的位置，没有跳转索引时返回`None`
+        """
+        seek_index = self.get_seek_index()
+        if seek_index is None or len(seek_index) == 0:
+            return None
+        idx = seek_index.find(time)
+        if self.prefetcher is not None:
+            self._debug(f'prefetch block {seek_index.blocks[idx]} for time {time}')
+            self.prefetcher.request(seek_index.blocks[idx])
+        return seek_index.positions[idx]
+
+    def get_trickplay_index(self) -> Optional[TrickplayIndex]:
+        """读取加密时生成的预览缩略图索引，第一次调用时解密，文件中没有时返回`None`"""
+        if not self._trickplay_loaded:
+            self._trickplay_loaded = True
+            if self.video_info_reader is not None:
+                info_idx, data = self.video_info_reader.find_info(INFO_TRICKPLAY_INDEX)
+                if data is not None:
+                    self._trickplay = (info_idx, TrickplayIndex.from_bytes(data))
+        return None if self._trickplay is None else self._trickplay[1]
+
+    def get_trickplay_tile(self, time: float) -> Optional[Tuple[bytes, Tuple[int, int, int, int]]]:
+        """
+        获取`time`处的预览缩略图，只解密缩略图所在的拼图，连续获取同一张拼图中的缩略图时不再解密
+        :param time: 时间（秒）
+        :return JPEG格式的拼图数据和缩略图在拼图中的位置（x、y、宽度、高度），
+            没有缩略图或拼图生成失败（长度为0）时返回`None`
+        """
+        index = self.get_trickplay_index()
+        if index is None or len(index) == 0:
+            return None
+        sheet, x, y, w, h = index.get_tile_rect(index.find(time))
+        if index.sheet_lengths[sheet] == 0:
+            return None
+        if self._trickplay_sheet[0] != sheet:
+            # 只解密拼图的有效数据，不解密预留的空白部分
+            info_idx = self._trickplay[0] + 1 + sheet
+            pos, length = self.video_info_reader.get_entry_table(info_idx)[INFO_TRICKPLAY_SHEET]
+            data = self.video_info_reader.read_info_range(info_idx, pos, min(length, index.sheet_lengths[sheet]))
+            self._trickplay_sheet = (sheet, data)
+        return self._trickplay_sheet[1], (x, y, w, h)
+
     def get_block_index(self, pos):
-        for idx, block in enumerate(self.head.block_index):
-            if block.raw_start_pos <= pos < block.raw_start_pos + block.data_size:
-                self._debug(f'block {idx} match position {pos}, block start: {block.raw_start_pos}, block end: {block.raw_start_pos + block.data_size}')
-                return idx
-        self._debug(f'can not find block, return {len(self.head.block_index)}')
-        return len(self.head.block_index)
+        idx = self.head.find_block(pos)
+        self._debug(f'block {idx} match position {pos}')
+        return idx
 
     def _open_datablock_stream(self):
         self._debug(f'open data block {self.index}')
-        block = self.head.block_index[self.index]
-        enc_data = block.read_block_data(self.file_stream)
-        data = decrypt_data1(self.key, block.iv, block.data_size, enc_data)
-        if self.block_stream is not None:
-            self.block_stream.close()
-        self.block_stream = BytesIO(data)
-        self.current_block = block
+        idx = self.index
+        data = None
+        if self.block_cache is not None:
+            data = self.block_cache.get(idx)
+        if data is None:
+            data = self._decrypt_block(idx)
+            if self.block_cache is not None:
+                self.block_cache.put(idx, data)
+        self.block_data = memoryview(data)
+        self.current_block_index = idx
+        if self.prefetcher is not None:
+            self.prefetcher.update(idx)
+
+    def _decrypt_block(self, idx: int) -> bytes:
+        """读取并解密数据块，预读线程也会调用"""
+        table = self.head.block_table
+        enc_data = self.file_reader.read_at(table.start_pos[idx], table.block_size[idx])
+        return self.cipher.decrypt(table.iv[idx], table.data_size[idx], enc_data)
+
+    def _read_blocks(self, blocks):
+        """依次读取数据块的加密数据，返回`CipherEngine.decrypt_many`的参数"""
+        table = self.head.block_table
+        for idx in blocks:
+            yield table.iv[idx], table.data_size[idx], self.file_reader.read_at(table.start_pos[idx],
+                                                                                 table.block_size[idx])
+
+    def _can_read_range(self, length: int) -> bool:
+        """
+        随机读取少量数据时只解密需要的部分，顺序读取和已经缓存的数据块仍然解密整个数据块
+        """
+        if self.partial_read_ratio <= 0 or not can_decrypt_block_range(self.head.cipher_mode):
+            return False
+        if self.position == self._last_read_end:
+            return False
+        if length * self.partial_read_ratio > self.head.block_table.data_size[self.index]:
+            return False
+        if self.block_cache is not None and self.index in self.block_cache:
+            return False
+        return True
+
+    def _decrypt_span(self, idx: int, offset: int, length: int) -> bytes:
+        """只解密数据块中`[offset, offset + length)`的数据"""
+        table = self.head.block_table
+        start, end = get_block_range_window(self.head.cipher_mode, offset, length)
+        enc_data = self.file_reader.read_at(table.start_pos[idx] + start, end - start)
+        aligned_offset = offset - offset % AES.block_size
+        data = self.cipher.decrypt_range(table.iv[idx], enc_data, aligned_offset)
+        return data[offset - aligned_offset:offset - aligned_offset + length]
+
+    def _read_range(self, view: memoryview) -> int:
+        """只解密读取范围内的数据，按16字节对齐"""
+        end = min(self.position + len(view), self.head.raw_file_size)
+        size = 0
+        for span in self.head.get_block_spans(self.position, end):
+            view[size:size + span.length] = self._decrypt_span(span.index, span.offset, span.length)
+            size += span.length
+        self.position += size
+        self.index = self.get_block_index(self.position)
+        return size
 
 
 class VideoInfoReader:
@@ -601,25 +2885,132 @@ class VideoInfoReader:
                  file_path: str,
                  start: int,
                  length: int,
-                 video_info_index_list: List[VideoInfoIndex]):
+                 video_info_index_list: List[VideoInfoIndex],
+                 cipher_mode: int = CIPHER_MODE_CBC,
+                 info_format: int = INFO_FORMAT_PADDED):
         self.key = key
+        self.cipher_mode = cipher_mode
+        self.info_format = info_format
         self.file_path = file_path
         self.start = start
         self.length = length
         self.video_info_index_list = video_info_index_list
+        self.cipher = create_cipher_engine(key, cipher_mode)
         self.reader = None
+        self._entry_tables: Dict[int, Dict[bytes, Tuple[int, int]]] = {}
 
     def open(self):
         self.reader = open(self.file_path, 'rb')
 
+    def _get_info_pos(self, idx: int) -> int:
+        return self.start + sum(i.length for i in self.video_info_index_list[:idx])
+
+    def _get_data_limit(self, idx: int) -> int:
+        """第`idx`个视频信息原始数据长度的上限，CBC包含填充字符"""
+        length = self.video_info_index_list[idx].length
+        return length - GCM_TAG_LEN if self.cipher_mode == CIPHER_MODE_GCM else length
+
+    def read_info_range(self, idx: int, offset: int, length: int) -> bytes:
+        """
+        只解密第`idx`个视频信息中`[offset, offset + length)`的原始数据，不校验认证标签
+        :param idx: 视频信息序号
+        :param offset: 数据在序列化后的视频信息中的起始位置
+        :param length: 数据长度
+        """
+        if self.reader is None:
+            self.open()
+        start, end = get_block_range_window(self.cipher_mode, offset, length)
+        self.reader.seek(self._get_info_pos(idx) + start)
+        enc_data = self.reader.read(end - start)
+        aligned = offset - offset % AES.block_size
+        data = self.cipher.decrypt_range(self.video_info_index_list[idx].iv, enc_data, aligned)
+        return data[offset - aligned:offset - aligned + length]
+
+    def _read_compact_entry_table(self, idx: int) -> Dict[bytes, Tuple[int, int]]:
+        limit = self._get_data_limit(idx)
+        size = min(INFO_TABLE_READ_SIZE, limit)
+        while True:
+            view = memoryview(self.read_info_range(idx, 0, size))
+            count = int.from_bytes(view[:VideoInfo.head_all_info_bytes_cnt_len], byteorder='big')
+            try:
+                entries, pos = VideoInfo._read_compact_table(view, count)
+                break
+            except VideoInfoException:
+                if size >= limit:
+                    raise
+                size = min(size * 4, limit)
+        table = {}
+        for name, data_len in entries:
+            table[name] = (pos, data_len)
+            pos += data_len
+        return table
+
+    def _read_padded_entry_table(self, idx: int) -> Dict[bytes, Tuple[int, int]]:
+        # 名字和数据交替保存，逐个解密名字和长度，跳过数据
+        name_len = VideoInfo.name_max_length
+        header_len = name_len + VideoInfo.get_data_bytes_cnt_len(self.info_format)
+        pos = VideoInfo.head_all_info_bytes_cnt_len
+        count = int.from_bytes(self.read_info_range(idx, 0, pos), byteorder='big')
+        table = {}
+        for _ in range(count):
+            header = self.read_info_range(idx, pos, header_len)
+            if len(header) < header_len:
+                raise VideoInfoException('video info truncated')
+            pos += header_len
+            data_len = int.from_bytes(header[name_len:], byteorder='big')
+            table[VideoInfo.unpad(header[:name_len])] = (pos, data_len)
+            pos += data_len
+        return table
+
+    def get_entry_table(self, idx: int) -> Dict[bytes, Tuple[int, int]]:
+        """
+        第`idx`个视频信息中每项数据的位置，第一次调用时只解密名字和长度，不解密数据
+        :return 名字到数据在序列化后的视频信息中的起始位置和长度
+        """
+        if idx not in self._entry_tables:
+            if self.info_format == INFO_FORMAT_COMPACT:
+                self._entry_tables[idx] = self._read_compact_entry_table(idx)
+            else:
+                self._entry_tables[idx] = self._read_padded_entry_table(idx)
+        return self._entry_tables[idx]
+
+    def names(self) -> List[bytes]:
+        """所有视频信息中数据的名字，不解密数据"""
+        return [name for i in range(len(self.video_info_index_list)) for name in self.get_entry_table(i)]
+
+    def find_info(self, name: bytes) -> Tuple[int, Optional[bytes]]:
+        """
+        找到第一个包含`name`的视频信息，只解密名字表和这一项数据
+        :return 视频信息序号和数据，没有时返回-1和`None`
+        """
+        for i in range(len(self.video_info_index_list)):
+            entry = self.get_entry_table(i).get(name)
+            if entry is not None:
+                return i, self.read_info_range(i, *entry)
+        return -1, None
+
+    def get(self, name: bytes) -> Optional[bytes]:
+        """读取第一个名字为`name`的数据，不解密其他数据，没有时返回`None`"""
+        return self.find_info(name)[1]
+
+    def read_info(self, idx: int) -> VideoInfo:
+        """只解密第`idx`个视频信息"""
+        if self.reader is None:
+            self.open()
+        video_info_index = self.video_info_index_list[idx]
+        self.reader.seek(self._get_info_pos(idx))
+        enc_index_data = self.reader.read(video_info_index.length)
+        return VideoInfo.from_bytes(self.cipher.decrypt(video_info_index.iv, -1, enc_index_data), self.info_format)
+
     def read(self) -> List[VideoInfo]:
         self.reader.seek(self.start)
         for video_info_index in self.video_info_index_list:
             enc_index_data = self.reader.read(video_info_index.length)
-            index_data = decrypt_data1(self.key, video_info_index.iv, -1, enc_index_data)
-            video_info = VideoInfo.from_bytes(index_data)
+            index_data = self.cipher.decrypt(video_info_index.iv, -1, enc_index_data)
+            video_info = VideoInfo.from_bytes(index_data, self.info_format)
             yield video_info
 
     def close(self):
         if self.reader is not None:
             self.reader.close()
+            self.reader = None
@@ -0,0 +1,52 @@
+"""
+解密导出吞吐量测试
+
+对比`VideoStream.read`逐块读取和`decrypt_video`多线程解密的MB/s
+
+    python bench_decrypt_export.py [文件大小MB]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gxbzys.video import VideoStream, decrypt_video
+from tests.util import create_encrypt_file, create_raw_file
+
+
+def export_read(enc_file, key, output_file):
+    with VideoStream(enc_file, key) as stream, open(output_file, 'wb') as writer:
+        while True:
+            data = stream.read(1024 * 1024)
+            if len(data) == 0:
+                break
+            writer.write(data)
+
+
+def export_parallel(enc_file, key, output_file, workers):
+    with open(output_file, 'wb') as writer:
+        decrypt_video(key, enc_file, writer, workers=workers)
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    key = os.urandom(32)
+    with tempfile.TemporaryDirectory() as path:
+        raw_file = create_raw_file(os.path.join(path, 'raw.bin'), size_mb * 1024 * 1024)
+        enc_file = os.path.join(path, 'enc.bin')
+        create_encrypt_file(raw_file, enc_file, key)
+        output_file = os.path.join(path, 'out.bin')
+        cases = [('read', lambda: export_read(enc_file, key, output_file))]
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            cases.append((f'parallel-{workers}', lambda w=workers: export_parallel(enc_file, key, output_file, w)))
+        for name, func in cases:
+            start = time.perf_counter()
+            func()
+            cost = time.perf_counter() - start
+            print(f'{name:<12} {size_mb / cost:10.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+跳转到关键帧的延迟测试
+
+对比固定大小的数据块和在关键帧处分块（`align_keyframes`），模拟播放器跳转后从关键帧开始读取一个GOP的开头，
+统计需要解密的数据块数量和耗时。不指定文件时生成关键帧间隔随机的MPEG-TS数据
+
+    python bench_keyframe_seek.py [视频文件] [读取长度KB]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gxbzys.keyframes import TS_PACKET_SIZE, find_keyframes
+from gxbzys.video import VideoStream
+from tests.util import create_encrypt_file
+
+FILE_SIZE = 128 * 1024 * 1024
+SEEK_COUNT = 100
+
+
+def create_ts_file(file_path):
+    packet_num = FILE_SIZE // TS_PACKET_SIZE
+    data = bytearray(os.urandom(packet_num * TS_PACKET_SIZE))
+    next_keyframe = 0
+    for i in range(packet_num):
+        pos = i * TS_PACKET_SIZE
+        if i == next_keyframe:
+            # 关键帧间隔0.5M到2M
+            next_keyframe += random.randrange(512 * 1024, 2 * 1024 * 1024) // TS_PACKET_SIZE
+            data[pos:pos + 14] = b'\x47\x41\x00\x30\x01\x40\x00\x00\x01\xe0\x00\x00\x80\x00'
+        else:
+            data[pos:pos + 4] = b'\x47\x01\x00\x10'
+    with open(file_path, 'wb') as writer:
+        writer.write(data)
+
+
+def bench(name, enc_file, key, positions, read_size):
+    costs = []
+    blocks = []
+    for pos in positions:
+        # 每次跳转使用新的流，不使用之前解密的数据块
+        stream = VideoStream(enc_file, key)
+        stream.partial_read_ratio = 0
+        stream.open()
+        start = time.perf_counter()
+        stream.seek(pos)
+        stream.read(read_size)
+        costs.append(time.perf_counter() - start)
+        blocks.append(len(stream.head.get_block_range(pos, pos + read_size)))
+        stream.close()
+    costs.sort()
+    avg = sum(costs) / len(costs)
+    p95 = costs[int(len(costs) * 0.95)]
+    print(f'{name:<8} blocks {sum(blocks) / len(blocks):5.2f}  avg {avg * 1000:8.3f} ms  p95 {p95 * 1000:8.3f} ms')
+
+
+def main():
+    read_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 256) * 1024
+    key = os.urandom(32)
+    with tempfile.TemporaryDirectory() as path:
+        if len(sys.argv) > 1:
+            raw_file = sys.argv[1]
+        else:
+            raw_file = os.path.join(path, 'raw.ts')
+            create_ts_file(raw_file)
+        keyframes = find_keyframes(raw_file)
+        if len(keyframes) == 0:
+            print('no keyframes found')
+            return
+        positions = [k.pos for k in random.sample(keyframes, min(SEEK_COUNT, len(keyframes)))]
+        for align_keyframes, name in [(False, 'fixed'), (True, 'aligned')]:
+            enc_file = os.path.join(path, f'{name}.enc')
+            head = create_encrypt_file(raw_file, enc_file, key, head_args=dict(align_keyframes=align_keyframes))
+            print(f'{name:<8} {len(head.block_table)} blocks, head {head.head_size} bytes')
+            bench(name, enc_file, key, positions, read_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+随机读取少量数据的延迟测试
+
+对比只解密需要的部分和解密整个数据块两种方式，模拟mpv探测文件和跳转时的小块读取
+
+    python bench_partial_read.py [文件大小MB] [读取长度KB]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gxbzys.video import CIPHER_MODE_CBC, CIPHER_MODE_GCM, VideoStream
+from tests.util import create_encrypt_file, create_raw_file
+
+READ_COUNT = 200
+
+
+def bench(name, enc_file, key, positions, read_size, partial_read_ratio):
+    stream = VideoStream(enc_file, key)
+    stream.partial_read_ratio = partial_read_ratio
+    stream.open()
+    costs = []
+    for pos in positions:
+        start = time.perf_counter()
+        stream.seek(pos)
+        stream.read(read_size)
+        costs.append(time.perf_counter() - start)
+    stream.close()
+    costs.sort()
+    avg = sum(costs) / len(costs)
+    p95 = costs[int(len(costs) * 0.95)]
+    print(f'{name:<14} avg {avg * 1000:8.3f} ms  p95 {p95 * 1000:8.3f} ms')
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    read_size = (int(sys.argv[2]) if len(sys.argv) > 2 else 4) * 1024
+    key = os.urandom(32)
+    with tempfile.TemporaryDirectory() as path:
+        raw_file = create_raw_file(os.path.join(path, 'raw.bin'), size_mb * 1024 * 1024)
+        positions = [random.randrange(0, size_mb * 1024 * 1024 - read_size) for _ in range(READ_COUNT)]
+        for cipher_mode, mode_name in [(CIPHER_MODE_CBC, 'cbc'), (CIPHER_MODE_GCM, 'gcm')]:
+            enc_file = os.path.join(path, f'enc{cipher_mode}.bin')
+            create_encrypt_file(raw_file, enc_file, key, head_args=dict(cipher_mode=cipher_mode))
+            bench(f'{mode_name} block', enc_file, key, positions, read_size, 0)
+            bench(f'{mode_name} partial', enc_file, key, positions, read_size, VideoStream.partial_read_ratio)
+
+
+if __name__ == '__main__':
+    main()
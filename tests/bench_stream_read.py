@@ -0,0 +1,79 @@
+"""
+crypto:// 读取回调吞吐量测试
+
+模拟mpv调用读取回调，对比逐字节拷贝、memmove整块拷贝和直接解密到缓冲区三种方式的MB/s
+
+    python bench_stream_read.py [文件大小MB]
+"""
+import os
+import sys
+import tempfile
+import time
+from ctypes import CFUNCTYPE, POINTER, addressof, c_char, c_int64, c_uint64, c_ubyte, c_void_p, \
+    create_string_buffer, memmove
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gxbzys.video import VideoStream
+from tests.util import create_encrypt_file, create_raw_file
+
+# 与 gxbzys.mpv.StreamReadFn 相同的签名，gxbzys.mpv 需要加载libmpv，这里单独定义
+StreamReadFn = CFUNCTYPE(c_int64, c_void_p, POINTER(c_char), c_uint64)
+
+MPV_READ_SIZE = 64 * 1024
+
+
+def read_loop(stream, buf, bufsize):
+    data = stream.read(bufsize)
+    for i in range(len(data)):
+        buf[i] = data[i]
+    return len(data)
+
+
+def read_memmove(stream, buf, bufsize):
+    data = stream.read(bufsize)
+    memmove(buf, data, len(data))
+    return len(data)
+
+
+def read_into(stream, buf, bufsize):
+    view = (c_ubyte * bufsize).from_address(addressof(buf.contents))
+    return stream.readinto(view)
+
+
+def bench(name, enc_file, key, reader, limit):
+    stream = VideoStream(enc_file, key)
+    stream.open()
+
+    @StreamReadFn
+    def callback(_userdata, buf, bufsize):
+        return reader(stream, buf, bufsize)
+
+    buffer = create_string_buffer(MPV_READ_SIZE)
+    total = 0
+    start = time.perf_counter()
+    while total < limit:
+        size = callback(None, buffer, MPV_READ_SIZE)
+        if size == 0:
+            break
+        total += size
+    cost = time.perf_counter() - start
+    stream.close()
+    print(f'{name:<10} {total / 1024 / 1024:8.1f} MB {cost:8.3f} s {total / 1024 / 1024 / cost:10.1f} MB/s')
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    key = os.urandom(32)
+    with tempfile.TemporaryDirectory() as path:
+        raw_file = create_raw_file(os.path.join(path, 'raw.bin'), size_mb * 1024 * 1024)
+        enc_file = os.path.join(path, 'enc.bin')
+        create_encrypt_file(raw_file, enc_file, key)
+        # 逐字节拷贝太慢，只读取一部分
+        bench('loop', enc_file, key, read_loop, min(size_mb, 8) * 1024 * 1024)
+        bench('memmove', enc_file, key, read_memmove, size_mb * 1024 * 1024)
+        bench('readinto', enc_file, key, read_into, size_mb * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    main()
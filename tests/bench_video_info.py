@@ -0,0 +1,34 @@
+"""
+视频信息解析速度测试
+
+对比名字补齐到1024字节的原来的格式和`INFO_FORMAT_COMPACT`，模拟保存大量元数据的视频信息
+
+    python bench_video_info.py [数据数量]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gxbzys.video import VideoInfo, INFO_FORMAT_PADDED, INFO_FORMAT_COMPACT
+
+PARSE_COUNT = 20
+
+
+def main():
+    entry_num = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    video_info = VideoInfo()
+    for i in range(entry_num):
+        video_info.add_info(f'metadata_{i}'.encode('utf-8'), os.urandom(32))
+    for info_format, name in [(INFO_FORMAT_PADDED, 'padded'), (INFO_FORMAT_COMPACT, 'compact')]:
+        data = video_info.to_bytes(info_format)
+        start = time.perf_counter()
+        for _ in range(PARSE_COUNT):
+            VideoInfo.from_bytes(data, info_format)
+        cost = (time.perf_counter() - start) / PARSE_COUNT
+        print(f'{name:<8} size {len(data):8d} bytes  parse {cost * 1000:8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
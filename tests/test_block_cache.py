@@ -0,0 +1,74 @@
+import os
+from unittest import TestCase
+
+from gxbzys.cache import DecryptedBlockCache
+from gxbzys.video import VideoStream
+from keymanager.utils import read_file
+
+
+class TestDecryptedBlockCache(TestCase):
+
+    def test_lru(self):
+        cache = DecryptedBlockCache(max_size=30, pin_first_last=False)
+        cache.put(0, b'0' * 10)
+        cache.put(1, b'1' * 10)
+        cache.put(2, b'2' * 10)
+        assert cache.get(0) == b'0' * 10
+        cache.put(3, b'3' * 10)
+        assert 1 not in cache
+        assert 0 in cache and 2 in cache and 3 in cache
+        assert cache.size == 30
+        assert cache.get(1) is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['evictions'] == 1
+
+    def test_pin(self):
+        cache = DecryptedBlockCache(max_size=20, pin_first_last=False)
+        cache.pin(0)
+        cache.put(0, b'0' * 10)
+        for i in range(1, 10):
+            cache.put(i, b'x' * 10)
+        assert 0 in cache
+        assert cache.size == 20
+
+        cache.unpin(0)
+        cache.put(10, b'x' * 10)
+        assert 0 in cache
+        cache.put(11, b'x' * 10)
+        assert 0 not in cache
+
+    def test_discard_unread(self):
+        cache = DecryptedBlockCache(max_size=100, pin_first_last=False)
+        cache.put(0, b'0' * 10, prefetched=True)
+        cache.put(1, b'1' * 10, prefetched=True)
+        cache.put(2, b'2' * 10)
+        # 被读取过的和不是预读的数据块不会被移除
+        assert cache.get(1) == b'1' * 10
+        assert not cache.discard_unread(1)
+        assert not cache.discard_unread(2)
+        assert cache.discard_unread(0)
+        assert 0 not in cache and 1 in cache and 2 in cache
+        assert cache.size == 20
+
+    def test_stream_cache(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        raw_content = read_file(os.path.join(root, 'photo-1615529328331-f8917597711f.webp'))
+        enc_file = os.path.join(root, 'photo-1615529328331-f8917597711f.enc.webp')
+
+        cache = DecryptedBlockCache(max_size=8 * 1024)
+        stream = VideoStream(enc_file, key, block_cache=cache)
+        stream.open()
+        for pos in [0, 24000, 5000, 24500, 100, 5100]:
+            stream.seek(pos)
+            assert stream.read(200) == raw_content[pos:pos + 200]
+        stream.close()
+
+        assert 0 in cache
+        assert len(raw_content) // 1024 in cache
+        assert cache.hits == 4
+        assert cache.misses == 5
+        assert cache.size <= 8 * 1024
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import pickle
+from unittest import TestCase
+
+from gxbzys import video
+from gxbzys.video import CIPHER_MODE_CBC, CIPHER_MODE_GCM, CryptodomeCipherEngine, KeymanagerCipherEngine, \
+    VideoDecryptException, create_cipher_engine, select_cipher_engine
+
+
+class TestCipherEngine(TestCase):
+
+    def test_engines_compatible(self):
+        key = os.urandom(32)
+        data_list = [os.urandom(size) for size in [0, 1, 16, 1000, 4096]]
+        engines = [CryptodomeCipherEngine(key), KeymanagerCipherEngine(key)]
+        for encryptor in engines:
+            for decryptor in engines:
+                for data in data_list:
+                    iv, enc_data = encryptor.encrypt(data)
+                    assert decryptor.decrypt(iv, len(data), enc_data) == data
+                    assert decryptor.decrypt(iv, -1, enc_data) == data
+
+    def test_batch(self):
+        key = os.urandom(32)
+        data_list = [os.urandom(size) for size in range(0, 5000, 97)]
+        for cipher_mode in [CIPHER_MODE_CBC, CIPHER_MODE_GCM]:
+            engine = create_cipher_engine(key, cipher_mode)
+            encrypted = list(engine.encrypt_many(data_list, workers=4))
+            items = [(iv, len(data), enc_data) for data, (iv, enc_data) in zip(data_list, encrypted)]
+            assert list(engine.decrypt_many(items, workers=4)) == data_list
+
+        # 指定偏移向量并同时计算摘要，进程池中使用复制的引擎
+        engine = CryptodomeCipherEngine(key, CIPHER_MODE_GCM)
+        ivs = [os.urandom(12) + bytes(4) for _ in data_list]
+        for use_processes in [False, True]:
+            encrypted = list(engine.encrypt_many(iter(data_list), 2, ivs, use_processes, digest=True))
+            for data, iv, (enc_iv, enc_data, digest) in zip(data_list, ivs, encrypted):
+                assert enc_iv == iv
+                assert digest == hashlib.sha256(data).digest()
+                assert engine.decrypt(iv, len(data), enc_data) == data
+        items = [(iv, -1, enc_data) for iv, enc_data, _ in encrypted]
+        assert list(engine.decrypt_many(items, 2, digest=True)) == \
+               [(data, hashlib.sha256(data).digest()) for data in data_list]
+
+        engine = create_cipher_engine(key, CIPHER_MODE_GCM)
+        iv, enc_data = engine.encrypt(b'data')
+        with self.assertRaises(VideoDecryptException):
+            engine.decrypt(iv, 4, b'x' + enc_data[1:])
+
+    def test_prepared_context(self):
+        key = os.urandom(32)
+        engine = pickle.loads(pickle.dumps(CryptodomeCipherEngine(key)))
+        keymanager_engine = KeymanagerCipherEngine(key)
+        for size in [0, 1, 15, 16, 17, 4096, 100000]:
+            data = os.urandom(size)
+            iv, enc_data = keymanager_engine.encrypt(data)
+            assert engine.decrypt(iv, -1, enc_data) == data
+            assert engine.decrypt(iv, size, enc_data) == data
+            for offset in range(0, size, 4000):
+                window = enc_data[max(offset - 16, 0):]
+                assert engine.decrypt_range(iv, window, offset)[:len(data) - offset] == data[offset:]
+
+    def test_select(self):
+        engine_class = video.CIPHER_ENGINE
+        try:
+            assert select_cipher_engine('keymanager') is KeymanagerCipherEngine
+            assert isinstance(create_cipher_engine(os.urandom(32)), KeymanagerCipherEngine)
+            assert select_cipher_engine() is CryptodomeCipherEngine
+            # 第一次创建引擎时才选择
+            video.CIPHER_ENGINE = None
+            assert isinstance(create_cipher_engine(os.urandom(32)), CryptodomeCipherEngine)
+            assert video.CIPHER_ENGINE is CryptodomeCipherEngine
+            with self.assertRaises(TypeError):
+                video.CipherEngine(os.urandom(32))
+        finally:
+            video.CIPHER_ENGINE = engine_class
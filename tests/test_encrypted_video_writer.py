@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from gxbzys.video import EncryptedVideoWriter, VideoHead, VideoStream, CIPHER_MODE_GCM, verify_encrypt_video, \
+    update_video_keys
+from keymanager.utils import read_file
+from tests.util import RAW_FILE, INFO_NAME, create_video_info, read_encrypt_file
+
+
+class NonSeekableStream:
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        return self.writer.write(data)
+
+
+class TestEncryptedVideoWriter(TestCase):
+    input_file = RAW_FILE
+    output_file = './enc/stream.enc.webp'
+
+    def tearDown(self):
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+    def _write(self, key, chunk_size, **kwargs):
+        raw_content = read_file(self.input_file)
+        with open(self.output_file, 'wb') as f:
+            with EncryptedVideoWriter(key, NonSeekableStream(f), [create_video_info()], block_size=1000,
+                                      **kwargs) as writer:
+                for i in range(0, len(raw_content), chunk_size):
+                    writer.write(raw_content[i:i + chunk_size])
+        return raw_content
+
+    def _check(self, key, raw_content):
+        assert VideoHead.is_encrypt_video(self.output_file)
+        for lazy_head in [True, False]:
+            stream = VideoStream(self.output_file, key, lazy_head=lazy_head)
+            stream.open()
+            assert stream.head.raw_file_size == len(raw_content)
+            assert stream.head.file_size == os.path.getsize(self.output_file)
+            assert stream.read(len(raw_content) + 1) == raw_content
+            for pos, length in [(5000, 7), (999, 10), (len(raw_content) - 3, 20), (0, 3000)]:
+                stream.seek(pos)
+                assert stream.read(length) == raw_content[pos:pos + length]
+            stream.video_info_reader.open()
+            assert list(stream.video_info_reader.read())[0].info[b'name'] == INFO_NAME
+            stream.close()
+
+    def test_write(self):
+        key = os.urandom(32)
+        for chunk_size in [1, 333, 1000, 4096]:
+            raw_content = self._write(key, chunk_size, digest=True, key_check=True)
+            self._check(key, raw_content)
+            assert verify_encrypt_video(key, self.output_file, workers=2)
+
+    def test_write_compact_envelope(self):
+        key, new_key = os.urandom(32), os.urandom(32)
+        raw_content = self._write(key, 777, cipher_mode=CIPHER_MODE_GCM, compact=True, envelope=True, digest=True)
+        self._check(key, raw_content)
+        assert verify_encrypt_video(key, self.output_file)
+
+        update_video_keys(self.output_file, key, add_keys=[new_key], remove_keys=[key])
+        self._check(new_key, raw_content)
+
+    def test_pipe(self):
+        key_file = './enc/stream.key'
+        key = os.urandom(32)
+        with open(key_file, 'wb') as f:
+            f.write(key)
+        with open(self.input_file, 'rb') as reader, open(self.output_file, 'wb') as writer:
+            subprocess.run([sys.executable, '-m', 'gxbzys.encrypt', key_file], stdin=reader, stdout=writer,
+                           check=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        os.remove(key_file)
+        assert read_encrypt_file(self.output_file, key) == read_file(self.input_file)
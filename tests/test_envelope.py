@@ -0,0 +1,77 @@
+import os
+import shutil
+from unittest import TestCase
+
+from gxbzys.rekey import rewrap_directory
+from gxbzys.video import VideoDecryptException, update_video_keys, CIPHER_MODE_GCM, KEY_SLOT_NUM
+from keymanager.utils import read_file
+from tests.util import RAW_FILE, INFO_NAME, create_encrypt_file, create_video_info, read_encrypt_file, \
+    read_video_infos
+
+
+class TestEnvelope(TestCase):
+    input_file = RAW_FILE
+    output_dir = './enc/envelope'
+
+    def setUp(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write(self, output_file, key, cipher_mode=0):
+        return create_encrypt_file(self.input_file, output_file, key, [create_video_info()],
+                                   head_args=dict(default_block_size=1024, cipher_mode=cipher_mode),
+                                   default_block_size=1024, envelope=True)
+
+    def _read(self, output_file, key):
+        data = read_encrypt_file(output_file, key)
+        assert read_video_infos(output_file, key)[0].info[b'name'] == INFO_NAME
+        return data
+
+    def test_rotate_key(self):
+        raw_content = read_file(self.input_file)
+        key, new_key, other_key = os.urandom(32), os.urandom(32), os.urandom(32)
+        output_file = os.path.join(self.output_dir, 'photo.enc.webp')
+        head = self._write(output_file, key, CIPHER_MODE_GCM)
+        assert len(head.get_key_slots()) == KEY_SLOT_NUM
+        assert self._read(output_file, key) == raw_content
+        with self.assertRaises(VideoDecryptException):
+            self._read(output_file, other_key)
+
+        enc_content = read_file(output_file)
+        update_video_keys(output_file, key, add_keys=[new_key], remove_keys=[key])
+        # 只修改了文件头中的密钥槽
+        new_enc_content = read_file(output_file)
+        assert len(new_enc_content) == len(enc_content)
+        assert new_enc_content[head.head_size:] == enc_content[head.head_size:]
+        assert self._read(output_file, new_key) == raw_content
+        with self.assertRaises(VideoDecryptException):
+            self._read(output_file, key)
+
+        with self.assertRaises(VideoDecryptException):
+            update_video_keys(output_file, new_key, remove_keys=[new_key])
+        with self.assertRaises(VideoDecryptException):
+            update_video_keys(output_file, key, add_keys=[other_key])
+
+        keys = [os.urandom(32) for _ in range(KEY_SLOT_NUM - 1)]
+        update_video_keys(output_file, new_key, add_keys=keys)
+        for k in keys:
+            assert self._read(output_file, k) == raw_content
+        with self.assertRaises(VideoDecryptException):
+            update_video_keys(output_file, new_key, add_keys=[other_key])
+
+    def test_rewrap_directory(self):
+        raw_content = read_file(self.input_file)
+        key, new_key = os.urandom(32), os.urandom(32)
+        files = [os.path.join(self.output_dir, f'{i}.enc.webp') for i in range(3)]
+        for f in files:
+            self._write(f, key)
+        shutil.copy(self.input_file, os.path.join(self.output_dir, 'raw.webp'))
+
+        succeeded, failed = rewrap_directory(self.output_dir, key, new_key, remove_old=False)
+        assert sorted(succeeded) == sorted(files)
+        assert failed == []
+        for f in files:
+            assert self._read(f, key) == raw_content
+            assert self._read(f, new_key) == raw_content
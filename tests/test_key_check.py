@@ -0,0 +1,71 @@
+import os
+from unittest import TestCase
+
+from gxbzys.video import VideoStream, VideoDecryptException, KeyRing, update_video_keys, get_key_id
+from keymanager.utils import read_file
+from tests.util import RAW_FILE, create_encrypt_file, read_encrypt_file
+
+
+class TestKeyCheck(TestCase):
+    input_file = RAW_FILE
+
+    def _write(self, output_file, key, **kwargs):
+        return create_encrypt_file(self.input_file, output_file, key, head_args=dict(default_block_size=1024),
+                                   default_block_size=1024, **kwargs)
+
+    def _read(self, output_file, key, key_ring=None):
+        return read_encrypt_file(output_file, key, key_ring=key_ring)
+
+    def test_key_check(self):
+        raw_content = read_file(self.input_file)
+        key, other_key = os.urandom(32), os.urandom(32)
+        output_file = './enc/key_check.enc.webp'
+        head = self._write(output_file, key, key_check=True)
+        assert head.get_key_ids() == [get_key_id(key)]
+        assert head.match_key(key)
+        assert not head.match_key(other_key)
+        assert self._read(output_file, key) == raw_content
+        with self.assertRaises(VideoDecryptException):
+            self._read(output_file, other_key)
+        os.remove(output_file)
+
+    def test_legacy_file(self):
+        # 没有密钥校验值的文件，检查第一个数据块的填充字符
+        enc_file = './data/photo-1615529328331-f8917597711f.enc.webp'
+        key = read_file('./data/key.key')
+        stream = VideoStream(enc_file, key)
+        stream.open()
+        assert stream.head.match_key(key) is None
+        stream.close()
+        with self.assertRaises(VideoDecryptException):
+            self._read(enc_file, os.urandom(32))
+
+    def test_key_ring(self):
+        raw_content = read_file(self.input_file)
+        keys = [os.urandom(32) for _ in range(3)]
+        files = [f'./enc/key_ring_{i}.enc.webp' for i in range(4)]
+        self._write(files[0], keys[0], key_check=True)
+        self._write(files[1], keys[1], envelope=True)
+        self._write(files[2], keys[2], envelope=True)
+        self._write(files[3], keys[0])
+        update_video_keys(files[2], keys[2], add_keys=[keys[1]], remove_keys=[keys[2]])
+
+        key_ring = KeyRing()
+        for key in keys[:2]:
+            key_ring.add(key)
+        assert len(key_ring) == 2
+        current_key = keys[1]
+        # 当前密钥不是文件使用的密钥时按密钥标识选择
+        assert self._read(files[0], current_key, key_ring) == raw_content
+        assert self._read(files[1], current_key, key_ring) == raw_content
+        assert self._read(files[2], current_key, key_ring) == raw_content
+        # 没有密钥标识的文件使用当前密钥
+        assert self._read(files[3], keys[0], key_ring) == raw_content
+        with self.assertRaises(VideoDecryptException):
+            self._read(files[3], current_key, key_ring)
+
+        key_ring.remove(keys[0])
+        with self.assertRaises(VideoDecryptException):
+            self._read(files[0], current_key, key_ring)
+        for f in files:
+            os.remove(f)
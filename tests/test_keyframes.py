@@ -0,0 +1,223 @@
+import os
+import struct
+import time
+from unittest import TestCase
+
+from gxbzys.keyframes import Keyframe, find_keyframes, plan_block_boundaries, TS_PACKET_SIZE
+from gxbzys.video import VideoHead, VideoStream, write_encrypt_video, verify_encrypt_video
+
+
+def _pts_bytes(pts: int) -> bytes:
+    return bytes([0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1,
+                  (pts >> 7) & 0xFF, ((pts << 1) & 0xFE) | 1])
+
+
+def make_ts(packet_num: int, keyframe_every: int, audio_every: int = 0) -> (bytes, list):
+    """
+    生成每隔`keyframe_every`个数据包有一个关键帧的MPEG-TS数据，
+    `audio_every`不为0时每隔`audio_every`个数据包有一个设置了`random_access_indicator`的音频PES
+    """
+    data = bytearray()
+    keyframes = []
+    for i in range(packet_num):
+        if audio_every and i % audio_every == 1:
+            pes = b'\x00\x00\x01\xc0\x00\x00\x80\x80\x05' + _pts_bytes(i * 900)
+            packet = bytes([0x47, 0x41, 0x01, 0x30, 0x01, 0x40]) + pes
+        elif i % keyframe_every == 0:
+            pts = i * 900
+            pes = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + _pts_bytes(pts)
+            packet = bytes([0x47, 0x41, 0x00, 0x30, 0x01, 0x40]) + pes
+            keyframes.append(Keyframe(len(data), pts / 90000))
+        else:
+            packet = bytes([0x47, 0x01, 0x00, 0x10])
+        data += packet + os.urandom(TS_PACKET_SIZE - len(packet))
+    return bytes(data), keyframes
+
+
+def _ebml(element_id: int, payload: bytes, unknown_size: bool = False) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, byteorder='big')
+    size = b'\x01\xff\xff\xff\xff\xff\xff\xff' if unknown_size else b'\x01' + len(payload).to_bytes(7, 'big')
+    return id_bytes + size + payload
+
+
+def make_mkv(cluster_num: int, unknown_size: bool = False) -> (bytes, list):
+    """生成每个Cluster只有一个SimpleBlock的MKV数据"""
+    header = _ebml(0x1A45DFA3, _ebml(0x4282, b'matroska'))
+    info = _ebml(0x1549A966, _ebml(0x2AD7B1, (1000000).to_bytes(3, 'big')))
+    clusters = bytearray()
+    keyframes = []
+    segment_start = len(header) + 12
+    for i in range(cluster_num):
+        keyframes.append(Keyframe(segment_start + len(info) + len(clusters), i * 2.0))
+        content = _ebml(0xE7, (i * 2000).to_bytes(4, 'big')) + _ebml(0xA3, os.urandom(3000))
+        clusters += _ebml(0x1F43B675, content, unknown_size)
+    return header + _ebml(0x18538067, info + bytes(clusters)), keyframes
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def _full_box(box_type: bytes, payload: bytes) -> bytes:
+    return _box(box_type, b'\x00\x00\x00\x00' + payload)
+
+
+def _video_trak(stbl: bytes) -> bytes:
+    tkhd = _full_box(b'tkhd', struct.pack('>III', 0, 0, 1) + bytes(68))
+    mdhd = _full_box(b'mdhd', struct.pack('>IIII', 0, 0, 1000, 0) + bytes(4))
+    hdlr = _full_box(b'hdlr', b'\x00\x00\x00\x00vide' + bytes(13))
+    return _box(b'trak', tkhd + _box(b'mdia', mdhd + hdlr + _box(b'minf', _box(b'stbl', stbl))))
+
+
+def make_mp4(sample_num: int, keyframe_every: int, sample_size: int = 500) -> (bytes, list):
+    """生成每个chunk有两个样本的MP4数据"""
+    ftyp = _box(b'ftyp', b'isom\x00\x00\x00\x00')
+    mdat_start = len(ftyp) + 8
+    mdat = _box(b'mdat', os.urandom(sample_num * sample_size))
+    sync = [i + 1 for i in range(0, sample_num, keyframe_every)]
+    keyframes = [Keyframe(mdat_start + (s - 1) * sample_size, (s - 1) * 40 / 1000) for s in sync]
+    stbl = (_full_box(b'stts', struct.pack('>III', 1, sample_num, 40)) +
+            _full_box(b'stss', struct.pack(f'>I{len(sync)}I', len(sync), *sync)) +
+            _full_box(b'stsz', struct.pack(f'>II{sample_num}I', 0, sample_num, *[sample_size] * sample_num)) +
+            _full_box(b'stsc', struct.pack('>IIII', 1, 1, 2, 1)) +
+            _full_box(b'stco', struct.pack(f'>I{sample_num // 2}I', sample_num // 2,
+                                           *[mdat_start + i * 2 * sample_size for i in range(sample_num // 2)])))
+    return ftyp + mdat + _box(b'moov', _video_trak(stbl)), keyframes
+
+
+def make_fragmented_mp4(fragment_num: int) -> (bytes, list):
+    data = bytearray(_box(b'ftyp', b'iso6\x00\x00\x00\x00'))
+    data += _box(b'moov', _video_trak(b''))
+    keyframes = []
+    for i in range(fragment_num):
+        keyframes.append(Keyframe(len(data), i * 2.0))
+        traf = _box(b'traf', _full_box(b'tfhd', struct.pack('>I', 1)) +
+                    _box(b'tfdt', b'\x01\x00\x00\x00' + struct.pack('>Q', i * 2000)))
+        data += _box(b'moof', _full_box(b'mfhd', struct.pack('>I', i + 1)) + traf)
+        data += _box(b'mdat', os.urandom(3000))
+    return bytes(data), keyframes
+
+
+class TestKeyframes(TestCase):
+
+    def _find(self, data: bytes, name: str) -> list:
+        file_path = f'./enc/{name}'
+        with open(file_path, 'wb') as writer:
+            writer.write(data)
+        try:
+            return find_keyframes(file_path)
+        finally:
+            os.remove(file_path)
+
+    def test_ts(self):
+        data, keyframes = make_ts(200, 30)
+        assert self._find(data, 'keyframes.ts') == keyframes
+        # 音频PES也设置了random_access_indicator，不是关键帧
+        data, keyframes = make_ts(200, 30, audio_every=7)
+        assert self._find(data, 'keyframes_audio.ts') == keyframes
+
+    def test_mkv(self):
+        data, keyframes = make_mkv(10)
+        assert self._find(data, 'keyframes.mkv') == keyframes
+        data, keyframes = make_mkv(10, unknown_size=True)
+        assert self._find(data, 'keyframes_live.mkv') == keyframes
+        # EBML头的大小未知
+        data = b'\x1a\x45\xdf\xa3\x01\xff\xff\xff\xff\xff\xff\xff' + data[12:]
+        assert self._find(data, 'keyframes_unknown_header.mkv') == []
+
+    def test_mp4(self):
+        data, keyframes = make_mp4(100, 25)
+        assert self._find(data, 'keyframes.mp4') == keyframes
+        data, keyframes = make_fragmented_mp4(8)
+        assert self._find(data, 'keyframes_frag.mp4') == keyframes
+
+    def test_mp4_broken(self):
+        # 视频轨道没有tkhd
+        hdlr = _full_box(b'hdlr', b'\x00\x00\x00\x00vide' + bytes(13))
+        trak = _box(b'trak', _box(b'mdia', hdlr))
+        data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', trak)
+        assert self._find(data, 'keyframes_no_tkhd.mp4') == []
+        # 截断的文件
+        data, _ = make_mp4(100, 25)
+        for size in (len(data) - 20, len(data) - 200):
+            assert self._find(data[:size], 'keyframes_truncated.mp4') == []
+
+    def test_unknown_format(self):
+        assert self._find(os.urandom(4096), 'keyframes.bin') == []
+
+    def test_plan_block_boundaries(self):
+        keyframes = [Keyframe(p) for p in (900, 2100, 2500, 3900, 9000)]
+        boundaries = plan_block_boundaries(12000, keyframes, 1000, tolerance=0.25)
+        # 2500距离上一个边界太近，附近没有关键帧时按1000分块
+        assert boundaries == [0, 900, 2100, 3100, 3900, 4900, 5900, 6900, 7900, 9000, 10000, 11000]
+        sizes = [b - a for a, b in zip(boundaries, boundaries[1:] + [12000])]
+        assert all(750 <= size <= 1250 for size in sizes[:-1])
+        assert plan_block_boundaries(100, [], 1000) == [0]
+
+    def test_encrypt_aligned(self):
+        data, keyframes = make_ts(400, 20)
+        input_file = './enc/keyframes_raw.ts'
+        output_file = './enc/keyframes_enc.ts'
+        with open(input_file, 'wb') as writer:
+            writer.write(data)
+        key = os.urandom(32)
+        block_size = TS_PACKET_SIZE * 16
+        head = VideoHead.from_raw_file(input_file, default_block_size=block_size, align_keyframes=True)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=block_size)
+        # 每个数据块都从关键帧开始
+        positions = {k.pos for k in keyframes}
+        assert all(pos in positions for pos in head.block_table.raw_start_pos)
+
+        stream = VideoStream(output_file, key)
+        stream.open()
+        assert stream.read(len(data)) == data
+        for k in keyframes[::5]:
+            stream.seek(k.pos)
+            assert stream.read(TS_PACKET_SIZE) == data[k.pos:k.pos + TS_PACKET_SIZE]
+        stream.close()
+        os.remove(input_file)
+        os.remove(output_file)
+
+    def test_seek_index(self):
+        data, keyframes = make_mkv(40)
+        input_file = './enc/seek_index_raw.mkv'
+        output_file = './enc/seek_index_enc.mkv'
+        with open(input_file, 'wb') as writer:
+            writer.write(data)
+        key = os.urandom(32)
+        block_size = 8192
+        head = VideoHead.from_raw_file(input_file, default_block_size=block_size)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=block_size, digest=True,
+                                seek_index=True)
+        assert verify_encrypt_video(key, output_file)
+
+        stream = VideoStream(output_file, key, prefetch_depth=2)
+        stream.open()
+        seek_index = stream.get_seek_index()
+        assert len(seek_index) == len(keyframes)
+        assert list(seek_index.positions) == [k.pos for k in keyframes]
+        assert list(seek_index.blocks) == [k.pos // block_size for k in keyframes]
+        # 跳转到两个关键帧之间时从前一个关键帧开始
+        k = keyframes[30]
+        assert stream.prefetch_time(k.time + 1) == k.pos
+        end = time.monotonic() + 5
+        while k.pos // block_size not in stream.block_cache and time.monotonic() < end:
+            time.sleep(0.01)
+        assert k.pos // block_size in stream.block_cache
+        stream.seek(k.pos)
+        assert stream.read(100) == data[k.pos:k.pos + 100]
+        stream.close()
+
+        # 没有跳转索引的文件
+        head = VideoHead.from_raw_file(input_file, default_block_size=block_size)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=block_size)
+        stream = VideoStream(output_file, key)
+        stream.open()
+        assert stream.get_seek_index() is None
+        assert stream.prefetch_time(10) is None
+        stream.close()
+        os.remove(input_file)
+        os.remove(output_file)
@@ -0,0 +1,63 @@
+import os
+import time
+from unittest import TestCase
+
+from gxbzys.pipeline import StagedPipeline
+from gxbzys.video import VideoHead, VideoStream, write_encrypt_video
+from keymanager.utils import read_file
+
+
+class TestStagedPipeline(TestCase):
+
+    def test_stages(self):
+        pipeline = StagedPipeline(queue_size=2)
+
+        def source(_):
+            for i in range(20):
+                yield i
+
+        def slow_square(items):
+            for i in items:
+                time.sleep(0.01)
+                yield i * i
+
+        pipeline.add_stage('read', source)
+        pipeline.add_stage('square', slow_square)
+        assert list(pipeline.run()) == [i * i for i in range(20)]
+        assert pipeline.stats['square'].items == 20
+        assert pipeline.stats['square'].busy_time >= 0.2
+        assert pipeline.stats['read'].blocked_time > pipeline.stats['read'].busy_time
+        assert 'bottleneck: square' in pipeline.report()
+
+    def test_error(self):
+        pipeline = StagedPipeline()
+
+        def source(_):
+            yield 1
+            raise IOError('read error')
+
+        pipeline.add_stage('read', source)
+        pipeline.add_stage('copy', lambda items: (i for i in items))
+        result = []
+        with self.assertRaises(IOError):
+            for i in pipeline.run():
+                result.append(i)
+        assert result == [1]
+
+    def test_write_encrypt_video(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+
+        head = VideoHead.from_raw_file(input_file, default_block_size=1024)
+        pipeline = StagedPipeline(queue_size=3)
+        with open(input_file, 'rb') as reader, open('./enc/pipeline.enc.webp', 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=1024, workers=2, pipeline=pipeline)
+        for name in ['read', 'encrypt', 'write']:
+            assert pipeline.stats[name].items == len(head.block_table)
+
+        stream = VideoStream('./enc/pipeline.enc.webp', key)
+        stream.open()
+        assert stream.read(head.raw_file_size + 1) == read_file(input_file)
+        stream.close()
+        os.remove('./enc/pipeline.enc.webp')
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from gxbzys.cache import DecryptedBlockCache
+from gxbzys.prefetch import BlockPrefetcher
+from gxbzys.video import VideoStream
+from keymanager.utils import read_file
+
+
+def wait_until(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestBlockPrefetcher(TestCase):
+
+    def test_prefetch_and_seek(self):
+        loaded = []
+        release = threading.Event()
+
+        def load_block(idx):
+            loaded.append(idx)
+            if idx >= 50:
+                release.wait()
+            return bytes([idx % 256]) * 10
+
+        cache = DecryptedBlockCache(max_size=1024, pin_first_last=False)
+        prefetcher = BlockPrefetcher(load_block, cache, 100, max_depth=4, min_depth=2)
+        prefetcher.start()
+
+        prefetcher.update(0)
+        assert wait_until(lambda: 1 in cache and 2 in cache)
+        assert 3 not in cache
+
+        # 顺序读取，读取速度很快，预读深度增加到最大值
+        for idx in range(1, 10):
+            prefetcher.update(idx)
+        assert prefetcher.depth == 4
+        assert wait_until(lambda: all(i in cache for i in range(10, 14)))
+
+        # 跳转以后丢弃已经预读和正在预读的数据块
+        prefetcher.update(49)
+        assert wait_until(lambda: 50 in loaded)
+        prefetcher.update(80)
+        release.set()
+        assert wait_until(lambda: 81 in cache and 82 in cache)
+        assert 10 not in cache
+        assert 50 not in cache
+        assert prefetcher.discarded > 0
+        prefetcher.close()
+
+    def test_shared_cache(self):
+        cache = DecryptedBlockCache(max_size=1024, pin_first_last=False)
+        prefetcher = BlockPrefetcher(lambda idx: bytes([idx % 256]) * 10, cache, 100, max_depth=4, min_depth=4)
+        prefetcher.start()
+        prefetcher.update(0)
+        assert wait_until(lambda: all(i in cache for i in range(1, 5)))
+
+        # 共用缓存的其他视频流读取过的数据块在跳转后保留
+        assert cache.get(2) is not None
+        prefetcher.update(50)
+        assert wait_until(lambda: 51 in cache)
+        assert 2 in cache
+        assert 1 not in cache and 3 not in cache
+        prefetcher.close()
+
+    def test_prefetch_stream(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        raw_content = read_file(os.path.join(root, 'photo-1615529328331-f8917597711f.webp'))
+        enc_file = os.path.join(root, 'photo-1615529328331-f8917597711f.enc.webp')
+
+        stream = VideoStream(enc_file, key, prefetch_depth=4)
+        stream.open()
+        data = b''
+        while True:
+            new_data = stream.read(500)
+            if len(new_data) == 0:
+                break
+            data += new_data
+        assert data == raw_content
+        stream.seek(10000)
+        assert stream.read(3000) == raw_content[10000:13000]
+        stream.close()
@@ -0,0 +1,138 @@
+import os
+from unittest import TestCase, skipUnless
+
+from gxbzys.trickplay import TrickplayGenerator, av, Image
+from gxbzys.video import TrickplayIndex, VideoHead, VideoStream, write_encrypt_video, verify_encrypt_video, \
+    INFO_TRICKPLAY_INDEX, INFO_TRICKPLAY_SHEET
+
+
+class SolidTrickplayGenerator(TrickplayGenerator):
+    """不解码视频，每张拼图的内容为拼图序号，用于测试加密和读取"""
+
+    def _probe(self, interval, tile_width, columns, rows):
+        self.index = TrickplayIndex(int(interval * 1000), tile_width, tile_width // 2, columns, rows)
+        self._tile_num = 25
+
+    def _generate(self):
+        pass
+
+    def create_infos(self):
+        if self._infos is None:
+            index = TrickplayIndex(self.index.interval, self.index.tile_width, self.index.tile_height,
+                                   self.index.columns, self.index.rows)
+            index.times.extend(i * self.index.interval for i in range(self._tile_num))
+            sheets = []
+            for sheet in range(index.sheet_num):
+                # 第3张拼图生成失败
+                data = bytes([sheet]) * 40 if sheet != 2 else b''
+                index.sheet_lengths.append(len(data))
+                sheets.append(data + bytes(self.get_sheet_size(sheet) - len(data)))
+            self._infos = self._create_infos(index.to_bytes(), sheets)
+        return self._infos
+
+
+class TestTrickplay(TestCase):
+    input_file = './data/photo-1615529328331-f8917597711f.webp'
+
+    def test_index(self):
+        index = TrickplayIndex(10000, 160, 90, 4, 3)
+        index.times.extend(range(0, 300000, 10000))
+        index.sheet_lengths.extend([100, 200, 300])
+        data = index.to_bytes()
+        assert len(data) == TrickplayIndex.get_bytes_len(30, 3)
+        index = TrickplayIndex.from_bytes(data)
+        assert index.sheet_num == 3 and list(index.sheet_lengths) == [100, 200, 300]
+        assert index.find(0) == 0
+        assert index.find(25.5) == 2
+        assert index.find(1000) == 29
+        # 第18张缩略图在第2张拼图的第2行第2列
+        assert index.get_tile_rect(17) == (1, 160, 90, 160, 90)
+
+    def test_not_video(self):
+        file_path = './enc/trickplay_not_video.bin'
+        with open(file_path, 'wb') as writer:
+            writer.write(os.urandom(4096))
+        assert not TrickplayGenerator(file_path).enabled
+        os.remove(file_path)
+
+    def test_write_and_read(self):
+        output_file = './enc/trickplay.enc.webp'
+        key = os.urandom(32)
+        head = VideoHead.from_raw_file(self.input_file, default_block_size=1024)
+        trickplay = SolidTrickplayGenerator(self.input_file, interval=2, tile_width=16, columns=4, rows=2)
+        with open(self.input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=1024, digest=True,
+                                trickplay=trickplay)
+        # 摘要仍然在最后一个视频信息中
+        assert verify_encrypt_video(key, output_file)
+
+        stream = VideoStream(output_file, key)
+        stream.open()
+        index = stream.get_trickplay_index()
+        assert len(index) == 25 and index.sheet_num == 4
+        sheet, rect = stream.get_trickplay_tile(27)
+        assert sheet == bytes([1]) * 40
+        assert rect == (16, 8, 16, 8)
+        # 生成失败的拼图没有缩略图
+        assert stream.get_trickplay_tile(35) is None
+        sheet, rect = stream.get_trickplay_tile(1000)
+        assert sheet == bytes([3]) * 40
+        assert rect == (0, 0, 16, 8)
+        stream.close()
+        os.remove(output_file)
+
+
+def make_video(file_path: str, seconds: int = 5, fps: int = 10):
+    """使用PyAV生成颜色逐帧变化的视频"""
+    with av.open(file_path, 'w') as container:
+        stream = container.add_stream('mpeg4', rate=fps)
+        stream.width, stream.height = 64, 48
+        stream.pix_fmt = 'yuv420p'
+        for i in range(seconds * fps):
+            image = Image.new('RGB', (64, 48), ((i * 5) % 256, 128, 255 - (i * 5) % 256))
+            for packet in stream.encode(av.VideoFrame.from_image(image)):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@skipUnless(TrickplayGenerator.is_available(), 'PyAV and Pillow not installed')
+class TestTrickplayGenerator(TestCase):
+    video_file = './enc/trickplay_raw.mp4'
+
+    def setUp(self):
+        make_video(self.video_file)
+
+    def tearDown(self):
+        os.remove(self.video_file)
+
+    def test_generate(self):
+        generator = TrickplayGenerator(self.video_file, interval=1, tile_width=16, columns=2, rows=2)
+        assert generator.enabled
+        assert generator.index.tile_height == 12
+        placeholders = generator.create_placeholder_infos()
+        generator.start()
+        infos = generator.create_infos()
+        assert len(infos) == len(placeholders) == 3
+        for info, placeholder in zip(infos, placeholders):
+            assert info.create_video_info_index().length == placeholder.create_video_info_index().length
+        index = TrickplayIndex.from_bytes(infos[0].info[INFO_TRICKPLAY_INDEX])
+        assert len(index) == 5 and index.sheet_num == 2
+        assert list(index.times) == sorted(index.times)
+        for sheet, info in enumerate(infos[1:]):
+            data = info.info[INFO_TRICKPLAY_SHEET]
+            assert 0 < index.sheet_lengths[sheet] <= generator.get_sheet_size(sheet)
+            assert data[:2] == b'\xff\xd8'
+            assert len(data) == generator.get_sheet_size(sheet)
+        generator.close()
+
+    def test_encode_sheet(self):
+        generator = TrickplayGenerator(self.video_file, interval=1, tile_width=16, columns=2, rows=2)
+        tiles = [Image.new('RGB', (16, 12), (i * 60, 0, 0)) for i in range(4)]
+        data = generator._encode_sheet(0, tiles)
+        assert 0 < len(data) <= generator.get_sheet_size(0)
+        # 最低质量也超过预留的长度时放弃并记录日志
+        noise = [Image.frombytes('RGB', (16, 12), os.urandom(16 * 12 * 3)) for _ in range(4)]
+        generator.get_sheet_size = lambda sheet: 16
+        with self.assertLogs('TrickplayGenerator', 'ERROR'):
+            assert generator._encode_sheet(0, noise) == b''
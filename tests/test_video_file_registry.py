@@ -0,0 +1,56 @@
+import os
+import threading
+from unittest import TestCase
+
+from gxbzys.video import VideoStream, VideoFileRegistry
+from keymanager.utils import read_file
+
+
+class TestVideoFileRegistry(TestCase):
+
+    def test_shared_streams(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        raw_content = read_file(os.path.join(root, 'photo-1615529328331-f8917597711f.webp'))
+        enc_file = os.path.join(root, 'photo-1615529328331-f8917597711f.enc.webp')
+
+        registry = VideoFileRegistry(cache_size=64 * 1024)
+        streams = [VideoStream(enc_file, key, registry=registry) for _ in range(4)]
+        for stream in streams:
+            stream.open()
+        assert len(registry) == 1
+        shared_file = streams[0].shared_file
+        assert all(stream.head is shared_file.head for stream in streams)
+        assert shared_file.ref_count == 4
+
+        errors = []
+
+        def read_all(stream, start):
+            try:
+                for _ in range(20):
+                    stream.seek(start)
+                    data = b''
+                    while True:
+                        new_data = stream.read(777)
+                        if len(new_data) == 0:
+                            break
+                        data += new_data
+                    if data != raw_content[start:]:
+                        errors.append(start)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read_all, args=(stream, i * 5000)) for i, stream in enumerate(streams)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert shared_file.block_cache.hits > 0
+
+        for stream in streams[:3]:
+            stream.close()
+        assert len(registry) == 1
+        streams[3].close()
+        assert len(registry) == 0
+        assert shared_file.reader.file_stream.closed
@@ -0,0 +1,152 @@
+import os
+import tracemalloc
+from io import FileIO
+from unittest import TestCase
+
+from gxbzys.video import VideoHead, VideoInfo, VideoStream, write_encrypt_video, create_cipher_engine, \
+    CIPHER_MODE_CBC, CIPHER_MODE_GCM, HEAD_FILE_MARKER_V2, INFO_FORMAT_LARGE, INFO_FORMAT_PADDED, INFO_FORMAT_COMPACT, \
+    INFO_CHUNK_SIZE
+
+
+class TestVideoInfo(TestCase):
+    input_file = './data/photo-1615529328331-f8917597711f.webp'
+
+    def _read_infos(self, output_file, key):
+        stream = VideoStream(output_file, key)
+        stream.open()
+        try:
+            stream.video_info_reader.open()
+            return stream.head, list(stream.video_info_reader.read())
+        finally:
+            stream.close()
+
+    def test_stream_encryptor(self):
+        key = os.urandom(32)
+        data = os.urandom(INFO_CHUNK_SIZE * 2 + 5)
+        for cipher_mode in (CIPHER_MODE_CBC, CIPHER_MODE_GCM):
+            cipher = create_cipher_engine(key, cipher_mode)
+            encryptor = cipher.create_encryptor()
+            enc_data = b''.join(encryptor.update(data[i:i + 1000]) for i in range(0, len(data), 1000))
+            enc_data += encryptor.finalize()
+            assert cipher.decrypt(encryptor.iv, -1, enc_data) == data
+
+    def test_large_info(self):
+        # 超过16M的数据使用INFO_FORMAT_LARGE，分块加密，内存占用与数据大小无关
+        attachment_file = './enc/large_attachment.bin'
+        output_file = './enc/large_info.enc.webp'
+        attachment_size = 20 * 1024 * 1024
+        with open(attachment_file, 'wb') as writer:
+            for _ in range(attachment_size // INFO_CHUNK_SIZE):
+                writer.write(os.urandom(INFO_CHUNK_SIZE))
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        video_info.add_info(b'attachment', FileIO(attachment_file))
+        assert video_info.get_info_format() == INFO_FORMAT_LARGE
+
+        key = os.urandom(32)
+        head = VideoHead.from_raw_file(self.input_file, default_block_size=1024)
+        tracemalloc.start()
+        with open(self.input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1024)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < INFO_CHUNK_SIZE * 8
+
+        head, infos = self._read_infos(output_file, key)
+        assert head.marker == HEAD_FILE_MARKER_V2
+        assert head.info_format == INFO_FORMAT_LARGE
+        assert infos[0].info[b'name'] == b'photo.webp'
+        with open(attachment_file, 'rb') as f:
+            assert infos[0].info[b'attachment'] == f.read()
+        os.remove(attachment_file)
+        os.remove(output_file)
+
+    def test_small_info(self):
+        # 数据都不超过16M时文件格式不变
+        output_file = './enc/small_info.enc.webp'
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        video_info.add_info(b'thumbnail', FileIO(self.input_file))
+        key = os.urandom(32)
+        head = VideoHead.from_raw_file(self.input_file, default_block_size=1024)
+        with open(self.input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1024)
+        head, infos = self._read_infos(output_file, key)
+        assert head.info_format == INFO_FORMAT_PADDED
+        assert len(head.extensions) == 0
+        with open(self.input_file, 'rb') as f:
+            assert infos[0].info[b'thumbnail'] == f.read()
+        os.remove(output_file)
+
+    def test_compact_format(self):
+        video_info = VideoInfo()
+        for i in range(300):
+            video_info.add_info(f'meta{i}'.encode('utf-8'), str(i).encode('utf-8'))
+        video_info.add_info(b'\x00name', b'')
+        video_info.add_info(b'thumbnail', FileIO(self.input_file))
+        data = video_info.to_bytes(INFO_FORMAT_COMPACT)
+        assert len(data) == video_info.create_video_info_index(INFO_FORMAT_COMPACT).length
+        assert len(data) < 300 * 20 + os.path.getsize(self.input_file)
+        new_info = VideoInfo.from_bytes(data, INFO_FORMAT_COMPACT)
+        assert new_info.video_info_cnt == 302
+        assert new_info.info[b'meta299'] == b'299'
+        # 名字原样保存，不会去掉0
+        assert new_info.info[b'\x00name'] == b''
+        with open(self.input_file, 'rb') as f:
+            assert new_info.info[b'thumbnail'] == f.read()
+
+    def test_write_compact(self):
+        output_file = './enc/compact_info.enc.webp'
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        video_info.add_info(b'thumbnail', FileIO(self.input_file))
+        key = os.urandom(32)
+        head = VideoHead.from_raw_file(self.input_file, default_block_size=1024)
+        with open(self.input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1024, digest=True,
+                                info_format=INFO_FORMAT_COMPACT)
+        head, infos = self._read_infos(output_file, key)
+        assert head.info_format == INFO_FORMAT_COMPACT
+        assert infos[0].info[b'name'] == b'photo.webp'
+        with open(self.input_file, 'rb') as f:
+            assert infos[0].info[b'thumbnail'] == f.read()
+        os.remove(output_file)
+
+    def test_get_entry(self):
+        output_file = './enc/get_entry.enc.webp'
+        with open(self.input_file, 'rb') as f:
+            thumbnail = f.read()
+        key = os.urandom(32)
+        for cipher_mode in (CIPHER_MODE_CBC, CIPHER_MODE_GCM):
+            for info_format in (INFO_FORMAT_PADDED, INFO_FORMAT_COMPACT):
+                video_info = VideoInfo()
+                video_info.add_info(b'thumbnail', FileIO(self.input_file))
+                for i in range(300):
+                    video_info.add_info(f'meta{i}'.encode('utf-8'), str(i).encode('utf-8'))
+                duration_info = VideoInfo()
+                duration_info.add_info(b'name', b'photo.webp')
+                duration_info.add_info(b'duration', b'12.5')
+                head = VideoHead.from_raw_file(self.input_file, default_block_size=1024, cipher_mode=cipher_mode)
+                with open(self.input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+                    write_encrypt_video(key, head, [video_info, duration_info], reader, writer,
+                                        default_block_size=1024, info_format=info_format)
+                stream = VideoStream(output_file, key)
+                stream.open()
+                info_reader = stream.video_info_reader
+
+                def decrypt_all(*args):
+                    raise AssertionError('decrypt whole video info')
+
+                info_reader.cipher.decrypt = decrypt_all
+                assert info_reader.get(b'name') == b'photo.webp'
+                assert info_reader.find_info(b'duration') == (1, b'12.5')
+                assert info_reader.get(b'meta299') == b'299'
+                assert info_reader.get(b'thumbnail') == thumbnail
+                assert info_reader.get(b'missing') is None
+                names = info_reader.names()
+                assert len(names) == 303 and names[0] == b'thumbnail' and names[-1] == b'duration'
+                pos, length = info_reader.get_entry_table(0)[b'thumbnail']
+                assert length == len(thumbnail)
+                assert info_reader.read_info_range(0, pos + 10, 5) == thumbnail[10:15]
+                stream.close()
+        os.remove(output_file)
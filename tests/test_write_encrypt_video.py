@@ -1,9 +1,15 @@
+import hashlib
+import io
 import os
+import shutil
 from io import BytesIO, FileIO
 from typing import List, Iterator
 from unittest import TestCase
 
-from gxbzys.video import VideoHead, write_encrypt_video, VideoStream, VideoInfo, VideoInfoIndex
+from gxbzys.video import VideoHead, write_encrypt_video, VideoStream, VideoInfo, VideoInfoIndex, VideoContentIndex, \
+    VideoBlockTable, verify_encrypt_video, INFO_FILE_DIGEST, CIPHER_MODE_GCM, GCM_TAG_LEN, HEAD_FILE_MARKER_V2, \
+    VideoDecryptException, decrypt_video
+from keymanager.encryptor import decrypt_data1
 from keymanager.utils import write_file, read_file
 
 
@@ -233,3 +239,360 @@ class TestWrite_encrypt_video(TestCase):
         assert new_video_info_index.length == video_info_index.length
         assert new_video_info_index.iv == video_info_index.iv
 
+
+    def test_readinto(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        raw_content = read_file(os.path.join(root, 'photo-1615529328331-f8917597711f.webp'))
+        enc_file = os.path.join(root, 'photo-1615529328331-f8917597711f.enc.webp')
+
+        stream = VideoStream(enc_file, key)
+        stream.open()
+        stream.seek(1000)
+        buffer = bytearray(3000)
+        assert stream.readinto(buffer) == 3000
+        assert bytes(buffer) == raw_content[1000:4000]
+        assert stream.tell() == 4000
+
+        stream.seek(len(raw_content) - 100)
+        assert stream.readinto(buffer) == 100
+        assert bytes(buffer[:100]) == raw_content[-100:]
+        assert stream.readinto(buffer) == 0
+        stream.close()
+
+    def test_raw_io(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        raw_content = read_file(os.path.join(root, 'photo-1615529328331-f8917597711f.webp'))
+        enc_file = os.path.join(root, 'photo-1615529328331-f8917597711f.enc.webp')
+
+        stream = VideoStream(enc_file, key)
+        # 没有打开时不能读取
+        with self.assertRaises(ValueError):
+            stream.read(10)
+        with self.assertRaises(ValueError):
+            stream.readinto(bytearray(10))
+        with stream:
+            assert stream.readable() and stream.seekable() and not stream.writable()
+            assert stream.seek(-100, io.SEEK_END) == len(raw_content) - 100
+            assert stream.read() == raw_content[-100:]
+            stream.seek(10)
+            assert stream.seek(20, io.SEEK_CUR) == 30
+            assert stream.read(5) == raw_content[30:35]
+            stream.seek(0)
+            view = stream.read_view(len(raw_content))
+            assert isinstance(view, memoryview) and 0 < len(view) < len(raw_content)
+            assert view == raw_content[:len(view)]
+            assert stream.read(10) == raw_content[len(view):len(view) + 10]
+            # read读到数据块末尾后接着read_view
+            block_size = stream.head.block_table.data_size[0]
+            stream.seek(0)
+            assert stream.read(block_size) == raw_content[:block_size]
+            view = stream.read_view(100)
+            assert len(view) == 100 and view == raw_content[block_size:block_size + 100]
+            assert stream.read(50) == raw_content[block_size + 100:block_size + 150]
+            stream.seek(block_size - 10)
+            assert stream.read_view(100) == raw_content[block_size - 10:block_size]
+            assert stream.read_view(10) == raw_content[block_size:block_size + 10]
+            stream.seek(len(raw_content))
+            assert len(stream.read_view(10)) == 0
+
+            stream.seek(0)
+            reader = io.BufferedReader(stream, buffer_size=3000)
+            assert reader.read(5000) == raw_content[:5000]
+            reader.seek(123)
+            assert reader.read() == raw_content[123:]
+            stream.seek(0)
+            bos = BytesIO()
+            shutil.copyfileobj(stream, bos)
+            assert bos.getvalue() == raw_content
+        assert stream.closed
+        with self.assertRaises(ValueError):
+            stream.read(10)
+        with self.assertRaises(ValueError):
+            stream.open()
+
+    def test_iter_blocks(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        output_file = './enc/iter_blocks.enc.webp'
+        raw_content = read_file(input_file)
+        head = VideoHead.from_raw_file(input_file, default_block_size=1024)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=1024)
+
+        stream = VideoStream(output_file, key)
+        stream.open()
+        stream.seek(100)
+        for workers, lookahead in [(1, None), (4, None), (4, 1)]:
+            blocks = list(stream.iter_blocks(workers=workers, lookahead=lookahead))
+            assert len(blocks) == len(stream.head.block_table)
+            assert b''.join(blocks) == raw_content
+        assert b''.join(stream.iter_blocks(1000, 5000, workers=4)) == raw_content[1000:5000]
+        assert b''.join(stream.iter_blocks(2048, 3072)) == raw_content[2048:3072]
+        assert list(stream.iter_blocks(len(raw_content))) == []
+        # 不改变读取位置
+        assert stream.read(10) == raw_content[100:110]
+        stream.close()
+
+        bos = BytesIO()
+        progress = []
+        size = decrypt_video(key, output_file, bos, start=1500, end=4500, workers=4,
+                             videodecrypthook=lambda i, n: progress.append((i, n)))
+        assert size == 3000 and bos.getvalue() == raw_content[1500:4500]
+        # 只解密范围涉及的4个数据块
+        assert progress == [(0, 4), (1, 4), (2, 4), (3, 4)]
+        bos = BytesIO()
+        assert decrypt_video(key, output_file, bos) == len(raw_content)
+        assert bos.getvalue() == raw_content
+        os.remove(output_file)
+
+    def test_block_table(self):
+        index_list = []
+        for i in range(100):
+            index_list.append(VideoContentIndex(os.urandom(16), 1024 + i, pow(2, 40) - 1 - i, 1024 * i, 1040 + i))
+        legacy_bytes = b''.join(vbi.to_bytes() for vbi in index_list)
+
+        table = VideoBlockTable.from_index_list(index_list)
+        assert table.to_bytes() == legacy_bytes
+
+        new_table = VideoBlockTable.from_bytes(legacy_bytes)
+        assert len(new_table) == 100
+        for i, vbi in enumerate(index_list):
+            assert new_table.iv[i] == vbi.iv
+            assert new_table.start_pos[i] == vbi.start_pos
+            assert new_table.raw_start_pos[i] == vbi.raw_start_pos
+            assert new_table.data_size[i] == vbi.data_size
+            assert new_table.block_size[i] == vbi.block_size
+
+        head = VideoHead()
+        head.block_index = index_list
+        head.block_index[3].data_size = 7
+        assert head.block_table.data_size[3] == 7
+        assert head.block_index[-1].iv == index_list[-1].iv
+        assert VideoHead.from_bytes(head.to_bytes()).block_index[3].data_size == 7
+
+    def test_lazy_head(self):
+        enc_file = './data/photo-1615529328331-f8917597711f.enc.webp'
+        with open(enc_file, 'rb') as reader:
+            head = VideoHead.from_bytes(VideoHead.get_head_block(reader))
+            lazy_head = VideoHead.from_file_lazy(reader)
+            assert lazy_head.head_size == head.head_size
+            assert lazy_head.raw_file_size == head.raw_file_size
+            assert len(lazy_head.video_info_index) == len(head.video_info_index)
+            assert len(lazy_head.block_table) == len(head.block_table)
+            for i in range(len(head.block_table)):
+                assert lazy_head.block_index[i].to_bytes() == head.block_index[i].to_bytes()
+            assert lazy_head.to_bytes() == head.to_bytes()
+            lazy_head.close()
+
+    def test_block_range(self):
+        table = VideoBlockTable()
+        raw_start_pos = 0
+        start_pos = 100
+        for data_size in [1000, 10, 3000, 1, 500]:
+            table.append(data_size=data_size, start_pos=start_pos, raw_start_pos=raw_start_pos,
+                         block_size=data_size + 16)
+            raw_start_pos += data_size
+            start_pos += data_size + 16
+
+        def brute_force(start, end):
+            return [i for i in range(len(table)) if start < end
+                    and table.raw_start_pos[i] < end and start < table.raw_start_pos[i] + table.data_size[i]]
+
+        for start in range(0, raw_start_pos + 20, 7):
+            assert table.find_block(start) == (brute_force(start, start + 1) + [len(table)])[0]
+            for end in range(start, raw_start_pos + 20, 13):
+                assert list(table.get_block_range(start, end)) == brute_force(start, end)
+
+        spans = list(table.get_block_spans(995, 1012))
+        assert [span.index for span in spans] == [0, 1, 2]
+        assert [(span.offset, span.length) for span in spans] == [(995, 5), (0, 10), (0, 2)]
+        assert spans[1].start_pos == 1116
+        assert spans[1].block_size == 26
+
+    def test_write_encrypt_video_parallel(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        raw_content = read_file(input_file)
+
+        heads = []
+        for workers, use_processes in [(1, False), (4, False), (2, True)]:
+            head = VideoHead.from_raw_file(input_file, default_block_size=1024)
+            writer = BytesIO()
+            hook_calls = []
+            with open(input_file, 'rb') as reader:
+                write_encrypt_video(key, head, [], reader, writer, default_block_size=1024,
+                                    videowritehook=lambda i, total: hook_calls.append(i),
+                                    workers=workers, use_processes=use_processes)
+            assert hook_calls == list(range(len(head.block_table)))
+            assert head.file_size == len(writer.getvalue())
+            for i in range(len(head.block_table)):
+                enc_data = writer.getvalue()[head.block_table.start_pos[i]:][:head.block_table.block_size[i]]
+                data = decrypt_data1(key, head.block_table.iv[i], head.block_table.data_size[i], enc_data)
+                raw_start_pos = head.block_table.raw_start_pos[i]
+                assert data == raw_content[raw_start_pos:raw_start_pos + len(data)]
+            heads.append(head)
+
+        for head in heads[1:]:
+            for name, _ in VideoBlockTable.int_columns:
+                assert getattr(head.block_table, name) == getattr(heads[0].block_table, name)
+
+    def test_verify_encrypt_video(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        output_file = './enc/digest.enc.webp'
+
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        head = VideoHead.from_raw_file(input_file, default_block_size=1024)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1024, workers=2,
+                                digest=True)
+        assert len(head.video_info_index) == 2
+
+        verified = []
+        assert verify_encrypt_video(key, output_file, workers=3, videoverifyhook=lambda i, n: verified.append(i))
+        assert verified == list(range(len(head.block_table)))
+
+        stream = VideoStream(output_file, key)
+        stream.open()
+        stream.video_info_reader.open()
+        info_list = list(stream.video_info_reader.read())
+        stream.close()
+        assert info_list[0].info[b'name'] == b'photo.webp'
+        assert info_list[1].info[INFO_FILE_DIGEST] == hashlib.sha256(read_file(input_file)).digest()
+
+        # 修改一个数据块
+        with open(output_file, 'r+b') as writer:
+            writer.seek(head.block_table.start_pos[10] + 5)
+            writer.write(b'\0' * 16)
+        assert not verify_encrypt_video(key, output_file, workers=3)
+        os.remove(output_file)
+
+    def test_gcm_stream(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        output_file = './enc/gcm.enc.webp'
+        raw_content = read_file(input_file)
+
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        head = VideoHead.from_raw_file(input_file, default_block_size=1024, cipher_mode=CIPHER_MODE_GCM)
+        head.extensions[0x7fff] = b'unknown'
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1024)
+        assert head.block_table.block_size[0] == 1024 + GCM_TAG_LEN
+
+        with open(output_file, 'rb') as reader:
+            head_bytes = VideoHead.get_head_block(reader)
+        assert head_bytes[:8] == HEAD_FILE_MARKER_V2
+        assert VideoHead.is_encrypt_video(output_file)
+        new_head = VideoHead.from_bytes(head_bytes)
+        assert new_head.cipher_mode == CIPHER_MODE_GCM
+        assert new_head.extensions == {0x7fff: b'unknown'}
+        assert new_head.block_table.to_bytes() == head.block_table.to_bytes()
+
+        for lazy_head in [True, False]:
+            stream = VideoStream(output_file, key, lazy_head=lazy_head)
+            stream.open()
+            assert stream.read(len(raw_content) + 10) == raw_content
+            # 随机读取少量数据，只解密需要的部分
+            for pos, length in [(5000, 7), (1020, 10), (17, 1), (len(raw_content) - 3, 20), (4096, 64)]:
+                stream.seek(pos)
+                assert stream.read(length) == raw_content[pos:pos + length]
+                assert stream.tell() == min(pos + length, len(raw_content))
+                # 接着读取剩余数据
+                assert stream.read(3000) == raw_content[pos + length:pos + length + 3000]
+            stream.video_info_reader.open()
+            assert list(stream.video_info_reader.read())[0].info[b'name'] == b'photo.webp'
+            stream.close()
+
+        # 修改一个数据块，整块解密时校验失败
+        with open(output_file, 'r+b') as writer:
+            writer.seek(head.block_table.start_pos[3] + 5)
+            writer.write(b'\0')
+        stream = VideoStream(output_file, key)
+        stream.open()
+        stream.seek(3 * 1024)
+        with self.assertRaises(VideoDecryptException):
+            stream.read(1024)
+        stream.close()
+        os.remove(output_file)
+
+    def test_partial_read_cbc(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        output_file = './enc/partial.enc.webp'
+        raw_content = read_file(input_file)
+
+        head = VideoHead.from_raw_file(input_file, default_block_size=4096)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [], reader, writer, default_block_size=4096)
+
+        stream = VideoStream(output_file, key)
+        stream.open()
+        for pos, length in [(5000, 7), (4090, 10), (17, 1), (0, 16), (32, 200), (len(raw_content) - 3, 20)]:
+            stream.seek(pos)
+            assert stream.read(length) == raw_content[pos:pos + length]
+            # 随机读取少量数据时不解密整个数据块
+            assert stream.block_data is None
+        assert stream.partial_read_ratio > 0
+        # 接着读取时解密整个数据块
+        stream.seek(100)
+        assert stream.read(10) == raw_content[100:110]
+        assert stream.read(5000) == raw_content[110:5110]
+        assert stream.block_data is not None
+        stream.close()
+        os.remove(output_file)
+
+    def test_compact_head(self):
+        root = r'./data/'
+        key = read_file(os.path.join(root, 'key.key'))
+        input_file = os.path.join(root, 'photo-1615529328331-f8917597711f.webp')
+        output_file = './enc/compact.enc.webp'
+        raw_content = read_file(input_file)
+
+        with self.assertRaises(ValueError):
+            VideoHead.from_raw_file(input_file, default_block_size=1024, compact=True)
+
+        video_info = VideoInfo()
+        video_info.add_info(b'name', b'photo.webp')
+        head = VideoHead.from_raw_file(input_file, default_block_size=1000, cipher_mode=CIPHER_MODE_GCM, compact=True)
+        with open(input_file, 'rb') as reader, open(output_file, 'wb') as writer:
+            write_encrypt_video(key, head, [video_info], reader, writer, default_block_size=1000, workers=2,
+                                digest=True)
+        # 文件头长度与数据块数量无关
+        assert len(head.block_table) > 10
+        assert head.head_size < 200
+        assert verify_encrypt_video(key, output_file, workers=2)
+
+        with open(output_file, 'rb') as reader:
+            new_head = VideoHead.from_bytes(VideoHead.get_head_block(reader))
+        table = new_head.block_table
+        assert len(table) == len(head.block_table)
+        for i in [0, 1, len(table) - 1]:
+            assert table.iv[i] == head.block_table.iv[i]
+            assert table.start_pos[i] == head.block_table.start_pos[i]
+            assert table.block_size[i] == table.data_size[i] + GCM_TAG_LEN
+        assert table.data_size[-1] == len(raw_content) - 1000 * (len(table) - 1)
+        assert table.find_block(999) == 0
+        assert table.find_block(1000) == 1
+        assert table.find_block(len(raw_content)) == len(table)
+        assert table.get_block_range(999, 2001) == range(0, 3)
+        assert table.get_block_range(len(raw_content) - 1, len(raw_content) + 100) == range(len(table) - 1, len(table))
+
+        for lazy_head in [True, False]:
+            stream = VideoStream(output_file, key, lazy_head=lazy_head)
+            stream.open()
+            assert stream.read(len(raw_content)) == raw_content
+            for pos, length in [(5000, 7), (999, 10), (len(raw_content) - 3, 20)]:
+                stream.seek(pos)
+                assert stream.read(length) == raw_content[pos:pos + length]
+            stream.close()
+        os.remove(output_file)
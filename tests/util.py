@@ -0,0 +1,67 @@
+"""
+测试和性能测试共用的函数，测试在tests目录中运行，使用相对路径
+"""
+import os
+from typing import List
+
+from gxbzys.video import VideoHead, VideoInfo, VideoStream, write_encrypt_video
+
+RAW_FILE = './data/photo-1615529328331-f8917597711f.webp'  #: 测试使用的原始文件
+INFO_NAME = b'photo.webp'  #: `create_video_info`中保存的文件名
+
+
+def create_video_info() -> VideoInfo:
+    """只包含文件名的视频信息"""
+    video_info = VideoInfo()
+    video_info.add_info(b'name', INFO_NAME)
+    return video_info
+
+
+def create_raw_file(raw_file: str, size: int) -> str:
+    """写入`size`字节的随机数据作为原始文件"""
+    with open(raw_file, 'wb') as writer:
+        writer.write(os.urandom(size))
+    return raw_file
+
+
+def create_encrypt_file(raw_file: str,
+                        enc_file: str,
+                        key: bytes,
+                        video_infos: List[VideoInfo] = None,
+                        head_args: dict = None,
+                        **kwargs) -> VideoHead:
+    """
+    使用`write_encrypt_video`加密原始文件
+    :param video_infos: 视频信息，为`None`时不写入
+    :param head_args: `VideoHead.from_raw_file`的参数
+    :param kwargs: `write_encrypt_video`的参数
+    :return 写入的文件头
+    """
+    head = VideoHead.from_raw_file(raw_file, **(head_args or {}))
+    with open(raw_file, 'rb') as reader, open(enc_file, 'wb') as writer:
+        write_encrypt_video(key, head, video_infos or [], reader, writer, **kwargs)
+    return head
+
+
+def read_encrypt_file(enc_file: str, key: bytes, **kwargs) -> bytes:
+    """
+    读取加密文件中的全部原始数据
+    :param kwargs: `VideoStream`的参数
+    """
+    stream = VideoStream(enc_file, key, **kwargs)
+    stream.open()
+    try:
+        return stream.read(stream.head.raw_file_size)
+    finally:
+        stream.close()
+
+
+def read_video_infos(enc_file: str, key: bytes) -> List[VideoInfo]:
+    """读取加密文件中的所有视频信息"""
+    stream = VideoStream(enc_file, key)
+    stream.open()
+    try:
+        stream.video_info_reader.open()
+        return list(stream.video_info_reader.read())
+    finally:
+        stream.close()